@@ -0,0 +1,163 @@
+"""
+Import-time regression benchmark for the agent container's cold start.
+
+Imports the production entry point (`wsgi` by default) in fresh interpreters
+with `python -X importtime` and reports, from the best of --repeat runs:
+
+    import_ms   cumulative import time of the module
+    top         its slowest direct imports (cumulative ms)
+    deferred    modules that must not be imported with the app (promptflow,
+                the Azure SDKs, NumPy); they are loaded on first use or by
+                the worker warm-up (wsgi.warm_up), so any hit is a regression
+
+The run fails (exit status 1) when a deferred module is imported, when
+import_ms exceeds --budget-ms, or, with --baseline, when import_ms grew by
+more than --max-regression over the baseline report.
+
+Usage:
+    python bench/bench_imports.py --repeat 5 --output bench/imports.json
+    python bench/bench_imports.py --baseline bench/imports.json --max-regression 0.2
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from run_bench import _parse_env  # noqa: E402
+
+AGENT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../estimation_agent"))
+DEFAULT_BUDGET_MS = 1000.0
+# Top-level names that only the flow runtime or specific requests need
+DEFERRED = ("promptflow", "openai", "httpx", "azure.search", "azure.identity", "numpy")
+
+# One line of -X importtime output: "import time: self | cumulative | <indent>name"
+Entry = Tuple[int, str, int]
+
+
+def parse_importtime(stderr: str) -> List[Entry]:
+    """(depth, module, cumulative microseconds) per imported module, in output order"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # Header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip(), int(fields[1])))
+    return entries
+
+
+def _children(entries: List[Entry], module: str) -> Tuple[int, List[Tuple[str, int]]]:
+    """Cumulative time of `module` and its direct imports (entries precede their parent)"""
+    children: List[Tuple[str, int]] = []
+    for depth, name, cumulative in entries:
+        if depth == 0:
+            if name == module:
+                return cumulative, children
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative))
+    raise ValueError(f"{module} not found in the importtime output")
+
+
+def _deferred(name: str) -> Optional[str]:
+    """The DEFERRED entry covering module `name`, if any"""
+    for prefix in DEFERRED:
+        if name == prefix or name.startswith(prefix + "."):
+            return prefix
+    return None
+
+
+def measure_once(module: str, env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Import `module` in a new interpreter and return its importtime breakdown"""
+    # A developer's PROMPTFLOW_TOOLS would load promptflow; only --env may set it
+    run_env = {k: v for k, v in os.environ.items() if k != "PROMPTFLOW_TOOLS"}
+    run_env.update(env or {})
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=AGENT_DIR, env=run_env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        tail = proc.stderr.strip().splitlines()[-1:] or ["no output"]
+        raise RuntimeError(f"import {module} failed: {tail[0]}")
+    entries = parse_importtime(proc.stderr)
+    cumulative, children = _children(entries, module)
+    return {
+        "import_ms": cumulative / 1000,
+        "children": children,
+        "deferred": sorted({_deferred(name) for _, name, _ in entries} - {None}),
+    }
+
+
+def run(module: str = "wsgi", repeat: int = 5, top: int = 10,
+        env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    # The first run may also write bytecode caches; it is kept but rarely the best
+    runs = [measure_once(module, env) for _ in range(max(1, repeat))]
+    best = min(runs, key=lambda r: r["import_ms"])
+    slowest = sorted(best["children"], key=lambda child: child[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "runs": len(runs),
+        "import_ms": round(best["import_ms"], 1),
+        "median_ms": round(statistics.median(r["import_ms"] for r in runs), 1),
+        "top": [{"module": name, "cumulative_ms": round(us / 1000, 1)} for name, us in slowest],
+        "deferred": sorted({name for r in runs for name in r["deferred"]}),
+    }
+
+
+def compare(report: Dict[str, Any], budget_ms: float,
+            baseline: Optional[Dict[str, Any]] = None,
+            max_regression: float = 0.2) -> List[str]:
+    """Descriptions of every regression (empty when the report passes)"""
+    problems = [f"{name} imported at startup" for name in report["deferred"]]
+    if report["import_ms"] > budget_ms:
+        problems.append(f"import {report['module']} {report['import_ms']}ms "
+                        f"> budget {budget_ms}ms")
+    if baseline:
+        limit = baseline["import_ms"] * (1 + max_regression)
+        if report["import_ms"] > limit:
+            problems.append(f"import {report['module']} {baseline['import_ms']}ms -> "
+                            f"{report['import_ms']}ms")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the app's import time")
+    parser.add_argument("--module", default="wsgi", help="Module to import (default: wsgi)")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=10, help="Slowest direct imports to list")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--baseline", help="Previous report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative growth of import_ms over the baseline")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Environment for the measured interpreters")
+    args = parser.parse_args(argv)
+
+    report = run(args.module, repeat=args.repeat, top=args.top, env=_parse_env(args.env))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    problems = compare(report, args.budget_ms, baseline, args.max_regression)
+    report["regressions"] = problems
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    for problem in problems:
+        print(f"REGRESSION: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
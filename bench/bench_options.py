@@ -0,0 +1,122 @@
+"""
+Micro-benchmark for option extraction (option_extractor.py).
+
+Times the previous regex implementation against OptionExtractor over the
+golden corpus of recorded replies (tests/golden/option_extraction.jsonl):
+
+    oneshot  extract the options of a complete reply (/score)
+    stream   feed the reply in --chunk-chars deltas and report options as
+             lines complete (/score/stream); the regex variant rescans the
+             lines completed by each delta, as the stream handler used to
+
+Results are microseconds per reply (best of --repeat runs). The outputs of
+both implementations are compared first, so a mismatch fails the run.
+
+Usage:
+    python bench/bench_options.py --number 2000 --chunk-chars 8
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../estimation_agent")))
+
+from option_extractor import OptionExtractor, extract_options  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "../tests/golden/option_extraction.jsonl")
+
+
+def legacy_extract_options(agent_response: str) -> List[Dict[str, str]]:
+    """The regex implementation option_extractor replaced (baseline)"""
+    options_bracket = re.findall(r'\[([^\]\n]+)\](?!\()', agent_response)
+    potential_list_items = re.findall(r'^\s*[-ー•*1-9][\.\)\s]+([^\n\[\]]+)', agent_response,
+                                      re.MULTILINE)
+    unique_options = []
+    seen = set()
+    for opt in options_bracket + potential_list_items:
+        clean_opt = re.sub(r'[\[\]\*]', '', opt).strip()
+        if ': ' in clean_opt:
+            clean_opt = clean_opt.split(': ')[0].strip()
+        if clean_opt and clean_opt not in seen and len(clean_opt) < 40:
+            if not clean_opt.startswith(('#', 'http://', 'https://')):
+                unique_options.append({"label": clean_opt, "value": clean_opt})
+                seen.add(clean_opt)
+    return unique_options
+
+
+def legacy_stream(deltas: List[str]) -> List[Dict[str, str]]:
+    pending_line = ""
+    seen = set()
+    reported = []
+    for delta in deltas:
+        pending_line += delta
+        *lines, pending_line = pending_line.split("\n")
+        for option in legacy_extract_options("\n".join(lines)):
+            if option["label"] not in seen:
+                seen.add(option["label"])
+                reported.append(option)
+    # The final payload re-scanned the whole reply
+    return legacy_extract_options("".join(deltas))
+
+
+def extractor_stream(deltas: List[str]) -> List[Dict[str, str]]:
+    extractor = OptionExtractor()
+    for delta in deltas:
+        extractor.feed(delta)
+    extractor.close()
+    return extractor.options()
+
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _time(fn: Callable[[], Any], number: int, repeat: int, replies: int) -> float:
+    best = min(timeit.repeat(fn, number=number, repeat=repeat))
+    return round(best / number / replies * 1e6, 2)
+
+
+def run(corpus: List[Dict[str, Any]], number: int = 1000, repeat: int = 5,
+        chunk_chars: int = 8) -> Dict[str, Any]:
+    texts = [case["response"] for case in corpus]
+    chunked = [[t[i:i + chunk_chars] for i in range(0, len(t), chunk_chars)] for t in texts]
+    for text, deltas in zip(texts, chunked):
+        expected = legacy_extract_options(text)
+        if extract_options(text) != expected or extractor_stream(deltas) != expected:
+            raise AssertionError(f"option mismatch: {text[:60]!r}")
+
+    report: Dict[str, Any] = {"replies": len(texts), "chunk_chars": chunk_chars}
+    for mode, legacy, current in (
+            ("oneshot", lambda: [legacy_extract_options(t) for t in texts],
+             lambda: [extract_options(t) for t in texts]),
+            ("stream", lambda: [legacy_stream(d) for d in chunked],
+             lambda: [extractor_stream(d) for d in chunked])):
+        legacy_us = _time(legacy, number, repeat, len(texts))
+        current_us = _time(current, number, repeat, len(texts))
+        report[mode] = {"regex_us": legacy_us, "extractor_us": current_us,
+                        "speedup": round(legacy_us / current_us, 2) if current_us else None}
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark option extraction")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--number", type=int, default=1000, help="Corpus passes per timing run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--chunk-chars", type=int, default=8,
+                        help="Delta size for the streaming mode")
+    args = parser.parse_args(argv)
+    report = run(load_corpus(args.corpus), number=args.number, repeat=args.repeat,
+                 chunk_chars=args.chunk_chars)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
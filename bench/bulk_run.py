@@ -0,0 +1,353 @@
+"""
+Bulk evaluation of recorded hearing sessions, fully offline.
+
+Replays every session of a JSONL file through the app (Flask test client,
+with the Azure OpenAI / AI Search / Calc API stubs from stubs.py) and
+streams the results as JSONL while sessions finish:
+
+    {"type": "turn", ...}     per turn: input, status, path (llm / early),
+                              latency_ms, the response timings and tokens
+    {"type": "session", ...}  per session: final estimate, diff, verdict
+    {"type": "summary", ...}  last line: counts, throughput, latency, tokens
+                              (throughput over the replay time of the slowest
+                              worker, excluding process startup and warmup)
+
+Sessions are spread over --processes worker processes (spawn; each runs its
+own app and stubs, so throughput grows with cores) and --threads concurrent
+sessions per process; --processes 0 runs them in this process. --rate caps
+the turns per second over all workers.
+
+The final estimate of a session (collected params and Calc result of its
+last calculation) is diffed against its snapshot with
+estimation_engine.diff_results: only keys present in the snapshot are
+compared. Verdicts are match, mismatch, no_estimate (a snapshot but no
+estimate) and no_snapshot. The exit status is 1 on errors, mismatches or
+missing estimates.
+
+Input lines:
+    {"name": ..., "turns": [user_input, ...], "snapshot": {"params": {...}, "result": {...}}}
+The snapshot is optional; --snapshots FILE (JSON object, name -> snapshot)
+overrides it, and --write-snapshots FILE writes the input sessions back with
+the estimates observed in this run (to record new goldens).
+
+Usage:
+    python bench/bulk_run.py --processes 4 --threads 8 --output bench/bulk-results.jsonl
+    python bench/bulk_run.py --repeat 50 --rate 200 --output -
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import IO, Any, Callable, Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../estimation_agent")))
+
+from run_bench import _parse_env, _reset_clients, summarize  # noqa: E402
+from stubs import start_stubs  # noqa: E402
+from estimation_engine import diff_results  # noqa: E402
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(__file__), "golden_sessions.jsonl")
+# Resends of a turn answered with 503 before the session is marked failed
+MAX_TURN_RETRIES = 3
+VERDICTS = ("match", "mismatch", "no_estimate", "no_snapshot")
+
+
+def load_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class RateLimiter:
+    """Spaces calls evenly at `rate` per second across threads (0 = unlimited)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def compare_snapshot(final: Optional[Dict[str, Any]],
+                     snapshot: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Verdict and differing paths of a final estimate against its snapshot"""
+    if not snapshot:
+        return {"verdict": "no_snapshot", "diff": []}
+    if final is None:
+        return {"verdict": "no_estimate", "diff": []}
+    diff = (diff_results(final.get("params"), snapshot.get("params") or {}, "params")
+            + diff_results(final.get("result"), snapshot.get("result") or {}, "result"))
+    return {"verdict": "mismatch" if diff else "match", "diff": diff}
+
+
+def play_session(agent_app: Any, recorded: Dict[str, Any],
+                 limiter: RateLimiter) -> List[Dict[str, Any]]:
+    """Replay one session; returns its turn records followed by the session record"""
+    name = recorded["name"]
+    client = agent_app.app.test_client()
+    session_id = None
+    lines: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    for index, user_input in enumerate(recorded["turns"]):
+        body = {"user_input": user_input}
+        if session_id:
+            body["session_id"] = session_id
+        for attempt in range(MAX_TURN_RETRIES + 1):
+            limiter.acquire()
+            started = time.perf_counter()
+            resp = client.post("/score", json=body)
+            latency_ms = (time.perf_counter() - started) * 1000
+            if resp.status_code != 503 or attempt == MAX_TURN_RETRIES:
+                break
+            time.sleep(float(resp.headers.get("Retry-After") or 1))
+        payload = resp.get_json(silent=True) or {}
+        usage = payload.get("usage") or {}
+        timings = payload.get("timings") or {}
+        lines.append({
+            "type": "turn", "session": name, "turn": index, "input": user_input,
+            "status": resp.status_code,
+            "path": "llm" if "llm_ms" in timings else "early",
+            "latency_ms": round(latency_ms, 2),
+            "timings": timings,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+        })
+        if resp.status_code != 200:
+            errors.append(f"turn {index}: HTTP {resp.status_code} {payload.get('error', '')}")
+            break
+        session_id = payload.get("session_id", session_id)
+
+    session = agent_app.sessions.get(session_id) if session_id else None
+    snapshot = session.estimation_snapshot if session is not None else None
+    final = ({"params": snapshot["params"], "result": snapshot["result"]}
+             if snapshot else None)
+    lines.append(dict({
+        "type": "session", "session": name, "turns": len(lines), "errors": errors,
+        "final": final,
+    }, **compare_snapshot(final, recorded.get("snapshot"))))
+    return lines
+
+
+def _worker(sessions: List[Dict[str, Any]], config: Dict[str, Any], out: Any) -> None:
+    """Start stubs and the app, replay `sessions` on `threads` threads, report to `out`"""
+    stubs = None
+    replay_seconds = 0.0
+    try:
+        stubs = start_stubs(llm_latency_ms=config["llm_latency_ms"],
+                            search_latency_ms=config["search_latency_ms"],
+                            calc_latency_ms=config["calc_latency_ms"])
+        os.environ.update(stubs.env)
+        os.environ.update(config["env"])
+        import app as agent_app
+
+        # The app may already be imported with other settings (inline runs, tests)
+        _reset_clients()
+        # Unreported replays: lazy imports, client pools and the compiled template
+        for session in sessions[:config["warmup"]]:
+            play_session(agent_app, session, RateLimiter(0))
+        limiter = RateLimiter(config["rate"])
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=config["threads"]) as pool:
+            futures = [pool.submit(play_session, agent_app, s, limiter) for s in sessions]
+            for future in as_completed(futures):
+                out.put(("lines", future.result()))
+        replay_seconds = time.perf_counter() - started
+    except Exception:
+        out.put(("failed", traceback.format_exc()))
+    finally:
+        counts = stubs.request_counts() if stubs is not None else {}
+        if stubs is not None:
+            stubs.stop()
+            _reset_clients()
+        out.put(("done", {"stub_requests": counts, "replay_seconds": replay_seconds}))
+
+
+def run(sessions: List[Dict[str, Any]], output: IO[str], processes: int = 0, threads: int = 4,
+        rate: float = 0.0, warmup: int = 1, llm_latency_ms: float = 0.0,
+        search_latency_ms: float = 0.0, calc_latency_ms: float = 0.0,
+        env: Optional[Dict[str, str]] = None,
+        on_session: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Replay sessions, stream JSONL records to `output`, return the summary record.
+    on_session is called with every session record (e.g. to collect estimates).
+    """
+    workers = max(1, processes)
+    config = {
+        "threads": threads,
+        "rate": rate / workers,
+        "warmup": warmup,
+        "llm_latency_ms": llm_latency_ms,
+        "search_latency_ms": search_latency_ms,
+        "calc_latency_ms": calc_latency_ms,
+        "env": env or {},
+    }
+    shards = [sessions[i::workers] for i in range(workers)]
+    started = time.perf_counter()
+    if processes:
+        context = multiprocessing.get_context("spawn")
+        out = context.Queue()
+        handles = [context.Process(target=_worker, args=(shard, config, out)) for shard in shards]
+    else:
+        out = queue.Queue()
+        # The worker points this process's environment at its stubs
+        previous_env = dict(os.environ)
+        handles = [threading.Thread(target=_worker, args=(shards[0], config, out))]
+    for handle in handles:
+        handle.start()
+
+    latencies: List[float] = []
+    paths = {"llm": 0, "early": 0}
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+    verdicts = dict.fromkeys(VERDICTS, 0)
+    stub_requests: Dict[str, int] = {}
+    failures: List[str] = []
+    errors = 0
+    turns = 0
+    finished = 0
+    # Longest worker replay, excluding process startup and warmup
+    replay_seconds = 0.0
+    while finished < len(handles):
+        kind, payload = out.get()
+        if kind == "done":
+            finished += 1
+            replay_seconds = max(replay_seconds, payload["replay_seconds"])
+            for name, count in payload["stub_requests"].items():
+                stub_requests[name] = stub_requests.get(name, 0) + count
+            continue
+        if kind == "failed":
+            failures.append(payload)
+            continue
+        for line in payload:
+            output.write(json.dumps(line, ensure_ascii=False) + "\n")
+            if line["type"] == "turn":
+                turns += 1
+                latencies.append(line["latency_ms"])
+                paths[line["path"]] += 1
+                for key in tokens:
+                    tokens[key] += line[key]
+            else:
+                verdicts[line["verdict"]] += 1
+                errors += bool(line["errors"])
+                if on_session is not None:
+                    on_session(line)
+        output.flush()
+    for handle in handles:
+        handle.join()
+    if not processes:
+        os.environ.clear()
+        os.environ.update(previous_env)
+    wall_seconds = time.perf_counter() - started
+
+    summary = {
+        "type": "summary",
+        "config": dict(config, processes=processes, rate=rate),
+        "sessions": sum(verdicts.values()),
+        "turns": turns,
+        "errors": errors,
+        "worker_failures": failures,
+        "verdicts": verdicts,
+        "paths": paths,
+        "tokens": tokens,
+        "latency_ms": summarize(latencies),
+        "wall_seconds": round(wall_seconds, 3),
+        "replay_seconds": round(replay_seconds, 3),
+        "turns_per_second": round(turns / replay_seconds, 2) if replay_seconds else 0.0,
+        "stub_requests": stub_requests,
+    }
+    output.write(json.dumps(summary, ensure_ascii=False) + "\n")
+    output.flush()
+    return summary
+
+
+def _open_output(path: str) -> IO[str]:
+    return sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded sessions against local stubs")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help="JSONL of recorded sessions")
+    parser.add_argument("--output", default="-", help="JSONL results (default: stdout)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (0 = run in this process)")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="Concurrent sessions per process")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Maximum turns per second over all workers (0 = unlimited)")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="Sessions each worker replays unreported before measuring")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Replay the input this many times (names get a #n suffix)")
+    parser.add_argument("--snapshots", help="JSON object of session name -> expected snapshot")
+    parser.add_argument("--write-snapshots", metavar="FILE",
+                        help="Write the sessions with the estimates of this run as JSONL")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--search-latency-ms", type=float, default=0.0)
+    parser.add_argument("--calc-latency-ms", type=float, default=0.0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra app environment (e.g. HEARING_FAST_PATH=false)")
+    args = parser.parse_args(argv)
+
+    recorded = load_jsonl(args.input)
+    if args.snapshots:
+        with open(args.snapshots, "r", encoding="utf-8") as f:
+            snapshots = json.load(f)
+        for session in recorded:
+            if session["name"] in snapshots:
+                session["snapshot"] = snapshots[session["name"]]
+    sessions = recorded if args.repeat <= 1 else [
+        dict(session, name=f"{session['name']}#{n}")
+        for n in range(args.repeat) for session in recorded]
+
+    # Estimates observed in this run, by recorded session name (for --write-snapshots)
+    finals: Dict[str, Any] = {}
+
+    def keep_final(record: Dict[str, Any]) -> None:
+        if record["final"]:
+            finals[record["session"].split("#")[0]] = record["final"]
+
+    output = _open_output(args.output)
+    try:
+        summary = run(sessions, output, processes=args.processes, threads=args.threads,
+                      rate=args.rate, warmup=args.warmup, llm_latency_ms=args.llm_latency_ms,
+                      search_latency_ms=args.search_latency_ms,
+                      calc_latency_ms=args.calc_latency_ms, env=_parse_env(args.env),
+                      on_session=keep_final)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.write_snapshots:
+        with open(args.write_snapshots, "w", encoding="utf-8") as f:
+            for session in recorded:
+                final = finals.get(session["name"])
+                record = dict(session, snapshot=final) if final else session
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    if args.output != "-":
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    for failure in summary["worker_failures"]:
+        print(f"WORKER FAILED: {failure}", file=sys.stderr)
+    verdicts = summary["verdicts"]
+    failed = (summary["errors"] or summary["worker_failures"]
+              or verdicts["mismatch"] or verdicts["no_estimate"])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,508 @@
+"""
+Load test for /score (or /score/stream) against local service stubs.
+
+Starts the Flask app on an ephemeral port together with the stubs in
+stubs.py, replays the recorded hearing sessions in bench/sessions/ at the
+requested concurrency and writes a JSON report:
+
+    summary  throughput (turns/s, sessions/s), error count, wall time
+    stages   count / mean / p50 / p95 / p99 / max per stage in milliseconds,
+             from the `timings` of each response plus client-side latency
+    memory   serialized size of the replayed sessions and tracemalloc growth
+             per session with --trace-memory (in-process server), or resident
+             memory growth per session of the gunicorn processes
+
+With --baseline, p95 latencies and throughput are compared against an
+earlier report and the exit status is 1 if any regressed by more than
+--max-regression.
+
+The app is served either by werkzeug's threaded server inside this process
+(--server werkzeug, default) or by the production entry point, gunicorn with
+gunicorn.conf.py, in a subprocess (--server gunicorn).
+
+Usage:
+    python bench/run_bench.py --concurrency 8 --sessions 40 --output bench/results.json
+    python bench/run_bench.py --server gunicorn --concurrency 8 --sessions 40
+    python bench/run_bench.py --stream --llm-token-delay-ms 20 --baseline bench/results.json
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../estimation_agent")))
+
+from stubs import start_stubs  # noqa: E402
+
+REPORT_VERSION = 1
+DEFAULT_SESSIONS_DIR = os.path.join(os.path.dirname(__file__), "sessions")
+AGENT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../estimation_agent"))
+# Resends of a turn answered with 503 before the virtual user gives up
+MAX_TURN_RETRIES = 3
+# p95 changes below this many milliseconds are treated as noise
+MIN_REGRESSION_MS = 1.0
+
+
+def load_sessions(directory: str = DEFAULT_SESSIONS_DIR) -> List[Dict[str, Any]]:
+    """Recorded sessions: {"name", "turns": [user_input, ...]} per JSON file"""
+    sessions = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            sessions.append(json.load(f))
+    if not sessions:
+        raise ValueError(f"No recorded sessions found in {directory}")
+    return sessions
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 2) if values else 0.0,
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2) if values else 0.0,
+    }
+
+
+class Rejected(Exception):
+    """The app answered 503 (LLM gateway saturated)"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"503, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _check_status(resp: requests.Response) -> None:
+    if resp.status_code == 503:
+        raise Rejected(float(resp.headers.get("Retry-After") or 1))
+    resp.raise_for_status()
+
+
+def _post(http: requests.Session, url: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    resp = http.post(url, json=body, timeout=120)
+    _check_status(resp)
+    return resp.json()
+
+
+def _post_stream(http: requests.Session, url: str, body: Dict[str, Any],
+                 started: float) -> Dict[str, Any]:
+    """POST to /score/stream and return the done payload (+ client first_token_ms)"""
+    first_token_ms = None
+    event = None
+    with http.post(url, json=body, stream=True, timeout=120) as resp:
+        _check_status(resp)
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if event == "token" and first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+            elif line.startswith("data: ") and event in ("done", "error"):
+                payload = json.loads(line[len("data: "):])
+                if event == "error":
+                    raise RuntimeError(payload.get("error"))
+                if first_token_ms is not None:
+                    payload["first_token_ms"] = first_token_ms
+                return payload
+    raise RuntimeError("Stream ended without a done event")
+
+
+def replay_session(base_url: str, recorded: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+    """
+    Play one recorded session turn by turn; returns per-turn samples.
+
+    A 503 is retried after its Retry-After (up to MAX_TURN_RETRIES times), as
+    the frontend would; each one is counted in `rejected`.
+    """
+    url = f"{base_url}/score/stream" if stream else f"{base_url}/score"
+    session_id = None
+    turns = []
+    errors = []
+    rejected = 0
+    # One keep-alive connection per virtual user, closed when the session ends
+    with requests.Session() as http:
+        for user_input in recorded["turns"]:
+            body = {"user_input": user_input}
+            if session_id:
+                body["session_id"] = session_id
+            payload = None
+            for attempt in range(MAX_TURN_RETRIES + 1):
+                started = time.perf_counter()
+                try:
+                    if stream:
+                        payload = _post_stream(http, url, body, started)
+                    else:
+                        payload = _post(http, url, body)
+                    break
+                except Rejected as e:
+                    rejected += 1
+                    if attempt == MAX_TURN_RETRIES:
+                        errors.append(f"{recorded['name']}: still rejected after {attempt} retries")
+                    else:
+                        time.sleep(e.retry_after)
+                except Exception as e:
+                    errors.append(f"{recorded['name']}: {e}")
+                    break
+            if payload is None:
+                break
+            client_ms = (time.perf_counter() - started) * 1000
+            session_id = payload.get("session_id", session_id)
+            sample = dict(payload.get("timings") or {}, client_ms=client_ms)
+            if "first_token_ms" in payload:
+                sample["first_token_ms"] = payload["first_token_ms"]
+            turns.append(sample)
+    return {"name": recorded["name"], "session_id": session_id, "turns": turns,
+            "errors": errors, "rejected": rejected}
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _reset_clients() -> None:
+    import call_calc_tool
+    import llm_gateway
+    import lookup_knowledge
+    import openai_client
+
+    openai_client.reset_openai_client()
+    llm_gateway.reset_gateway()
+    call_calc_tool.reset_calc_client()
+    lookup_knowledge.invalidate_retrieval_cache()
+
+
+class InProcessServer:
+    """The app on werkzeug's threaded server inside the benchmark process"""
+
+    name = "werkzeug"
+
+    def __init__(self):
+        import app as agent_app
+
+        # The app may already be imported with other settings (tests, earlier runs)
+        _reset_clients()
+        self._app = agent_app
+        self._server = make_server("127.0.0.1", 0, agent_app.app, threaded=True,
+                                   request_handler=_QuietHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def session_bytes(self, session_ids: List[str]) -> List[int]:
+        sizes = []
+        for session_id in session_ids:
+            session = self._app.sessions.get(session_id)
+            if session is not None:
+                sizes.append(len(json.dumps(session.to_dict(), ensure_ascii=False).encode("utf-8")))
+        return sizes
+
+    def rss_bytes(self) -> Optional[int]:
+        # Shared with the client and the stubs, so not attributable to the app
+        return None
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class GunicornServer:
+    """The production entry point (gunicorn.conf.py, wsgi:app) as a subprocess"""
+
+    name = "gunicorn"
+
+    def __init__(self, startup_timeout: float = 30.0):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app",
+             "--bind", f"127.0.0.1:{port}"],
+            cwd=AGENT_DIR, env=dict(os.environ, GUNICORN_ACCESS_LOG=""),
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        deadline = time.monotonic() + startup_timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                stderr = self._process.stderr.read().decode(errors="replace")
+                raise RuntimeError(f"gunicorn exited during startup: {stderr[-2000:]}")
+            try:
+                if requests.get(f"{self.base_url}/health", timeout=1).ok:
+                    return
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("gunicorn did not become healthy in time")
+
+    def session_bytes(self, session_ids: List[str]) -> List[int]:
+        return []
+
+    def rss_bytes(self) -> Optional[int]:
+        """Resident memory of the master and its workers (Linux /proc only)"""
+        pids = [self._process.pid] + _children(self._process.pid)
+        sizes = [_rss(pid) for pid in pids]
+        return sum(sizes) if all(size is not None for size in sizes) else None
+
+    def stop(self) -> None:
+        # SIGTERM: graceful shutdown, as in a container stop
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process.stderr.close()
+
+
+SERVERS = {"werkzeug": InProcessServer, "gunicorn": GunicornServer}
+
+
+def _children(pid: int) -> List[int]:
+    children = []
+    for stat in glob.glob("/proc/[0-9]*/stat"):
+        try:
+            with open(stat, "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(stat.split("/")[2]))
+    return children
+
+
+def _rss(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def run(concurrency: int = 4, sessions: int = 20, sessions_dir: str = DEFAULT_SESSIONS_DIR,
+        stream: bool = False, llm_latency_ms: float = 100.0, llm_token_delay_ms: float = 10.0,
+        llm_chunk_chars: int = 8, search_latency_ms: float = 20.0, calc_latency_ms: float = 20.0,
+        llm_rpm_limit: int = 0, llm_retry_after_ms: float = 1000.0,
+        trace_memory: bool = False, warmup: int = 1, server: str = "werkzeug",
+        env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Start stubs and the app server, replay `sessions` recorded sessions, return the report"""
+    recorded = load_sessions(sessions_dir)
+    stubs = start_stubs(llm_latency_ms, llm_token_delay_ms, llm_chunk_chars,
+                        search_latency_ms, calc_latency_ms, llm_rpm_limit, llm_retry_after_ms)
+    overrides = dict(stubs.env, **(env or {}))
+    previous_env = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    app_server = None
+    try:
+        app_server = SERVERS[server]()
+        base_url = app_server.base_url
+
+        # Warm up lazy imports, pooled connections and the compiled template
+        for session in recorded[:warmup]:
+            replay_session(base_url, session, stream)
+
+        if trace_memory:
+            tracemalloc.start()
+        traced_before = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+        rss_before = app_server.rss_bytes()
+
+        plan = [recorded[i % len(recorded)] for i in range(sessions)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda r: replay_session(base_url, r, stream), plan))
+        wall_seconds = time.perf_counter() - started
+
+        traced_growth = None
+        if trace_memory:
+            traced_growth = tracemalloc.get_traced_memory()[0] - traced_before
+            tracemalloc.stop()
+        rss_after = app_server.rss_bytes()
+        rss_growth = rss_after - rss_before if rss_before is not None and rss_after else None
+
+        sizes = app_server.session_bytes([r["session_id"] for r in results if r["session_id"]])
+    finally:
+        if app_server is not None:
+            app_server.stop()
+        stubs.stop()
+        for key, value in previous_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        # Do not leave clients (or cached passages) pointing at the stopped stubs
+        _reset_clients()
+
+    samples: Dict[str, List[float]] = {}
+    paths = {"llm": 0, "early": 0}
+    for result in results:
+        for turn in result["turns"]:
+            paths["llm" if "llm_ms" in turn else "early"] += 1
+            for name, value in turn.items():
+                samples.setdefault(name, []).append(value)
+    turns = sum(len(r["turns"]) for r in results)
+    errors = [e for r in results for e in r["errors"]]
+
+    return {
+        "version": REPORT_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "server": server,
+            "endpoint": "/score/stream" if stream else "/score",
+            "concurrency": concurrency,
+            "sessions": sessions,
+            "recorded_sessions": [r["name"] for r in recorded],
+            "llm_latency_ms": llm_latency_ms,
+            "llm_token_delay_ms": llm_token_delay_ms,
+            "llm_chunk_chars": llm_chunk_chars,
+            "llm_rpm_limit": llm_rpm_limit,
+            "llm_retry_after_ms": llm_retry_after_ms,
+            "search_latency_ms": search_latency_ms,
+            "calc_latency_ms": calc_latency_ms,
+            "warmup": warmup,
+            "env": env or {},
+        },
+        "summary": {
+            "sessions": sessions,
+            "turns": turns,
+            "errors": len(errors),
+            "rejected": sum(r["rejected"] for r in results),
+            "wall_seconds": round(wall_seconds, 3),
+            "turns_per_second": round(turns / wall_seconds, 2) if wall_seconds else 0.0,
+            "sessions_per_second": round(sessions / wall_seconds, 2) if wall_seconds else 0.0,
+        },
+        "paths": paths,
+        "stages": {name: summarize(values) for name, values in sorted(samples.items())},
+        "memory": {
+            "sessions_measured": len(sizes),
+            "session_bytes_mean": round(sum(sizes) / len(sizes), 1) if sizes else 0.0,
+            "session_bytes_max": max(sizes) if sizes else 0,
+            "traced_bytes_per_session": (round(traced_growth / sessions, 1)
+                                         if traced_growth is not None and sessions else None),
+            "rss_bytes": rss_after,
+            "rss_bytes_per_session": (round(rss_growth / sessions, 1)
+                                      if rss_growth is not None and sessions else None),
+        },
+        "stub_requests": stubs.request_counts(),
+        "error_samples": errors[:10],
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any],
+            max_regression: float = 0.2) -> List[str]:
+    """Regressions of `report` against `baseline` (p95 per stage, throughput)"""
+    regressions = []
+    for name, current in report["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not before:
+            continue
+        delta = current["p95"] - before["p95"]
+        if delta > MIN_REGRESSION_MS and current["p95"] > before["p95"] * (1 + max_regression):
+            regressions.append(f"{name} p95 {before['p95']}ms -> {current['p95']}ms")
+    before_tps = baseline.get("summary", {}).get("turns_per_second") or 0.0
+    current_tps = report["summary"]["turns_per_second"]
+    if before_tps and current_tps < before_tps * (1 - max_regression):
+        regressions.append(f"throughput {before_tps} -> {current_tps} turns/s")
+    if report["summary"]["errors"] > baseline.get("summary", {}).get("errors", 0):
+        regressions.append(f"errors {baseline['summary'].get('errors', 0)} -> "
+                           f"{report['summary']['errors']}")
+    return regressions
+
+
+def _parse_env(pairs: List[str]) -> Dict[str, str]:
+    env = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"--env expects KEY=VALUE, got {pair!r}")
+        env[key] = value
+    return env
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark /score against local service stubs")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent virtual users")
+    parser.add_argument("--sessions", type=int, default=20,
+                        help="Recorded sessions to replay in total")
+    parser.add_argument("--sessions-dir", default=DEFAULT_SESSIONS_DIR)
+    parser.add_argument("--server", choices=sorted(SERVERS), default="werkzeug",
+                        help="werkzeug: threaded dev server in-process; "
+                             "gunicorn: production entry point (gunicorn.conf.py) in a subprocess")
+    parser.add_argument("--stream", action="store_true", help="Use /score/stream (SSE)")
+    parser.add_argument("--llm-latency-ms", type=float, default=100.0,
+                        help="Stub time to first token")
+    parser.add_argument("--llm-token-delay-ms", type=float, default=10.0,
+                        help="Stub delay between streamed chunks")
+    parser.add_argument("--llm-chunk-chars", type=int, default=8,
+                        help="Characters per streamed chunk")
+    parser.add_argument("--llm-rpm-limit", type=int, default=0,
+                        help="Stub quota: answer 429 beyond RPM/6 requests per 10 s (0 = off)")
+    parser.add_argument("--llm-retry-after-ms", type=float, default=1000.0,
+                        help="Retry-After sent with stub 429 responses")
+    parser.add_argument("--search-latency-ms", type=float, default=20.0)
+    parser.add_argument("--calc-latency-ms", type=float, default=20.0)
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="Recorded sessions replayed before measuring (default 1)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Measure allocation growth per session with tracemalloc (slower)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra app environment (e.g. RAG_CACHE_BACKEND=none)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative p95/throughput regression (default 0.2)")
+    args = parser.parse_args(argv)
+
+    report = run(
+        concurrency=args.concurrency, sessions=args.sessions, sessions_dir=args.sessions_dir,
+        stream=args.stream, llm_latency_ms=args.llm_latency_ms,
+        llm_token_delay_ms=args.llm_token_delay_ms, llm_chunk_chars=args.llm_chunk_chars,
+        search_latency_ms=args.search_latency_ms, calc_latency_ms=args.calc_latency_ms,
+        llm_rpm_limit=args.llm_rpm_limit, llm_retry_after_ms=args.llm_retry_after_ms,
+        trace_memory=args.trace_memory, warmup=args.warmup, server=args.server,
+        env=_parse_env(args.env)
+    )
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+    status = 1 if report["summary"]["errors"] else 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION: {line}", file=sys.stderr)
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
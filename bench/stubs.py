@@ -0,0 +1,323 @@
+"""
+Local stand-ins for the services /score depends on.
+
+Each stub is a ThreadingHTTPServer on 127.0.0.1 (ephemeral port) that speaks
+just enough of the real wire format for the production clients:
+
+    StubOpenAIServer  Azure OpenAI chat completions (JSON and SSE streaming),
+                      with a configurable time to first token and per-chunk delay,
+                      and 429 responses (scripted or from an RPM quota)
+    StubSearchServer  Azure AI Search `docs/search` queries over a fixed corpus
+    StubCalcServer    Calc API, answered by the in-process estimation engine
+
+`start_stubs` launches all three and returns the environment variables that
+point the app at them.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../estimation_agent")))
+
+import estimation_engine  # noqa: E402
+from history_manager import PROPOSAL_HEADER  # noqa: E402
+
+HEARING_REPLY = (
+    "承知しました。見積もり手法を選択してください。\n"
+    "[画面数法] [STEP法] [FP法]"
+)
+
+PROPOSAL_REPLY = (
+    PROPOSAL_HEADER + "\n\n"
+    "## 1. 概要\n"
+    "ヒアリング内容と算出結果に基づく概算見積もりです。\n\n"
+    "## 2. 見積もり金額\n"
+    "| 項目 | 金額 |\n|---|---|\n"
+    "| 開発 | 算出結果を参照 |\n| 設計・デザイン | 算出結果を参照 |\n\n"
+    "## 3. 前提条件\n"
+    "- 要件の確定度に応じて金額は変動します。\n"
+)
+
+SEARCH_DOCUMENTS = [
+    {
+        "id": "price-list-0",
+        "source": "01_price_list.md",
+        "heading_path": "料金表 > 開発単価",
+        "content": "開発単価は1人日あたり50,000円。設計フェーズは別途見積もり。",
+    },
+    {
+        "id": "case-studies-0",
+        "source": "02_case_studies.md",
+        "heading_path": "事例 > ECサイト構築",
+        "content": "ECサイト構築（30画面、決済・会員機能）は開発3ヶ月、約1,200万円。",
+    },
+    {
+        "id": "design-0",
+        "source": "03_design_guidelines.md",
+        "heading_path": "デザイン > UIデザイン",
+        "content": "UIデザインとデザインシステム構築は画面数に応じて工数を算出する。",
+    },
+]
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.requests = 0
+        self._count_lock = threading.Lock()
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients that time out or cancel a stream hang up mid-response; that is expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def count(self) -> None:
+        with self._count_lock:
+            self.requests += 1
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self) -> "_StubServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, payload: Any, status: int = 200) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubOpenAIServer(_StubServer):
+    """
+    Chat completions stub.
+
+    latency_ms is the delay before the first token; token_delay_ms is slept
+    between streamed chunks of chunk_chars characters. Turns that carry a calc
+    result get a proposal document, every other turn a hearing question.
+
+    Rate limiting like Azure OpenAI: `statuses` are returned first (one per
+    request, e.g. [429, 429]), and with rpm_limit > 0 requests beyond
+    rpm_limit / 6 per 10-second window get a 429. Both carry retry_after_ms
+    as `retry-after-ms` / `retry-after` headers.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, token_delay_ms: float = 0.0,
+                 chunk_chars: int = 8, rpm_limit: int = 0, retry_after_ms: float = 1000.0):
+        super().__init__(_OpenAIHandler)
+        self.latency_ms = latency_ms
+        self.token_delay_ms = token_delay_ms
+        self.chunk_chars = chunk_chars
+        self.rpm_limit = rpm_limit
+        self.retry_after_ms = retry_after_ms
+        self.statuses: List[int] = []
+        self.throttled = 0
+        self._window: List[float] = []
+
+    def next_status(self) -> int:
+        """Status for the next request (scripted statuses, then the RPM window)"""
+        with self._count_lock:
+            if self.statuses:
+                status = self.statuses.pop(0)
+            elif self.rpm_limit > 0:
+                now = time.monotonic()
+                self._window = [t for t in self._window if now - t < 10.0]
+                status = 429 if len(self._window) >= max(1, self.rpm_limit // 6) else 200
+                if status == 200:
+                    self._window.append(now)
+            else:
+                status = 200
+            if status == 429:
+                self.throttled += 1
+            return status
+
+    @staticmethod
+    def reply_for(messages: List[Dict[str, Any]]) -> str:
+        prompt = "\n".join(str(m.get("content") or "") for m in messages if m.get("role") == "user")
+        return PROPOSAL_REPLY if "estimated_amount" in prompt else HEARING_REPLY
+
+
+class _OpenAIHandler(_JSONHandler):
+    def do_POST(self):
+        server = self.server
+        server.count()
+        request = self.read_json()
+        status = server.next_status()
+        if status != 200:
+            self._send_error(status, server.retry_after_ms)
+            return
+        reply = server.reply_for(request.get("messages", []))
+        prompt_chars = sum(len(str(m.get("content") or "")) for m in request.get("messages", []))
+        usage = {"prompt_tokens": prompt_chars // 2, "completion_tokens": len(reply) // 2}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        time.sleep(server.latency_ms / 1000)
+
+        if not request.get("stream"):
+            self.send_json({
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": reply}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = max(1, server.chunk_chars)
+        for start in range(0, len(reply), step):
+            if start:
+                time.sleep(server.token_delay_ms / 1000)
+            self._event(self._chunk({"content": reply[start:start + step]}, request))
+        self._event(self._chunk({}, request, finish_reason="stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._event(dict(self._chunk({}, request), choices=[], usage=usage))
+        self._write(b"data: [DONE]\n\n")
+        self._write(b"")
+
+    def _send_error(self, status: int, retry_after_ms: float) -> None:
+        message = ("Requests to the ChatCompletions_Create Operation have exceeded the rate limit."
+                   if status == 429 else "The server had an error while processing your request.")
+        body = json.dumps({"error": {"code": str(status), "message": message}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("retry-after-ms", str(int(retry_after_ms)))
+            self.send_header("retry-after", str(max(1, int(retry_after_ms / 1000))))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _chunk(delta: Dict[str, Any], request: Dict[str, Any],
+               finish_reason: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    def _event(self, payload: Dict[str, Any]) -> None:
+        self._write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _write(self, data: bytes) -> None:
+        # HTTP/1.1 chunked framing; an empty chunk ends the body
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StubSearchServer(_StubServer):
+    """Azure AI Search stub: every query returns the fixed corpus (top N)"""
+
+    def __init__(self, latency_ms: float = 0.0, documents: Optional[List[Dict[str, Any]]] = None):
+        super().__init__(_SearchHandler)
+        self.latency_ms = latency_ms
+        self.documents = documents if documents is not None else SEARCH_DOCUMENTS
+
+
+class _SearchHandler(_JSONHandler):
+    def do_POST(self):
+        server = self.server
+        server.count()
+        request = self.read_json()
+        time.sleep(server.latency_ms / 1000)
+        hits = server.documents[:int(request.get("top") or 50)]
+        self.send_json({
+            "@odata.count": len(hits),
+            "value": [dict(doc, **{"@search.score": 1.0 / (rank + 1)})
+                      for rank, doc in enumerate(hits)],
+        })
+
+
+class StubCalcServer(_StubServer):
+    """Calc API stub backed by estimation_engine (same response shape as the Function)"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        super().__init__(_CalcHandler)
+        self.latency_ms = latency_ms
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/api/calculate_estimate"
+
+
+class _CalcHandler(_JSONHandler):
+    def do_POST(self):
+        server = self.server
+        server.count()
+        payload = self.read_json()
+        time.sleep(server.latency_ms / 1000)
+        result = estimation_engine.estimate(payload)
+        self.send_json(result, status=400 if result.get("status") == "error" else 200)
+
+
+class Stubs:
+    """The three running stubs plus the environment that targets them"""
+
+    def __init__(self, openai: StubOpenAIServer, search: StubSearchServer, calc: StubCalcServer):
+        self.openai = openai
+        self.search = search
+        self.calc = calc
+
+    @property
+    def env(self) -> Dict[str, str]:
+        return {
+            "AZURE_OPENAI_ENDPOINT": self.openai.base_url,
+            "AZURE_OPENAI_API_KEY": "bench",
+            "AZURE_OPENAI_MAX_RETRIES": "0",
+            "AZURE_AI_SEARCH_ENDPOINT": self.search.base_url,
+            "AZURE_AI_SEARCH_API_KEY": "bench",
+            "RAG_BACKEND": "azure",
+            "CALC_API_ENDPOINT": self.calc.url,
+            "CALC_ENGINE": "remote",
+        }
+
+    def request_counts(self) -> Dict[str, int]:
+        return {"openai": self.openai.requests, "openai_429": self.openai.throttled,
+                "search": self.search.requests, "calc": self.calc.requests}
+
+    def stop(self) -> None:
+        for server in (self.openai, self.search, self.calc):
+            server.shutdown()
+            server.server_close()
+
+
+def start_stubs(llm_latency_ms: float = 0.0, llm_token_delay_ms: float = 0.0,
+                llm_chunk_chars: int = 8, search_latency_ms: float = 0.0,
+                calc_latency_ms: float = 0.0, llm_rpm_limit: int = 0,
+                llm_retry_after_ms: float = 1000.0) -> Stubs:
+    return Stubs(
+        StubOpenAIServer(llm_latency_ms, llm_token_delay_ms, llm_chunk_chars,
+                         llm_rpm_limit, llm_retry_after_ms).start(),
+        StubSearchServer(search_latency_ms).start(),
+        StubCalcServer(calc_latency_ms).start(),
+    )
@@ -3,17 +3,32 @@ Flask wrapper for Prompt Flow Agent - V2 Conversational Chat
 Provides REST API endpoints for the estimation agent with conversation management
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import logging
 import os
 import json
 import uuid
-import re
+import math
+import time
 from datetime import datetime
-from lookup_knowledge import lookup_knowledge
-from jinja2 import Template
-from openai import AzureOpenAI
-from call_calc_tool import call_calc
+from lookup_knowledge import get_local_index, get_retrieval_stats, lookup_knowledge
+from call_calc_tool import call_calc, get_calc_metrics
+from calc_inputs import calc_inputs
+from flow_executor import FlowExecutor, load_flow
+from session_store import create_session_store
+from conversation import ConversationSession
+import hearing_flow
+import param_matcher
+from chunking import count_tokens
+from history_manager import PROPOSAL_HEADER, fit_prompt, get_prompt_stats
+from option_extractor import OptionExtractor, extract_options
+from prompt_template import PrefixMonitor, load_template
+from stages import stage_timeout
+import metrics
+from metrics import observe_stage, record_usage, stage
+from openai_client import get_deployment_name, get_openai_client, get_pool_stats
+from llm_gateway import GatewaySaturated, estimate_tokens, get_gateway, get_gateway_stats
 
 app = Flask(__name__)
 # Enable CORS for frontend - allow specific origins
@@ -31,140 +46,49 @@ CORS(app, resources={
     }
 })
 
-# Load the Jinja2 template
+# Build the local retrieval index at startup rather than on the first request
+if os.getenv("RAG_BACKEND", "azure").lower() == "local":
+    get_local_index()
+
+# Load (and precompile) the Jinja2 template
 # Use absolute path relative to this file
 template_path = os.path.join(os.path.dirname(__file__), 'generate_response.jinja2')
-with open(template_path, 'r', encoding='utf-8') as f:
-    template_content = f.read()
-    response_template = Template(template_content)
-
-# In-memory session storage (for simplicity)
-# In production, use Redis or database
-sessions = {}
+response_template = load_template(template_path)
+# Static part of the prompt, counted once for the token budget
+template_tokens = count_tokens(response_template.system or "")
+# The system message must stay byte-identical across turns (prompt caching)
+prefix_monitor = PrefixMonitor()
+# Completion limit; also counted against the TPM quota at admission (llm_gateway)
+LLM_MAX_TOKENS = 4000
 
 
-class ConversationSession:
-    """Manages a conversation session"""
-    
-    def __init__(self, session_id):
-        self.session_id = session_id
-        self.history = []
-        # Stores CONFIRMED parameters for calculation
-        self.collected_params = {
-            "method": None, # Must be explicitly selected (Constitution enforcement)
-            "features": [],
-            "phase2_items": [],
-            "phase3_items": [],
-            "screen_count": None,
-            "complexity": None,
-            "loc": None,
-            "fp_count": None,
-            "man_days_per_unit": None,
-            "confidence": None # Phase 3: Design Confidence
-        }
-        # Immutable Estimation Snapshot (Params + Result + Timestamp)
-        self.estimation_snapshot = None
-        self.created_at = datetime.now()
-        self.is_complete = False
-        self.final_markdown = None
-    
-    def add_message(self, role, content):
-        """Add a message to conversation history"""
-        self.history.append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        })
-    
-    def update_param(self, key, value):
-        """Update collected information (Explicit Confirmation Only)"""
-        if key in ["features", "phase2_items", "phase3_items"]:
-            if isinstance(value, list):
-                for v in value:
-                    if v not in self.collected_params[key]:
-                        self.collected_params[key].append(v)
-            else:
-                 if value not in self.collected_params[key]:
-                        self.collected_params[key].append(value)
-        else:
-            # Scalar values are overwritten
-             self.collected_params[key] = value
 
-    def is_expired(self):
-        """Check if session is expired (1 hour)"""
-        return (datetime.now() - self.created_at).seconds > 3600
+# Session storage (in-process by default, Redis when SESSION_STORE=redis).
+# Expiry is handled by the store, so requests never sweep all sessions.
+sessions = create_session_store(ConversationSession.from_dict)
 
 
 def get_or_create_session(session_id=None):
     """Get existing session or create new one"""
-    if session_id and session_id in sessions:
-        session = sessions[session_id]
-        if not session.is_expired():
+    if session_id:
+        session = sessions.get(session_id)
+        if session is not None:
             return session
-        else:
-            # Session expired, remove it
-            del sessions[session_id]
     
-    # Create new session
+    # Create new session (expired or unknown ids are recreated)
     new_session_id = session_id or str(uuid.uuid4())
     session = ConversationSession(new_session_id)
-    sessions[new_session_id] = session
+    sessions.create(session)
     return session
 
+# flow.dag.yaml run in-process up to the LLM node (calc and knowledge run concurrently).
+# No node cache: call_calc and lookup_knowledge cache their own results (see FlowExecutor)
+flow = FlowExecutor(load_flow())
+# Flow node -> stage name used for timeouts, metrics and timings
+FLOW_STAGES = {"call_calc": "calc", "lookup_knowledge": "knowledge"}
 
-def cleanup_expired_sessions():
-    """Remove expired sessions"""
-    expired = [sid for sid, session in sessions.items() if session.is_expired()]
-    for sid in expired:
-        del sessions[sid]
-
-# Mapping from Japanese labels to English keys (for UI options -> Param keys)
-PARAM_MAPPING = {
-    # Methods
-    "STEP法": "step", "LOC法": "step", "Step": "step",
-    "FP法": "fp", "Function Point": "fp",
-    "画面数法": "screen", "Screen Count": "screen",
-
-    # Features
-    "ユーザー認証": "auth", "認証": "auth",
-    "一覧表示・検索": "list_search", "検索": "list_search", "一覧": "list_search",
-    "詳細表示": "detail_view", "詳細": "detail_view",
-    "CRUD操作": "crud", "登録・編集": "crud",
-    "決済機能": "payment", "決済": "payment",
-    "プッシュ通知": "push_notification", "通知": "push_notification",
-    "リアルタイム機能": "realtime", "チャット": "realtime",
-    "外部API連携": "external_api", "API連携": "external_api",
-    "データ移行": "data_migration",
-    "管理画面": "admin_panel",
-    
-    # Complexity
-    "簡易": "low", "シンプル": "low",
-    "標準": "medium", "一般的": "medium",
-    "高難度": "high", "複雑": "high",
-    
-    # Phase 2
-    "IA設計": "ia_design",
-    "WF作成": "wireframe",
-    "Figma化": "figma",
-    
-    # Phase 3
-    "UIデザイン": "ui_design",
-    "デザインシステム": "design_system",
-    "プロトタイプ": "prototype",
-    "アイコン・ロゴ": "logo_icon",
-
-    # Confidence (Design Readiness)
-    "要件がまだ曖昧": "low", "Low Confidence": "low", "概算レベル": "low", "Vague": "low",
-    "標準的": "medium", "Standard": "medium",
-    "仕様確定済み": "high", "High Confidence": "high", "Concrete": "high", "詳細仕様あり": "high"
-}
-
-def extract_number(value_str):
-    """Robustly extract first float/int from string value"""
-    match = re.search(r'(\d+(\.\d+)?)', str(value_str))
-    if match:
-        return float(match.group(1))
-    return None
+# Label -> parameter value table of every synonym (hearing_flow hides chosen options with it)
+PARAM_MAPPING = param_matcher.label_values()
 
 @app.route('/', methods=['GET'])
 def index():
@@ -176,230 +100,497 @@ def health():
     """Health check endpoint"""
     return jsonify({"status": "healthy"}), 200
 
-@app.route('/score', methods=['POST'])
-def score():
-    """Main scoring endpoint"""
-    try:
-        cleanup_expired_sessions()
-        
-        data = request.get_json()
-        user_input = data.get('user_input', {})
-        session_id = data.get('session_id')
-        
-        session = get_or_create_session(session_id)
-        
-        client_history = data.get('conversation_history', [])
-        if not session.history and client_history:
-            session.history = client_history
-        
-        user_message = user_input.get('message', '')
-        selected_option = user_input.get('selected_option') # This is the explicit intent
-        method_only_ack = False
-        
-        # --- PHASE 2/3 LOGIC: Explicit Param Collection ---
+def prepare_turn(data):
+    """
+    Apply one user turn to its session and build the LLM messages.
+
+    Returns (session, early_response, messages, timings). early_response is set
+    when the turn is answered without calling the LLM (hearing fast path,
+    method ack, constitution warning). The knowledge lookup and the Calc API
+    call run concurrently; timings holds their durations in milliseconds.
+    """
+    parse_started = time.perf_counter()
+    user_input = data.get('user_input', {})
+    session_id = data.get('session_id')
+    
+    session = get_or_create_session(session_id)
+    
+    client_history = data.get('conversation_history', [])
+    if not session.history and client_history:
+        session.restore_history(client_history)
+    
+    user_message = user_input.get('message', '')
+    selected_option = user_input.get('selected_option') # This is the explicit intent
+    method_only_ack = False
+    draft = None
+    # Option turns that only record a parameter can be answered by hearing_flow
+    param_recorded = False
+    
+    # --- PHASE 2/3 LOGIC: Explicit Param Collection ---
+    
+    if selected_option:
+        session.add_message('user', selected_option)
+         
+        # 1. Trigger
+        if selected_option in ["CALCULATE_ESTIMATE", "見積もり作成", "計算する"]:
+            pass 
         
-        if selected_option:
-            session.add_message('user', selected_option)
-             
-            # 1. Trigger
-            if selected_option in ["CALCULATE_ESTIMATE", "見積もり作成", "計算する"]:
-                pass 
-            
-            # 1.5 Method keys (direct)
-            elif selected_option in ["screen", "step", "fp"]:
-                session.update_param("method", selected_option)
-                method_only_ack = True
-
-            # 2. Map Params
-            elif selected_option in PARAM_MAPPING:
-                key = PARAM_MAPPING[selected_option]
-                
-                # Method Selection
-                if key in ["step", "fp", "screen"]:
-                    session.update_param("method", key)
+        # 1.5 Method keys (direct)
+        elif selected_option in ["screen", "step", "fp"]:
+            session.update_param("method", selected_option)
+            method_only_ack = True
+            param_recorded = True
+
+        # 1.6 Close the current multi-select hearing step
+        elif selected_option == hearing_flow.NEXT_OPTION:
+            hearing_flow.complete_current(session.collected_params, session.hearing_completed)
+            param_recorded = True
+
+        # 2. Labels and values with units (synonyms, NFKC folding: param_matcher)
+        else:
+            mentions = param_matcher.option_mentions(selected_option)
+            has_number = (any(m.kind == "number" for m in mentions)
+                          or (not mentions and any(ch.isdigit() for ch in selected_option)))
+            # --- CONSTITUTION ENFORCEMENT: METHOD FIRST ---
+            if has_number and session.collected_params["method"] is None:
+                # Physical Refusal of Input
+                warning_msg = (
+                    "【システム警告】見積り手法が未決定です。\n\n"
+                    "数値を入力する前に、まず採用する「見積り手法」を選択（確定）してください。\n"
+                    "これはTERASOLUNAの合意形成プロセスに基づく必須手順です。"
+                )
+                return session, {
+                    "message": warning_msg,
+                    "options": [
+                        {"label": "画面数法 (Screen)", "value": "画面数法"},
+                        {"label": "STEP法 (LOC)", "value": "STEP法"},
+                        {"label": "FP法 (Function Point)", "value": "FP法"}
+                    ],
+                    "is_complete": False,
+                    "session_id": session.session_id
+                }, None, {}
+
+            for mention in mentions:
+                session.update_param(mention.param, mention.value)
+                param_recorded = True
+                if mention.param == "method":
                     method_only_ack = True
-                
-                # Complexity
-                elif key in ["low", "medium", "high"]:
-                    if "難度" in selected_option or "複雑" in selected_option or "簡易" in selected_option:
-                        session.update_param("complexity", key)
-                    elif "曖昧" in selected_option or "確定" in selected_option or "概算" in selected_option or "詳細仕様" in selected_option:
-                        session.update_param("confidence", key)
-                    else:
-                        session.update_param("complexity", key)
-                
-                # Phase 2/3
-                elif key in ["ia_design", "wireframe", "figma"]:
-                    session.update_param("phase2_items", key)
-                elif key in ["ui_design", "design_system", "prototype", "logo_icon"]:
-                    session.update_param("phase3_items", key)
-                
-                # Default Features
-                else: 
-                     session.update_param("features", key)
-            
-            # 3. Numeric Extractions (Heuristics based on labels)
-            else:
-                 val = extract_number(selected_option)
-                 if val is not None:
-                     # --- CONSTITUTION ENFORCEMENT: METHOD FIRST ---
-                     if session.collected_params["method"] is None:
-                         # Physical Refusal of Input
-                         warning_msg = (
-                             "【システム警告】見積り手法が未決定です。\n\n"
-                             "数値を入力する前に、まず採用する「見積り手法」を選択（確定）してください。\n"
-                             "これはTERASOLUNAの合意形成プロセスに基づく必須手順です。"
-                         )
-                         return jsonify({
-                             "message": warning_msg,
-                             "options": [
-                                 {"label": "画面数法 (Screen)", "value": "画面数法"},
-                                 {"label": "STEP法 (LOC)", "value": "STEP法"},
-                                 {"label": "FP法 (Function Point)", "value": "FP法"}
-                             ],
-                             "is_complete": False,
-                             "session_id": session.session_id
-                         }), 200
-
-                     # Heuristics: Context needed? Or just check keywords in label
-                     if "画面" in selected_option and "数" not in selected_option and "率" not in selected_option: 
-                         # Assumes e.g. "20画面" but not "画面数法" or "生産性0.8"
-                         session.update_param("screen_count", int(val))
-                     elif "LOC" in selected_option or "step" in selected_option.lower():
-                         session.update_param("loc", int(val))
-                     elif "FP" in selected_option and "day" not in selected_option: # "100 FP"
-                         session.update_param("fp_count", int(val))
-                     elif "人日" in selected_option or "day" in selected_option.lower():
-                         # Productivity (man_days_per_unit)
-                         session.update_param("man_days_per_unit", val)
-                     elif "screen_count" in session.collected_params.get("method", "screen"): 
-                         # Fallback if just a number and method is screen (e.g. "[20]")
-                         session.update_param("screen_count", int(val))
-
-        elif user_message:
-            session.add_message('user', user_message)
-
-        # 4. Calculation
-        calc_result_json = None
-        should_calculate = (selected_option in ["CALCULATE_ESTIMATE", "見積もり作成", "計算する"])
-        
-        if method_only_ack and not should_calculate:
-            response_data = {
-                "message": "了解、手法を記録した。",
-                "is_complete": False,
-                "session_id": session.session_id
-            }
-            return jsonify(response_data), 200
-        
-        if should_calculate:
-            params = session.collected_params
-            result_str = call_calc(
-                api_version="v2", # Phase 2 Version
-                method=params["method"],
-                screen_count=params["screen_count"],
-                features=params["features"],
-                complexity=params["complexity"],
-                phase2_items=params["phase2_items"],
-                phase3_items=params["phase3_items"],
-                loc=params["loc"],
-                fp_count=params["fp_count"],
-                man_days_per_unit=params["man_days_per_unit"],
-                confidence=params["confidence"]
-            )
-            result_json = json.loads(result_str)
-            
-            if result_json.get("status") == "error":
-                if result_json.get("error_type") == "validation_error":
-                    missing = result_json.get("missing_fields", [])
-                    calc_result_json = {"error": "missing_params", "missing": missing}
-                else:
-                    calc_result_json = {"error": "api_error", "details": result_json.get("message")}
-            else:
-                # Success - PERSIST IMMUTABLE SNAPSHOT
-                calc_result_json = result_json
-                session.estimation_snapshot = {
-                    "params": params.copy(),
-                    "result": result_json,
-                    "timestamp": datetime.now().isoformat(),
-                    "schema_version": "v2"
-                }
-
-        knowledge = lookup_knowledge(user_input)
-        
-        client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version="2024-02-01",
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
-        
-        prompt = response_template.render(
-            user_input=json.dumps(user_input, ensure_ascii=False),
-            knowledge=knowledge,
-            conversation_history=json.dumps(session.history, ensure_ascii=False),
-            collected_params=json.dumps(session.collected_params, ensure_ascii=False),
-            calc_result=json.dumps(calc_result_json, ensure_ascii=False) if calc_result_json else None
+
+    elif user_message:
+        session.add_message('user', user_message)
+        # Free text is only a draft: recognized parameters are offered as buttons, not recorded
+        draft = param_matcher.scan(user_message)
+
+    observe_stage("parse", time.perf_counter() - parse_started)
+
+    # 4. Calculation
+    calc_result_json = None
+    should_calculate = (selected_option in ["CALCULATE_ESTIMATE", "見積もり作成", "計算する"])
+    
+    # Mechanical hearing steps: canned question, no retrieval / LLM call
+    if (param_recorded and not should_calculate and hearing_flow.is_enabled()
+            and session.collected_params["method"]):
+        recorded = None if selected_option == hearing_flow.NEXT_OPTION else selected_option
+        response_data = hearing_flow.reply(
+            session.collected_params, session.hearing_completed, PARAM_MAPPING, recorded=recorded
         )
-        
-        messages = []
-        if 'system:' in prompt:
-            parts = prompt.split('user:', 1)
-            system_content = parts[0].replace('system:', '').strip()
-            messages.append({"role": "system", "content": system_content})
-            if len(parts) > 1:
-                messages.append({"role": "user", "content": parts[1].strip()})
-        else:
-            messages.append({"role": "user", "content": prompt})
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=4000 
+        session.add_message('assistant', response_data["message"])
+        response_data.update(is_complete=False, session_id=session.session_id)
+        return session, response_data, None, {}
+    
+    if (draft is not None and hearing_flow.is_enabled() and session.collected_params["method"]
+            and param_matcher.is_parameter_request(draft)):
+        response_data = hearing_flow.draft_reply(
+            session.collected_params, session.hearing_completed, PARAM_MAPPING, draft.mentions
         )
-        
-        agent_response = response.choices[0].message.content
-        session.add_message('assistant', agent_response)
-        
-        is_complete = '# プロジェクト見積もり・提案書' in agent_response
-        
+        if response_data is not None:
+            session.add_message('assistant', response_data["message"])
+            response_data.update(is_complete=False, session_id=session.session_id)
+            return session, response_data, None, {}
+
+    if method_only_ack and not should_calculate:
         response_data = {
-            "message": agent_response,
-            "is_complete": is_complete,
+            "message": "了解、手法を記録した。",
+            "is_complete": False,
             "session_id": session.session_id
         }
+        return session, response_data, None, {}
+    
+    # 5. Knowledge lookup and calculation are independent nodes of flow.dag.yaml: the local
+    # flow executor runs them concurrently (call_calc only on calculation turns)
+    params = session.collected_params
+    node_results = flow.run(
+        {"user_input": user_input, "collected_params": params, "calculate": should_calculate,
+         "session_id": session.session_id},
+        tools={"calc_inputs": calc_inputs, "call_calc": call_calc,
+               "lookup_knowledge": lookup_knowledge},
+        targets=FLOW_STAGES,
+        timeouts={"call_calc": stage_timeout("calc", 15),
+                  "lookup_knowledge": stage_timeout("knowledge", 5)}
+    )
+    results = {FLOW_STAGES[node]: result for node, result in node_results.items()
+               if node in FLOW_STAGES}
+    timings = {f"{name}_ms": round(result.elapsed_ms, 1) for name, result in results.items()}
+    for name, result in results.items():
+        observe_stage(name, result.elapsed_ms / 1000)
+        if result.timed_out:
+            metrics.STAGE_TIMEOUTS.inc(stage=name)
+            logging.warning("Stage %s timed out after %.0f ms; answering without it",
+                            name, result.elapsed_ms)
+    
+    if should_calculate:
+        calc_stage = results["calc"]
+        if calc_stage.ok:
+            result_json = json.loads(calc_stage.value)
+        else:
+            reason = "timeout" if calc_stage.timed_out else str(calc_stage.error)
+            result_json = {"status": "error", "message": f"Calc stage failed: {reason}"}
+        
+        if result_json.get("status") == "error":
+            if result_json.get("error_type") == "validation_error":
+                missing = result_json.get("missing_fields", [])
+                calc_result_json = {"error": "missing_params", "missing": missing}
+            else:
+                calc_result_json = {"error": "api_error", "details": result_json.get("message")}
+        else:
+            # Success - PERSIST IMMUTABLE SNAPSHOT
+            calc_result_json = result_json
+            session.estimation_snapshot = {
+                "params": params.copy(),
+                "result": result_json,
+                "timestamp": datetime.now().isoformat(),
+                "schema_version": "v2"
+            }
+
+    knowledge_stage = results["knowledge"]
+    if knowledge_stage.ok:
+        knowledge = knowledge_stage.value
+    else:
+        # Answer without internal documents rather than failing the turn
+        knowledge = "No relevant internal documents found."
+    with stage("render"):
+        messages = render_messages(session, user_input, knowledge, calc_result_json)
+    return session, None, messages, timings
+
+
+def render_messages(session, user_input, knowledge, calc_result_json):
+    """
+    Render the chat messages: the static system prefix, then one user message.
+
+    The conversation history is compacted (recent turns verbatim, older turns
+    in a running summary) so the prompt stays under PROMPT_TOKEN_BUDGET.
+    """
+    user_input_json = json.dumps(user_input, ensure_ascii=False)
+    collected_params_json = json.dumps(session.collected_params, ensure_ascii=False)
+    calc_result = json.dumps(calc_result_json, ensure_ascii=False) if calc_result_json else None
+    
+    knowledge, history, session.history_summary, _ = fit_prompt(
+        session.history, session.history_summary, knowledge,
+        fixed_parts=[user_input_json, collected_params_json, calc_result or ""],
+        template_tokens=template_tokens, full_history_tokens=session.history_tokens
+    )
+    # Static system message first, then knowledge / params / calc / history / user turn
+    messages = load_template(template_path).render_messages(
+        user_input=user_input_json,
+        knowledge=knowledge,
+        conversation_history=json.dumps(history, ensure_ascii=False),
+        collected_params=collected_params_json,
+        calc_result=calc_result
+    )
+    if not prefix_monitor.observe(messages):
+        logging.warning("System prompt prefix changed; provider prompt cache will miss")
+    return messages
+
+
+def is_proposal(text):
+    """True if the text contains the final proposal document header"""
+    return PROPOSAL_HEADER in text
+
+
+def finalize_turn(session, agent_response, options=None):
+    """
+    Record the assistant reply and build the /score response payload.
+
+    `options` are the reply's options when already extracted (streaming).
+    """
+    session.add_message('assistant', agent_response)
+    
+    is_complete = is_proposal(agent_response)
+    
+    response_data = {
+        "message": agent_response,
+        "is_complete": is_complete,
+        "session_id": session.session_id
+    }
+    
+    if is_complete:
+        session.is_complete = True
+        session.final_markdown = agent_response
+        response_data["markdown"] = agent_response
+    else:
+        unique_options = extract_options(agent_response) if options is None else options
+        if unique_options:
+            response_data["options"] = unique_options
+    return response_data
+
+
+def llm_request(messages, **options):
+    """Chat completion call for the LLM gateway (admission, quota and retries)"""
+    client = get_openai_client()
+    return lambda: client.chat.completions.create(
+        model=get_deployment_name(),
+        messages=messages,
+        temperature=0.7,
+        max_tokens=LLM_MAX_TOKENS,
+        **options
+    )
+
+
+def saturated_response(session, error):
+    """
+    503 with a retry hint when the LLM gateway rejects the call.
+
+    The user's message is taken back out of the history so that resending the
+    same turn does not record it twice (parameter updates are idempotent).
+    """
+    if session.history and session.history[-1].role == "user":
+        session.pop_message()
+    metrics.TURNS.inc(path="rejected")
+    response = jsonify({
+        "error": "llm_unavailable",
+        "reason": error.reason,
+        "message": "ただいま混み合っています。しばらくしてから再度お試しください。",
+        "retry_after": error.retry_after,
+        "session_id": session.session_id
+    })
+    response.headers["Retry-After"] = str(math.ceil(error.retry_after))
+    return response, 503
+
+
+@app.route('/score', methods=['POST'])
+def score():
+    """Main scoring endpoint"""
+    try:
+        started = time.perf_counter()
+        session, response_data, messages, timings = prepare_turn(request.get_json())
         
-        if is_complete:
-            session.is_complete = True
-            session.final_markdown = agent_response
-            response_data["markdown"] = agent_response
+        if response_data is None:
+            llm_started = time.perf_counter()
+            response = get_gateway().complete(llm_request(messages),
+                                              estimate_tokens(messages, LLM_MAX_TOKENS))
+            llm_seconds = time.perf_counter() - llm_started
+            timings["llm_ms"] = round(llm_seconds * 1000, 1)
+            observe_stage("llm", llm_seconds)
+            usage = record_usage(getattr(response, "usage", None))
+            with stage("extract"):
+                response_data = finalize_turn(session, response.choices[0].message.content)
+            if usage is not None:
+                response_data["usage"] = usage
+            metrics.TURNS.inc(path="llm")
         else:
-            options_bracket = re.findall(r'\[([^\]\n]+)\](?!\()', agent_response)
-            potential_list_items = re.findall(r'^\s*[-ー•*1-9][\.\)\s]+([^\n\[\]]+)', agent_response, re.MULTILINE)
-            candidates = options_bracket + potential_list_items
-            unique_options = []
-            seen = set()
-            for opt in candidates:
-                clean_opt = re.sub(r'[\[\]\*]', '', opt).strip()
-                if ': ' in clean_opt: clean_opt = clean_opt.split(': ')[0].strip()
-                if clean_opt and clean_opt not in seen and len(clean_opt) < 40:
-                    if not clean_opt.startswith(('#', 'http://', 'https://')):
-                        unique_options.append({"label": clean_opt, "value": clean_opt})
-                        seen.add(clean_opt)
-            if unique_options:
-                response_data["options"] = unique_options
+            metrics.TURNS.inc(path="early")
 
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        response_data["timings"] = timings
+        sessions.save(session)
         return jsonify(response_data), 200
+    
+    except GatewaySaturated as e:
+        return saturated_response(session, e)
         
     except Exception as e:
         import traceback
         traceback.print_exc()
+        metrics.ERRORS.inc(endpoint="score")
+        return jsonify({"error": str(e)}), 500
+
+
+def _sse(event, payload):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.route('/score/stream', methods=['POST'])
+def score_stream():
+    """
+    Streaming variant of /score (Server-Sent Events).
+
+    Events:
+      token    - {"content": "..."} for every delta from the model
+      option   - {"label", "value"} as soon as an option line is complete
+      complete - {} once the proposal header is detected (is_complete)
+      done     - the same payload /score returns (message, options/markdown, session_id,
+                 timings, usage)
+      error    - {"error": "..."}
+
+    The LLM call is admitted before the stream starts, so a saturated gateway
+    is reported as the same 503 JSON as /score rather than as an event.
+    """
+    stream = None
+    try:
+        started = time.perf_counter()
+        session, early_response, messages, timings = prepare_turn(request.get_json())
+        if early_response is None:
+            llm_started = time.perf_counter()
+            stream = get_gateway().open_stream(
+                # Final chunk carries token usage (no choices)
+                llm_request(messages, stream=True, stream_options={"include_usage": True}),
+                estimate_tokens(messages, LLM_MAX_TOKENS)
+            )
+    except GatewaySaturated as e:
+        return saturated_response(session, e)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        metrics.ERRORS.inc(endpoint="score_stream")
         return jsonify({"error": str(e)}), 500
 
+    def generate():
+        if early_response is not None:
+            timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            early_response["timings"] = timings
+            metrics.TURNS.inc(path="early")
+            sessions.save(session)
+            yield _sse("done", early_response)
+            return
+
+        try:
+            parts = []
+            # Options are reported as their line completes; scanning stops at the proposal
+            extractor = OptionExtractor(stop_marker=PROPOSAL_HEADER)
+            is_complete = False
+            usage = None
+            for chunk in stream:
+                usage = record_usage(getattr(chunk, "usage", None)) or usage
+                # Azure sends prompt-filter chunks without choices
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if not parts:
+                    observe_stage("llm_first_token", time.perf_counter() - llm_started)
+                parts.append(delta)
+                yield _sse("token", {"content": delta})
+
+                if is_complete:
+                    continue
+                for option in extractor.feed(delta):
+                    yield _sse("option", option)
+                if extractor.stopped:
+                    is_complete = True
+                    yield _sse("complete", {})
+
+            llm_seconds = time.perf_counter() - llm_started
+            timings["llm_ms"] = round(llm_seconds * 1000, 1)
+            observe_stage("llm", llm_seconds)
+            timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            with stage("extract"):
+                extractor.close()
+                response_data = finalize_turn(session, "".join(parts), extractor.options())
+            response_data["timings"] = timings
+            if usage is not None:
+                response_data["usage"] = usage
+            metrics.TURNS.inc(path="llm")
+            sessions.save(session)
+            yield _sse("done", response_data)
+
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            metrics.ERRORS.inc(endpoint="score_stream")
+            yield _sse("error", {"error": str(e)})
+        finally:
+            # Release the gateway slot even if the client disconnected mid-stream
+            stream.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/estimate/batch', methods=['POST'])
+def estimate_batch_endpoint():
+    """
+    Evaluate many estimation scenarios in one vectorized pass (no LLM, no Calc API).
+
+    Body: {"scenarios": [{...}, ...]} or {"base": {...}, "grid": {"screen_count": [10, 20], ...}}
+    Returns column-oriented JSON: {"count": N, "columns": {"estimated_amount": [...], ...}}
+    """
+    # NumPy is only needed here; keep it out of the app's import time
+    from batch_estimation import estimate_batch, expand_scenarios
+
+    try:
+        scenarios = expand_scenarios(request.get_json() or {},
+                                     max_scenarios=int(os.getenv("BATCH_MAX_SCENARIOS", 100000)))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(estimate_batch(scenarios)), 200
+
+@app.route('/admin/stats', methods=['GET'])
+def admin_stats():
+    """Runtime statistics for operators (connection pools etc.)"""
+    return jsonify({
+        "openai_pool": get_pool_stats(),
+        "calc_api": get_calc_metrics(),
+        "retrieval_cache": get_retrieval_stats(),
+        "llm_gateway": get_gateway_stats(),
+        "sessions": get_session_stats(),
+        "prompt": dict(get_prompt_stats(), **prefix_monitor.stats())
+    }), 200
+
+def get_session_stats():
+    stats = {"active": len(sessions), "expired": sessions.expired, "evicted": sessions.evicted}
+    if hasattr(sessions, "total_bytes"):
+        stats.update(bytes=sessions.total_bytes, budget_bytes=sessions.max_bytes)
+    return stats
+
+def _cache_samples(field):
+    samples = []
+    for name, cache_stats in (("calc", get_calc_metrics()["cache"]),
+                              ("retrieval", get_retrieval_stats())):
+        if field in cache_stats:
+            samples.append(({"cache": name}, cache_stats[field]))
+    return samples
+
+
+metrics.registry.register_collector(
+    "estimation_cache_hits_total", "counter", "Cache hits (this process)",
+    lambda: _cache_samples("hits"))
+metrics.registry.register_collector(
+    "estimation_cache_misses_total", "counter", "Cache misses (this process)",
+    lambda: _cache_samples("misses"))
+metrics.registry.register_collector(
+    "estimation_llm_queue_depth", "gauge", "LLM calls waiting for admission",
+    lambda: [({}, get_gateway().waiting)])
+metrics.registry.register_collector(
+    "estimation_llm_in_flight", "gauge", "LLM calls in progress",
+    lambda: [({}, get_gateway().in_flight)])
+metrics.registry.register_collector(
+    "estimation_sessions_active", "gauge", "Live conversation sessions",
+    lambda: [({}, len(sessions))])
+metrics.registry.register_collector(
+    "estimation_sessions_expired_total", "counter", "Sessions expired by TTL (in-memory store)",
+    lambda: [({}, sessions.expired)])
+metrics.registry.register_collector(
+    "estimation_sessions_evicted_total", "counter",
+    "Sessions evicted by the memory budget (in-memory store)",
+    lambda: [({}, sessions.evicted)])
+metrics.registry.register_collector(
+    "estimation_sessions_bytes", "gauge", "Approximate memory held by sessions (in-memory store)",
+    lambda: [({}, getattr(sessions, "total_bytes", 0))])
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/sessions/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
     """Delete a session"""
-    if session_id in sessions:
-        del sessions[session_id]
+    if sessions.delete(session_id):
         return jsonify({"message": "Session deleted"}), 200
     return jsonify({"error": "Session not found"}), 404
 
@@ -410,14 +601,16 @@ def list_sessions():
         "active_sessions": len(sessions),
         "sessions": [
             {
-                "session_id": sid,
-                "created_at": session.created_at.isoformat(),
+                "session_id": session.session_id,
+                "created_at": datetime.fromtimestamp(session.created_at).isoformat(),
                 "collected_params": session.collected_params
             }
-            for sid, session in sessions.items()
+            for session in sessions.sessions()
         ]
     }), 200
 
 if __name__ == '__main__':
+    # Local development only; production serves wsgi:app with gunicorn (gunicorn.conf.py)
     port = int(os.getenv('PORT', 8080))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    debug = os.getenv('FLASK_DEBUG', 'false').lower() in ('1', 'true', 'yes')
+    app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)
@@ -0,0 +1,245 @@
+"""
+Vectorized batch estimation for scenario sweeps.
+
+Evaluates many Calc API payloads at once with NumPy, using the same rules as
+`estimation_engine.estimate` (one scenario per row, every rule applied as a
+column operation). Results are returned column-oriented so thousands of
+scenarios serialize compactly:
+
+    {"count": 3, "columns": {"screen_count": [10, 20, 40], "estimated_amount": [...], ...}}
+"""
+
+import itertools
+import math
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import estimation_engine as engine
+from estimation_engine import DEFAULT_RULES, METHODS
+
+PARAM_KEYS = ("method", "screen_count", "complexity", "features", "phase2_items",
+              "phase3_items", "loc", "fp_count", "man_days_per_unit", "confidence")
+LIST_KEYS = ("features", "phase2_items", "phase3_items")
+NUMBER_KEYS = ("screen_count", "loc", "fp_count", "man_days_per_unit")
+TEXT_KEYS = ("method", "complexity", "confidence")
+DEFAULT_MAX_SCENARIOS = 100000
+
+
+def _number(key: str, value: Any) -> Any:
+    """A non-negative finite number (numeric strings are converted)"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f"'{key}' must be a number, got {value!r}") from None
+        value = int(number) if number.is_integer() else number
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"'{key}' must be a number, got {value!r}")
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"'{key}' must be a non-negative number, got {value!r}")
+    return value
+
+
+def _canonical(scenario: Any) -> Dict[str, Any]:
+    """Validate one scenario and normalize it like call_calc (ValueError on bad input)"""
+    if not isinstance(scenario, dict):
+        raise ValueError(f"Each scenario must be an object, got {scenario!r}")
+    unknown = set(scenario) - set(PARAM_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+    params = {key: scenario.get(key) for key in PARAM_KEYS}
+    for key in TEXT_KEYS:
+        if params[key] is not None and not isinstance(params[key], str):
+            raise ValueError(f"'{key}' must be a string, got {params[key]!r}")
+    for key in NUMBER_KEYS:
+        params[key] = _number(key, params[key])
+    params["method"] = params["method"] or "screen"
+    params["complexity"] = params["complexity"] or "medium"
+    for key in LIST_KEYS:
+        items = params[key]
+        # A bare string would otherwise be split into characters
+        if items is not None and not (isinstance(items, list)
+                                      and all(isinstance(item, str) for item in items)):
+            raise ValueError(f"'{key}' must be a list of strings, got {items!r}")
+        # Same canonicalization as call_calc
+        params[key] = sorted(set(items)) if items else []
+    return params
+
+
+def expand_scenarios(request: Dict[str, Any],
+                     max_scenarios: int = DEFAULT_MAX_SCENARIOS) -> List[Dict[str, Any]]:
+    """
+    Build the scenario list from a batch request.
+
+    Either {"scenarios": [{...}, ...]} or {"base": {...}, "grid": {"screen_count": [10, 20], ...}}
+    (cartesian product of the grid values applied on top of base).
+    """
+    if not isinstance(request, dict):
+        raise ValueError("Request must be an object")
+    if "scenarios" in request:
+        scenarios = request["scenarios"]
+        if not isinstance(scenarios, list):
+            raise ValueError("'scenarios' must be a list")
+    elif "grid" in request:
+        grid = request["grid"]
+        if not isinstance(grid, dict) or not grid:
+            raise ValueError("'grid' must be a non-empty object")
+        keys = list(grid)
+        size = 1
+        for key in keys:
+            if not isinstance(grid[key], list) or not grid[key]:
+                raise ValueError(f"grid '{key}' must be a non-empty list")
+            size *= len(grid[key])
+        if size > max_scenarios:
+            raise ValueError(f"Too many scenarios: {size} > {max_scenarios}")
+        base = request.get("base") or {}
+        if not isinstance(base, dict):
+            raise ValueError("'base' must be an object")
+        scenarios = [dict(base, **dict(zip(keys, values)))
+                     for values in itertools.product(*(grid[key] for key in keys))]
+    else:
+        raise ValueError("Request must contain 'scenarios' or 'grid'")
+
+    if len(scenarios) > max_scenarios:
+        raise ValueError(f"Too many scenarios: {len(scenarios)} > {max_scenarios}")
+    return [_canonical(s) for s in scenarios]
+
+
+def _column(scenarios: List[Dict[str, Any]], key: str) -> np.ndarray:
+    """Numeric column with NaN for missing values"""
+    return np.array([np.nan if s[key] is None else float(s[key]) for s in scenarios], dtype=float)
+
+
+def _item_days(scenarios: List[Dict[str, Any]], key: str, table: Dict[str, float],
+               default: float = 0.0) -> np.ndarray:
+    """Sum of per-item days via a one-hot (scenario x item) matrix product"""
+    vocab = sorted(set(table) | {item for s in scenarios for item in s[key]})
+    index = {item: i for i, item in enumerate(vocab)}
+    onehot = np.zeros((len(scenarios), len(vocab)))
+    for row, s in enumerate(scenarios):
+        for item in s[key]:
+            onehot[row, index[item]] = 1.0
+    weights = np.array([table.get(item, default) for item in vocab], dtype=float)
+    return onehot @ weights if vocab else np.zeros(len(scenarios))
+
+
+def _has_any(scenarios: List[Dict[str, Any]], key: str, items: List[str]) -> np.ndarray:
+    wanted = set(items)
+    return np.array([bool(wanted.intersection(s[key])) for s in scenarios])
+
+
+def _round_days(values: np.ndarray) -> np.ndarray:
+    # Python's round() (exact decimal rounding) to match estimation_engine;
+    # np.round scales by 100 first and can differ in the last digit.
+    return np.array([round(v, 2) for v in values.tolist()], dtype=float)
+
+
+def _to_list(values: np.ndarray, valid: np.ndarray, as_int: bool = False) -> List[Optional[Any]]:
+    out: List[Optional[Any]] = []
+    for value, ok in zip(values.tolist(), valid.tolist()):
+        if not ok:
+            out.append(None)
+        else:
+            out.append(int(value) if as_int else value)
+    return out
+
+
+def estimate_batch(scenarios: List[Dict[str, Any]],
+                   rules: Dict[str, Any] = DEFAULT_RULES) -> Dict[str, Any]:
+    """Estimate canonical scenarios in one vectorized pass (column-oriented result)"""
+    n = len(scenarios)
+    method = np.array([s["method"] for s in scenarios], dtype=object)
+    complexity = np.array([s["complexity"] for s in scenarios], dtype=object)
+    confidence = np.array([s["confidence"] for s in scenarios], dtype=object)
+    screens = _column(scenarios, "screen_count")
+    loc = _column(scenarios, "loc")
+    fp_count = _column(scenarios, "fp_count")
+    per_unit = _column(scenarios, "man_days_per_unit")
+    screens0 = np.nan_to_num(screens)
+    n_features = np.array([len(s["features"]) for s in scenarios], dtype=float)
+    has_phase2 = np.array([bool(s["phase2_items"]) for s in scenarios])
+    has_phase3 = np.array([bool(s["phase3_items"]) for s in scenarios])
+
+    # --- Validation (same rules and messages as estimation_engine.validate) ---
+    errors = np.full(n, None, dtype=object)
+
+    def flag(mask: np.ndarray, message: str, values: Optional[np.ndarray] = None) -> None:
+        """Set message on the rows of mask without an earlier error ({} <- the row's value)"""
+        for row in np.flatnonzero(mask & (errors == None)):  # noqa: E711 (element-wise)
+            errors[row] = message.format(values[row]) if values is not None else message
+
+    is_screen, is_step, is_fp = method == "screen", method == "step", method == "fp"
+    flag(~np.isin(method, METHODS), engine.UNSUPPORTED_METHOD, method)
+    flag(is_screen & np.isnan(screens), engine.MISSING_SCREEN_COUNT)
+    flag(is_step & (np.isnan(loc) | np.isnan(per_unit)), engine.MISSING_STEP_PARAMS)
+    flag(is_fp & (np.isnan(fp_count) | np.isnan(per_unit)), engine.MISSING_FP_PARAMS)
+    flag(~np.isin(complexity, list(rules["complexity_multipliers"])),
+         engine.INVALID_COMPLEXITY, complexity)
+    flag(has_phase3 & ~np.isin(confidence, list(rules["confidence_variance"])),
+         engine.MISSING_CONFIDENCE)
+    valid = errors == None  # noqa: E711
+
+    # --- Development ---
+    multiplier = np.array([rules["complexity_multipliers"].get(c, np.nan) for c in complexity],
+                          dtype=float)
+    feature_days = _item_days(scenarios, "features", rules["feature_days"],
+                              rules["default_feature_days"])
+    screen_days = screens0 * rules["dev_screen_rate"]
+    base_days = np.select([is_screen, is_step, is_fp],
+                          [feature_days + screen_days, loc * per_unit, fp_count * per_unit],
+                          default=np.nan)
+    dev_days = base_days * multiplier
+    dev_cost = np.rint(dev_days * rules["internal_daily_rate"])
+
+    # --- Phase 2 ---
+    wireframe_rate = np.where(complexity == "high", rules["phase2_complex_screen_days"],
+                              rules["phase2_per_screen_days"].get("wireframe", 0.0))
+    per_screen2 = {k: v for k, v in rules["phase2_per_screen_days"].items() if k != "wireframe"}
+    p2_days = (_item_days(scenarios, "phase2_items", rules["phase2_fixed_days"])
+               + _item_days(scenarios, "phase2_items", per_screen2) * screens0
+               + _has_any(scenarios, "phase2_items", ["wireframe"]) * wireframe_rate * screens0
+               + has_phase2 * rules["phase2_feature_spec_days"] * n_features)
+    p2_cost = np.rint(p2_days * rules["internal_daily_rate"])
+
+    # --- Phase 3 ---
+    fixed3 = {k: v for k, v in rules["phase3_fixed_days"].items() if k != "design_system"}
+    design_system_days = np.where(screens0 <= rules["small_project_screens"],
+                                  rules["phase3_small_design_system_days"],
+                                  rules["phase3_fixed_days"]["design_system"])
+    p3_days = (_item_days(scenarios, "phase3_items", fixed3)
+               + _has_any(scenarios, "phase3_items", ["design_system"]) * design_system_days
+               + _item_days(scenarios, "phase3_items", rules["phase3_per_screen_days"]) * screens0)
+    p3_raw = p3_days * rules["vendor_daily_rate"] * (1 + rules["vendor_management_ratio"])
+    variance = np.array([rules["confidence_variance"].get(c, 0.0) for c in confidence],
+                        dtype=float) * has_phase3
+    p3_cost = np.rint(p3_raw)
+    p3_min = np.rint(p3_raw * (1 - variance))
+    p3_max = np.rint(p3_raw * (1 + variance))
+
+    # --- Totals ---
+    dev_days_r, p2_days_r, p3_days_r = _round_days(dev_days), _round_days(p2_days), _round_days(p3_days)
+    overhead = (rules["pm_ratio"] * (dev_days_r + p2_days_r + p3_days_r)
+                + rules["qa_ratio"] * dev_days_r) * rules["internal_daily_rate"]
+    fixed = dev_cost + p2_cost + overhead
+    buffer = rules["buffer_multiplier"]
+
+    columns: Dict[str, List[Any]] = {key: [s[key] for s in scenarios] for key in PARAM_KEYS}
+    columns.update({
+        "status": ["ok" if ok else "error" for ok in valid.tolist()],
+        "error": errors.tolist(),
+        "estimated_amount": _to_list(np.rint((fixed + p3_cost) * buffer), valid, as_int=True),
+        "estimated_min": _to_list(np.rint((fixed + p3_min) * buffer), valid, as_int=True),
+        "estimated_max": _to_list(np.rint((fixed + p3_max) * buffer), valid, as_int=True),
+        "development_days": _to_list(dev_days_r, valid),
+        "development_cost": _to_list(dev_cost, valid, as_int=True),
+        "phase2_days": _to_list(p2_days_r, valid),
+        "phase2_cost": _to_list(p2_cost, valid, as_int=True),
+        "phase3_days": _to_list(p3_days_r, valid),
+        "phase3_cost": _to_list(p3_cost, valid, as_int=True),
+        "phase3_min": _to_list(p3_min, valid, as_int=True),
+        "phase3_max": _to_list(p3_max, valid, as_int=True),
+    })
+    return {"count": n, "currency": "JPY", "columns": columns}
@@ -0,0 +1,18 @@
+from typing import Any, Dict
+from flow_tool import tool
+
+# call_calc arguments taken from the session's collected parameters
+CALC_PARAMS = ("method", "screen_count", "features", "complexity", "phase2_items", "phase3_items",
+               "loc", "fp_count", "man_days_per_unit", "confidence")
+
+
+@tool
+def calc_inputs(collected_params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Map the collected parameters onto call_calc's arguments (flow node).
+
+    Prompt Flow references node output keys (`${calc_inputs.output.loc}`)
+    but not keys of flow inputs, so this node feeds call_calc.
+    """
+    params = collected_params or {}
+    return {name: params.get(name) for name in CALC_PARAMS}
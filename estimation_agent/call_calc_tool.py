@@ -2,14 +2,212 @@ import os
 import requests
 import json
 import logging
+import threading
 from typing import List, Dict, Any, Optional
-from promptflow.core import tool
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flow_tool import tool
+from circuit_breaker import CircuitBreaker
+from ttl_cache import create_cache, stable_hash
+import estimation_engine
+
+# Shared HTTP session (connection pool + keep-alive) and per-endpoint breakers.
+# Calc calls are pure functions of the payload, so POST retries are safe.
+_session: Optional[requests.Session] = None
+_breakers: Dict[str, CircuitBreaker] = {}
+_lock = threading.Lock()
+# Result cache keyed on the canonical payload (None = caching disabled)
+_cache: Any = None
+_cache_ready = False
+# Local-vs-remote comparison counters (CALC_ENGINE=parity)
+_parity = {"checked": 0, "mismatched": 0}
+
+
+def _get_session() -> requests.Session:
+    """Return the pooled, retrying session used for Calc API calls"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                # Retry refused/failed connections and 502/503/504 only. A read
+                # timeout is not retried: a hung backend would otherwise hold the
+                # call for (retries + 1) x read timeout, past CALC_STAGE_TIMEOUT_SECONDS.
+                retry = Retry(
+                    total=int(os.getenv("CALC_API_MAX_RETRIES", 2)),
+                    read=0,
+                    backoff_factor=float(os.getenv("CALC_API_BACKOFF_FACTOR", 0.2)),
+                    backoff_max=float(os.getenv("CALC_API_BACKOFF_MAX", 2)),
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({"POST"}),
+                    respect_retry_after_header=True,
+                    raise_on_status=False
+                )
+                pool_size = int(os.getenv("CALC_API_POOL_SIZE", 10))
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                      max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _get_breaker(endpoint: str) -> CircuitBreaker:
+    """Return the circuit breaker for an endpoint, creating it on first use"""
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.setdefault(endpoint, CircuitBreaker(
+                failure_threshold=int(os.getenv("CALC_BREAKER_FAILURE_THRESHOLD", 5)),
+                reset_timeout=float(os.getenv("CALC_BREAKER_RESET_SECONDS", 30))
+            ))
+    return breaker
+
+
+def _get_cache() -> Any:
+    """
+    Return the Calc result cache configured by
+    CALC_CACHE_BACKEND (memory/redis/none), CALC_CACHE_SIZE, CALC_CACHE_TTL_SECONDS.
+    """
+    global _cache, _cache_ready
+    if not _cache_ready:
+        with _lock:
+            if not _cache_ready:
+                _cache = create_cache(
+                    "calc",
+                    backend=os.getenv("CALC_CACHE_BACKEND", "memory"),
+                    maxsize=int(os.getenv("CALC_CACHE_SIZE", 1024)),
+                    ttl_seconds=float(os.getenv("CALC_CACHE_TTL_SECONDS", 600))
+                )
+                _cache_ready = True
+    return _cache
+
+
+def get_calc_metrics() -> Dict[str, Any]:
+    """Circuit breaker state per Calc API endpoint and result cache counters"""
+    cache = _get_cache()
+    return {
+        "engine": os.getenv("CALC_ENGINE", "remote").lower(),
+        "parity": dict(_parity),
+        "breakers": {endpoint: b.metrics() for endpoint, b in list(_breakers.items())},
+        "cache": cache.stats() if cache is not None else {"backend": "none"}
+    }
+
+
+def reset_calc_client() -> None:
+    """Drop pooled connections, breaker state and cached results (config reload / tests)"""
+    global _session, _cache, _cache_ready
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _breakers.clear()
+        _cache = None
+        _cache_ready = False
+        _parity.update(checked=0, mismatched=0)
+
+
+def _call_remote(payload: Dict[str, Any]) -> str:
+    """POST a canonical payload to the Calc API (cached, pooled, circuit-broken)"""
+    endpoint = os.getenv("CALC_API_ENDPOINT")
+    # Fallback to local func default if not set (mostly for dev/test)
+    if not endpoint:
+        endpoint = "http://localhost:7071/api/calculate_estimate"
+        logging.warning(f"CALC_API_ENDPOINT not set. Using default: {endpoint}")
+
+    # Identical canonical payloads always produce the same estimate
+    cache = _get_cache()
+    cache_key = stable_hash({"endpoint": endpoint, "payload": payload})
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    breaker = _get_breaker(endpoint)
+    if not breaker.allow_request():
+        # Fail fast while the backend is known to be unhealthy
+        return json.dumps({
+            "status": "error",
+            "error_type": "circuit_open",
+            "message": "Calc API temporarily unavailable (circuit open)"
+        }, ensure_ascii=False)
+
+    try:
+        headers = {"Content-Type": "application/json"}
+        logging.info(f"Calling Calc API at {endpoint} with payload: {json.dumps(payload, ensure_ascii=False)}")
+        
+        timeout = (float(os.getenv("CALC_API_CONNECT_TIMEOUT", 3)),
+                   float(os.getenv("CALC_API_READ_TIMEOUT", 10)))
+        response = _get_session().post(endpoint, json=payload, headers=headers, timeout=timeout)
+    except Exception as e:
+        breaker.record_failure()
+        return json.dumps({
+            "status": "error",
+            "message": f"Connection Failed: {str(e)}"
+        }, ensure_ascii=False)
+
+    # Exactly one breaker outcome per call, decided once the body is parsed
+    if response.status_code != 200:
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            # 4xx are caller errors; the backend itself is healthy
+            breaker.record_success()
+        return json.dumps({
+            "status": "error",
+            "message": f"Calc API Error: {response.status_code}",
+            "details": response.text
+        }, ensure_ascii=False)
+
+    try:
+        result = response.json()
+    except ValueError:
+        result = None
+    if not isinstance(result, dict):
+        # A 200 without an estimate object means the backend is broken
+        breaker.record_failure()
+        return json.dumps({
+            "status": "error",
+            "message": "Calc API Error: invalid response body",
+            "details": response.text[:500]
+        }, ensure_ascii=False)
+
+    breaker.record_success()
+    result_str = json.dumps(result, ensure_ascii=False)
+    # Only successful estimates are cached
+    if cache is not None and result.get("status") != "error":
+        cache.set(cache_key, result_str)
+    return result_str
+
+
+def _check_parity(payload: Dict[str, Any], remote_str: str) -> None:
+    """
+    Compare the local engine against a remote result and log any drift.
+
+    Never raises: the remote result is served either way, and a check that
+    fails (local engine error, unexpected remote shape) counts as a mismatch.
+    """
+    try:
+        remote = json.loads(remote_str)
+        if remote.get("status") == "error":
+            return
+        diffs = estimation_engine.diff_results(estimation_engine.estimate(payload), remote)
+    except Exception as e:
+        logging.exception("Parity check failed")
+        diffs = [f"parity check failed: {e}"]
+    with _lock:
+        _parity["checked"] += 1
+        if diffs:
+            _parity["mismatched"] += 1
+    if diffs:
+        logging.warning(f"Local estimation engine differs from Calc API for {json.dumps(payload, ensure_ascii=False)}: {diffs}")
+
 
 @tool
 def call_calc(screen_count: int = None, features: List[str] = None, complexity: str = "medium", 
               phase2_items: List[str] = None, phase3_items: List[str] = None,
               method: str = "screen", loc: int = None, fp_count: int = None, man_days_per_unit: float = None,
-              confidence: str = None) -> str:
+              confidence: str = None, api_version: str = "v1") -> str:
     """
     Call the external Calculation API to get estimation details.
     
@@ -24,6 +222,7 @@ def call_calc(screen_count: int = None, features: List[str] = None, complexity:
         fp_count: Function Points (Required if method="fp").
         man_days_per_unit: Productivity rate (Required if method="step" or "fp").
         confidence: Design Confidence ("low", "medium", "high"). Required if Phase 2/3 items are present.
+        api_version: Calc API contract version sent in the payload.
     
     Returns:
         JSON string containing the calculation result.
@@ -62,7 +261,7 @@ def call_calc(screen_count: int = None, features: List[str] = None, complexity:
 
     # 3. Prepare Payload
     payload = {
-        "api_version": "v1",
+        "api_version": api_version,
         "method": method,
         "screen_count": screen_count,
         "complexity": complexity,
@@ -75,30 +274,15 @@ def call_calc(screen_count: int = None, features: List[str] = None, complexity:
         "confidence": confidence
     }
     
-    endpoint = os.getenv("CALC_API_ENDPOINT")
-    # Fallback to local func default if not set (mostly for dev/test)
-    if not endpoint:
-        endpoint = "http://localhost:7071/api/calculate_estimate"
-        logging.warning(f"CALC_API_ENDPOINT not set. Using default: {endpoint}")
+    # 4. Compute (local engine, remote Calc API, or both for parity checks)
+    engine = os.getenv("CALC_ENGINE", "remote").lower()
+    if engine == "local":
+        try:
+            return json.dumps(estimation_engine.estimate(payload), ensure_ascii=False)
+        except Exception as e:
+            logging.warning(f"Local estimation engine failed, falling back to Calc API: {e}")
 
-    try:
-        # 4. Call API
-        headers = {"Content-Type": "application/json"}
-        logging.info(f"Calling Calc API at {endpoint} with payload: {json.dumps(payload, ensure_ascii=False)}")
-        
-        response = requests.post(endpoint, json=payload, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            return json.dumps(response.json(), ensure_ascii=False)
-        else:
-            return json.dumps({
-                "status": "error", 
-                "message": f"Calc API Error: {response.status_code}",
-                "details": response.text
-            }, ensure_ascii=False)
-            
-    except Exception as e:
-        return json.dumps({
-            "status": "error",
-            "message": f"Connection Failed: {str(e)}"
-        }, ensure_ascii=False)
+    result_str = _call_remote(payload)
+    if engine == "parity":
+        _check_parity(payload, result_str)
+    return result_str
@@ -0,0 +1,205 @@
+"""
+Heading-aware markdown chunking for the RAG index.
+
+Files are split at markdown headings; sections larger than the token budget
+are packed paragraph by paragraph (then line by line) into chunks with a
+small token overlap. Each chunk records `source`, `heading_path` and
+`chunk_index` so retrieval can return passages instead of whole files.
+"""
+
+import glob
+import hashlib
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_MAX_TOKENS = 400
+DEFAULT_OVERLAP_TOKENS = 50
+DEFAULT_MIN_TOKENS = 100
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+
+_encoder: Any = None
+_encoder_loaded = False
+
+
+def _get_encoder() -> Any:
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        try:
+            import tiktoken  # Optional; falls back to a character heuristic
+            _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoder = None
+        _encoder_loaded = True
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the gpt-4o tokenizer (approximate if tiktoken is unavailable)"""
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    # Japanese text is roughly one token per character; ASCII ~4 chars per token
+    ascii_chars = sum(1 for ch in text if ch.isascii())
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def _sections(content: str) -> List[Dict[str, Any]]:
+    """Split markdown into (heading_path, text) sections, ignoring fenced code"""
+    sections: List[Dict[str, Any]] = []
+    stack: List[str] = []
+    lines: List[str] = []
+    in_fence = False
+
+    def flush() -> None:
+        text = "\n".join(lines).strip()
+        if text:
+            sections.append({"heading_path": " > ".join(stack), "text": text})
+
+    for line in content.splitlines():
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADING_RE.match(line)
+        if match:
+            flush()
+            lines = []
+            level = len(match.group(1))
+            stack = stack[:level - 1] + [match.group(2)]
+        lines.append(line)
+    flush()
+    return sections
+
+
+def _common_path(a: str, b: str) -> str:
+    common: List[str] = []
+    for x, y in zip(a.split(" > "), b.split(" > ")):
+        if x != y:
+            break
+        common.append(x)
+    return " > ".join(common)
+
+
+def _merge_small(sections: List[Dict[str, Any]], min_tokens: int, max_tokens: int,
+                 counter: Callable[[str], int]) -> List[Dict[str, Any]]:
+    """Fold tiny sections (e.g. a bare title heading) into the following section"""
+    merged: List[Dict[str, Any]] = []
+    for section in sections:
+        if merged:
+            previous = merged[-1]
+            combined = previous["text"] + "\n\n" + section["text"]
+            if counter(previous["text"]) < min_tokens and counter(combined) <= max_tokens:
+                merged[-1] = {"heading_path": _common_path(previous["heading_path"],
+                                                           section["heading_path"]),
+                              "text": combined}
+                continue
+        merged.append(dict(section))
+    return merged
+
+
+def _split_units(text: str, max_tokens: int, counter: Callable[[str], int]) -> List[str]:
+    """Paragraphs, falling back to lines (then hard cuts) for oversized paragraphs"""
+    units: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if counter(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for line in paragraph.split("\n"):
+            while counter(line) > max_tokens:
+                # Cut proportionally; a single line larger than the budget is rare
+                cut = max(1, len(line) * max_tokens // counter(line))
+                units.append(line[:cut])
+                line = line[cut:]
+            if line.strip():
+                units.append(line)
+    return units
+
+
+def _pack(units: List[str], max_tokens: int, overlap_tokens: int,
+          counter: Callable[[str], int]) -> List[str]:
+    """Greedily pack units into chunks, repeating trailing units as overlap"""
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for unit in units:
+        unit_tokens = counter(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            overlap: List[str] = []
+            overlap_size = 0
+            for previous in reversed(current):
+                size = counter(previous)
+                if overlap_size + size > overlap_tokens:
+                    break
+                if overlap_size + size + unit_tokens > max_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += size
+            current, current_tokens = overlap, overlap_size
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def chunk_id(source: str, heading_path: str, ordinal: int) -> str:
+    """
+    Azure AI Search compatible document key for a chunk.
+
+    Keyed by the chunk's heading and its ordinal under that heading rather
+    than its position in the file, so editing or inserting one section does
+    not re-key (and re-upload) every chunk after it.
+    """
+    return hashlib.md5(f"{source}#{heading_path}#{ordinal}".encode("utf-8")).hexdigest()
+
+
+def split_markdown(content: str, source: str, max_tokens: int = DEFAULT_MAX_TOKENS,
+                   overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                   min_tokens: int = DEFAULT_MIN_TOKENS,
+                   counter: Optional[Callable[[str], int]] = None) -> List[Dict[str, Any]]:
+    """Split one markdown document into heading-aware chunks"""
+    counter = counter or count_tokens
+    chunks: List[Dict[str, Any]] = []
+    ordinals: Dict[str, int] = {}
+    for section in _merge_small(_sections(content), min_tokens, max_tokens, counter):
+        if counter(section["text"]) <= max_tokens:
+            texts = [section["text"]]
+        else:
+            texts = _pack(_split_units(section["text"], max_tokens, counter),
+                          max_tokens, overlap_tokens, counter)
+        for text in texts:
+            chunk_index = len(chunks)
+            ordinal = ordinals.get(section["heading_path"], 0)
+            ordinals[section["heading_path"]] = ordinal + 1
+            chunks.append({
+                "id": chunk_id(source, section["heading_path"], ordinal),
+                "content": text,
+                "source": source,
+                "heading_path": section["heading_path"],
+                "chunk_index": chunk_index,
+            })
+    return chunks
+
+
+def chunk_directory(rags_dir: str, max_tokens: int = DEFAULT_MAX_TOKENS,
+                    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS) -> List[Dict[str, Any]]:
+    """Chunk every markdown file in rags_dir (sorted by filename)"""
+    chunks: List[Dict[str, Any]] = []
+    for file_path in sorted(glob.glob(os.path.join(rags_dir, "*.md"))):
+        with open(file_path, "r", encoding="utf-8") as f:
+            chunks.extend(split_markdown(f.read(), os.path.basename(file_path),
+                                         max_tokens=max_tokens, overlap_tokens=overlap_tokens))
+    return chunks
+
+
+def chunk_settings() -> Dict[str, int]:
+    """Chunking parameters from RAG_CHUNK_TOKENS / RAG_CHUNK_OVERLAP"""
+    return {
+        "max_tokens": int(os.getenv("RAG_CHUNK_TOKENS", DEFAULT_MAX_TOKENS)),
+        "overlap_tokens": int(os.getenv("RAG_CHUNK_OVERLAP", DEFAULT_OVERLAP_TOKENS)),
+    }
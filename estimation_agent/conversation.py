@@ -0,0 +1,310 @@
+"""
+Conversation session state with bounded, accounted memory use.
+
+Thousands of sessions can be live in one worker, so the records are compact:
+
+- messages are `Message` objects with `__slots__` (role, content, epoch-float
+  timestamp) instead of dicts with ISO timestamp strings; roles are interned
+- `final_markdown` points at the proposal message instead of copying it
+- each session tracks the approximate bytes it holds (`size_bytes()`), which
+  the in-memory store uses for its global LRU budget (SESSION_MEMORY_BUDGET_MB)
+- each session keeps a running token count of its history (`history_tokens`),
+  so the prompt statistics never re-tokenize the whole history
+
+History is capped at SESSION_HISTORY_MAX_MESSAGES / SESSION_HISTORY_MAX_BYTES.
+Messages dropped from the front are folded into the running summary first
+(history_manager), so the prompt keeps their gist. A client-supplied
+`conversation_history` is validated and capped separately
+(CLIENT_HISTORY_MAX_MESSAGES / CLIENT_HISTORY_MAX_BYTES, newest kept).
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from history_manager import message_tokens, new_summary, summarize_message
+
+DEFAULT_HISTORY_MAX_MESSAGES = 200
+DEFAULT_HISTORY_MAX_BYTES = 256 * 1024
+DEFAULT_CLIENT_HISTORY_MAX_MESSAGES = 50
+DEFAULT_CLIENT_HISTORY_MAX_BYTES = 64 * 1024
+
+CLIENT_ROLES = ("user", "assistant")
+
+
+def history_limits() -> Dict[str, int]:
+    """SESSION_HISTORY_MAX_* / CLIENT_HISTORY_MAX_* (0 disables a cap)"""
+    return {
+        "max_messages": int(os.getenv("SESSION_HISTORY_MAX_MESSAGES",
+                                      DEFAULT_HISTORY_MAX_MESSAGES)),
+        "max_bytes": int(os.getenv("SESSION_HISTORY_MAX_BYTES", DEFAULT_HISTORY_MAX_BYTES)),
+        "client_max_messages": int(os.getenv("CLIENT_HISTORY_MAX_MESSAGES",
+                                             DEFAULT_CLIENT_HISTORY_MAX_MESSAGES)),
+        "client_max_bytes": int(os.getenv("CLIENT_HISTORY_MAX_BYTES",
+                                          DEFAULT_CLIENT_HISTORY_MAX_BYTES)),
+    }
+
+
+def _epoch(value: Any) -> float:
+    """Epoch seconds from a float or a legacy ISO timestamp string"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+class Message:
+    """One history entry; read like the dicts it replaces (`m["role"]`, `m.get("content")`)"""
+
+    __slots__ = ("role", "content", "timestamp")
+
+    def __init__(self, role: str, content: str, timestamp: Optional[float] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other: Any) -> bool:
+        return (isinstance(other, Message) and self.role == other.role
+                and self.content == other.content and self.timestamp == other.timestamp)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content, "timestamp": self.timestamp}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Message":
+        return cls(str(data.get("role") or "user"), str(data.get("content") or ""),
+                   _epoch(data.get("timestamp")))
+
+
+# Fixed cost of a message beyond its content string (slots object + float)
+MESSAGE_OVERHEAD = sys.getsizeof(Message("user", "", 0.0)) + sys.getsizeof(0.0)
+# Session object, params dict and lists, counted once per session
+SESSION_OVERHEAD = 2048
+
+
+def message_bytes(message: Message) -> int:
+    return MESSAGE_OVERHEAD + sys.getsizeof(message.content)
+
+
+def client_messages(history: Any, max_messages: int, max_bytes: int) -> List[Message]:
+    """
+    Validate a client-supplied history: user/assistant entries with string
+    content only, newest first up to max_messages and max_bytes (0 = no cap).
+    """
+    if not isinstance(history, list):
+        return []
+    kept: List[Message] = []
+    total = 0
+    for entry in reversed(history):
+        if max_messages and len(kept) >= max_messages:
+            break
+        if not isinstance(entry, dict) or entry.get("role") not in CLIENT_ROLES:
+            continue
+        content = entry.get("content")
+        if not isinstance(content, str):
+            continue
+        message = Message.from_dict(entry)
+        size = message_bytes(message)
+        if max_bytes and total + size > max_bytes:
+            break
+        kept.append(message)
+        total += size
+    kept.reverse()
+    return kept
+
+
+class ConversationSession:
+    """Manages a conversation session"""
+
+    __slots__ = ("session_id", "history", "collected_params", "estimation_snapshot",
+                 "hearing_completed", "history_summary", "created_at", "is_complete",
+                 "history_bytes", "history_tokens", "_final", "_snapshot_bytes")
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.history = []
+        # Stores CONFIRMED parameters for calculation
+        self.collected_params = {
+            "method": None, # Must be explicitly selected (Constitution enforcement)
+            "features": [],
+            "phase2_items": [],
+            "phase3_items": [],
+            "screen_count": None,
+            "complexity": None,
+            "loc": None,
+            "fp_count": None,
+            "man_days_per_unit": None,
+            "confidence": None # Phase 3: Design Confidence
+        }
+        # Immutable Estimation Snapshot (Params + Result + Timestamp)
+        self.estimation_snapshot = None
+        # Multi-select hearing steps closed with [次へ] (see hearing_flow.py)
+        self.hearing_completed = []
+        # Running summary of turns outside the verbatim window (history_manager)
+        self.history_summary = None
+        # Epoch seconds
+        self.created_at = time.time()
+        self.is_complete = False
+        # Bytes held by `history` (kept up to date by add/trim)
+        self.history_bytes = 0
+        # Tokens of `history` as rendered into the prompt (history_manager)
+        self.history_tokens = 0
+        # The proposal message (final_markdown is read through it, not copied)
+        self._final = None
+        self._snapshot_bytes = None
+
+    def add_message(self, role, content):
+        """Add a message to conversation history (then apply the history caps)"""
+        message = Message(role, content)
+        self.history.append(message)
+        self.history_bytes += message_bytes(message)
+        self.history_tokens += message_tokens(message)
+        limits = history_limits()
+        self.trim_history(limits["max_messages"], limits["max_bytes"])
+        return message
+
+    def pop_message(self):
+        """Remove and return the last message"""
+        message = self.history.pop()
+        self.history_bytes -= message_bytes(message)
+        self.history_tokens -= message_tokens(message)
+        return message
+
+    def trim_history(self, max_messages, max_bytes):
+        """Drop the oldest messages beyond the caps (0 = no cap), keeping at least one"""
+        drop = 0
+        remaining = self.history_bytes
+        count = len(self.history)
+        while count - drop > 1 and (
+                (max_messages and count - drop > max_messages)
+                or (max_bytes and remaining > max_bytes)):
+            remaining -= message_bytes(self.history[drop])
+            drop += 1
+        if not drop:
+            return
+        summary = self.history_summary or new_summary()
+        # Keep the gist of dropped messages that were not summarized yet
+        lines = list(summary["lines"])
+        for message in self.history[summary["covered"]:drop]:
+            lines.append(summarize_message(message))
+        self.history_summary = {"lines": lines, "covered": max(0, summary["covered"] - drop)}
+        self.history_tokens -= sum(message_tokens(m) for m in self.history[:drop])
+        del self.history[:drop]
+        self.history_bytes = remaining
+
+    def restore_history(self, client_history):
+        """Seed an empty session with the (validated, capped) client-side history"""
+        limits = history_limits()
+        self.history = client_messages(client_history, limits["client_max_messages"],
+                                       limits["client_max_bytes"])
+        self.history_bytes = sum(message_bytes(m) for m in self.history)
+        self.history_tokens = sum(message_tokens(m) for m in self.history)
+        self.trim_history(limits["max_messages"], limits["max_bytes"])
+
+    @property
+    def final_markdown(self):
+        return self._final.content if self._final is not None else None
+
+    @final_markdown.setter
+    def final_markdown(self, content):
+        """Point at the last assistant message with this content (copied only if absent)"""
+        self._final = None
+        if content is None:
+            return
+        for message in reversed(self.history):
+            if message.role == "assistant" and message.content == content:
+                self._final = message
+                return
+        self._final = Message("assistant", content)
+
+    def size_bytes(self):
+        """Approximate memory held by this session (for the store's memory budget)"""
+        size = SESSION_OVERHEAD + self.history_bytes
+        if self.history_summary:
+            size += sum(sys.getsizeof(line) for line in self.history_summary["lines"])
+        if self.estimation_snapshot is not None:
+            snapshot = self.estimation_snapshot
+            # Measured once per snapshot (it is replaced, never mutated)
+            if self._snapshot_bytes is None or self._snapshot_bytes[0] is not snapshot:
+                encoded = json.dumps(snapshot, ensure_ascii=False, default=str)
+                self._snapshot_bytes = (snapshot, sys.getsizeof(encoded))
+            size += self._snapshot_bytes[1]
+        if self._final is not None and not any(m is self._final for m in self.history):
+            size += message_bytes(self._final)
+        return size
+
+    def update_param(self, key, value):
+        """Update collected information (Explicit Confirmation Only)"""
+        if key in ["features", "phase2_items", "phase3_items"]:
+            if isinstance(value, list):
+                for v in value:
+                    if v not in self.collected_params[key]:
+                        self.collected_params[key].append(v)
+            else:
+                 if value not in self.collected_params[key]:
+                        self.collected_params[key].append(value)
+        else:
+            # Scalar values are overwritten
+             self.collected_params[key] = value
+
+    def to_dict(self):
+        """Serialize session state for shared session stores"""
+        data = {
+            "session_id": self.session_id,
+            "history": [m.to_dict() for m in self.history],
+            "collected_params": self.collected_params,
+            "estimation_snapshot": self.estimation_snapshot,
+            "hearing_completed": self.hearing_completed,
+            "history_summary": self.history_summary,
+            "created_at": self.created_at,
+            "is_complete": self.is_complete,
+            "history_tokens": self.history_tokens
+        }
+        # The proposal is normally in the history: store its index, not a second copy
+        if self._final is not None:
+            index = next((i for i in range(len(self.history) - 1, -1, -1)
+                          if self.history[i] is self._final), None)
+            if index is not None:
+                data["final_index"] = index
+            else:
+                data["final_markdown"] = self._final.content
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a session serialized with to_dict() (also reads the older dict format)"""
+        session = cls(data["session_id"])
+        session.history = [Message.from_dict(m) for m in data.get("history", [])]
+        session.history_bytes = sum(message_bytes(m) for m in session.history)
+        # Stored with the session; counted once for records written before it was
+        tokens = data.get("history_tokens")
+        if tokens is None:
+            tokens = sum(message_tokens(m) for m in session.history)
+        session.history_tokens = tokens
+        session.collected_params.update(data.get("collected_params", {}))
+        session.estimation_snapshot = data.get("estimation_snapshot")
+        session.hearing_completed = data.get("hearing_completed", [])
+        session.history_summary = data.get("history_summary")
+        session.created_at = _epoch(data.get("created_at"))
+        session.is_complete = data.get("is_complete", False)
+        index = data.get("final_index")
+        if index is not None and 0 <= index < len(session.history):
+            session._final = session.history[index]
+        else:
+            session.final_markdown = data.get("final_markdown")
+        return session
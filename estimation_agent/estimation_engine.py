@@ -0,0 +1,238 @@
+"""
+In-process estimation engine.
+
+Implements the labor estimation rules (rags/29_labor_estimation_logic.md) with
+the same payload and response shape as the remote Calc API, so `call_calc`
+can answer without a network round trip (CALC_ENGINE=local) or diff itself
+against the deployed backend (CALC_ENGINE=parity).
+
+The default rules reproduce the golden snapshots of the deployed Calc API
+(golden_snapshots_verification.md). The deployed backend folds PM / QA
+overheads into a flat buffer multiplier, so `pm_ratio` / `qa_ratio` default
+to 0 and can be enabled explicitly for rule experiments.
+"""
+
+from typing import Any, Dict, List, Optional
+
+DEFAULT_RULES: Dict[str, Any] = {
+    # Unit rates (JPY / man-day)
+    "internal_daily_rate": 50000,   # Phase 2, development
+    "vendor_daily_rate": 80000,     # Phase 3 (design vendor)
+
+    # Development
+    "complexity_multipliers": {"low": 0.8, "medium": 1.0, "high": 1.3},
+    "dev_screen_rate": 1.5,         # man-days per screen
+    "feature_days": {
+        "auth": 5,
+        "list_search": 3,
+        "detail_view": 2,
+        "crud": 4,
+        "payment": 8,
+        "push_notification": 4,
+        "realtime": 8,
+        "external_api": 5,
+        "data_migration": 6,
+        "admin_panel": 6,
+    },
+    "default_feature_days": 3,
+
+    # Phase 2 (internal design)
+    "phase2_fixed_days": {"ia_design": 3},
+    "phase2_per_screen_days": {"wireframe": 0.5, "figma": 0.5},
+    "phase2_complex_screen_days": 0.8,   # wireframe rate when complexity is high
+    "phase2_feature_spec_days": 0.5,     # per selected feature
+
+    # Phase 3 (vendor design)
+    "phase3_fixed_days": {"design_system": 5, "prototype": 2, "logo_icon": 3},
+    "phase3_small_design_system_days": 3,
+    "small_project_screens": 10,
+    "phase3_per_screen_days": {"ui_design": 1.0},
+    "vendor_management_ratio": 0.15,
+    "confidence_variance": {"low": 0.4, "medium": 0.2, "high": 0.1},
+
+    # Overheads
+    "buffer_multiplier": 1.1,
+    "pm_ratio": 0.0,
+    "qa_ratio": 0.0,
+}
+
+METHODS = ("screen", "step", "fp")
+
+# validate() messages, shared with batch_estimation so both report the same text
+UNSUPPORTED_METHOD = "Unsupported method: {}"
+MISSING_SCREEN_COUNT = "Missing required param: screen_count"
+MISSING_STEP_PARAMS = ("Missing required param: loc / man_days_per_unit "
+                       "(explicit productivity required)")
+MISSING_FP_PARAMS = ("Missing required param: fp_count / man_days_per_unit "
+                     "(explicit productivity required)")
+INVALID_COMPLEXITY = "Invalid complexity: {}"
+MISSING_CONFIDENCE = ("Missing required param: confidence "
+                      "(Required for Phase 3 / Vendor Design estimation)")
+
+
+def _days(value: float) -> float:
+    return round(float(value), 2)
+
+
+def _yen(value: float) -> int:
+    return int(round(value))
+
+
+def _error(message: str) -> Dict[str, Any]:
+    return {"status": "error", "message": message}
+
+
+def validate(payload: Dict[str, Any], rules: Dict[str, Any] = DEFAULT_RULES) -> Optional[str]:
+    """Return an error message if the payload cannot be estimated"""
+    method = payload.get("method")
+    if method not in METHODS:
+        return UNSUPPORTED_METHOD.format(method)
+    if method == "screen" and payload.get("screen_count") is None:
+        return MISSING_SCREEN_COUNT
+    if method == "step" and (payload.get("loc") is None or payload.get("man_days_per_unit") is None):
+        return MISSING_STEP_PARAMS
+    if method == "fp" and (payload.get("fp_count") is None or payload.get("man_days_per_unit") is None):
+        return MISSING_FP_PARAMS
+    if payload.get("complexity") not in rules["complexity_multipliers"]:
+        return INVALID_COMPLEXITY.format(payload.get("complexity"))
+    if payload.get("phase3_items") and payload.get("confidence") not in rules["confidence_variance"]:
+        return MISSING_CONFIDENCE
+    return None
+
+
+def _development(payload: Dict[str, Any], rules: Dict[str, Any]) -> Dict[str, Any]:
+    method = payload["method"]
+    multiplier = rules["complexity_multipliers"][payload["complexity"]]
+
+    if method == "screen":
+        feature_days = sum(rules["feature_days"].get(f, rules["default_feature_days"])
+                           for f in payload.get("features") or [])
+        screen_days = payload["screen_count"] * rules["dev_screen_rate"]
+        base_days = feature_days + screen_days
+        details = {"feature_days": feature_days, "screen_days": _days(screen_days)}
+    elif method == "step":
+        base_days = payload["loc"] * payload["man_days_per_unit"]
+        details = {"loc": payload["loc"], "man_days_per_unit": payload["man_days_per_unit"]}
+    else:
+        base_days = payload["fp_count"] * payload["man_days_per_unit"]
+        details = {"fp_count": payload["fp_count"], "man_days_per_unit": payload["man_days_per_unit"]}
+
+    total_days = base_days * multiplier
+    return {
+        "method": method,
+        "base_days": _days(base_days),
+        "total_days": _days(total_days),
+        "cost": _yen(total_days * rules["internal_daily_rate"]),
+        "details": details,
+    }
+
+
+def _phase2(payload: Dict[str, Any], rules: Dict[str, Any]) -> Dict[str, Any]:
+    items: List[str] = payload.get("phase2_items") or []
+    screens = payload.get("screen_count") or 0
+    days = 0.0
+    for item in items:
+        if item in rules["phase2_fixed_days"]:
+            days += rules["phase2_fixed_days"][item]
+        elif item in rules["phase2_per_screen_days"]:
+            rate = rules["phase2_per_screen_days"][item]
+            if item == "wireframe" and payload.get("complexity") == "high":
+                rate = rules["phase2_complex_screen_days"]
+            days += rate * screens
+    if items:
+        days += rules["phase2_feature_spec_days"] * len(payload.get("features") or [])
+
+    cost = _yen(days * rules["internal_daily_rate"])
+    return {"total_days": _days(days), "cost": cost, "range": {"min": cost, "max": cost}}
+
+
+def _phase3(payload: Dict[str, Any], rules: Dict[str, Any]) -> Dict[str, Any]:
+    items: List[str] = payload.get("phase3_items") or []
+    screens = payload.get("screen_count") or 0
+    days = 0.0
+    for item in items:
+        if item == "design_system" and screens <= rules["small_project_screens"]:
+            days += rules["phase3_small_design_system_days"]
+        elif item in rules["phase3_fixed_days"]:
+            days += rules["phase3_fixed_days"][item]
+        elif item in rules["phase3_per_screen_days"]:
+            days += rules["phase3_per_screen_days"][item] * screens
+
+    cost = days * rules["vendor_daily_rate"] * (1 + rules["vendor_management_ratio"])
+    variance = rules["confidence_variance"].get(payload.get("confidence"), 0.0) if items else 0.0
+    return {
+        "total_days": _days(days),
+        "cost": _yen(cost),
+        "range": {"min": _yen(cost * (1 - variance)), "max": _yen(cost * (1 + variance))},
+    }
+
+
+def estimate(payload: Dict[str, Any], rules: Dict[str, Any] = DEFAULT_RULES) -> Dict[str, Any]:
+    """
+    Estimate a canonical Calc API payload locally.
+
+    Returns the same JSON shape as the remote Calc API
+    (status / estimated_amount / estimated_range / breakdown).
+    """
+    error = validate(payload, rules)
+    if error:
+        return _error(error)
+
+    development = _development(payload, rules)
+    phase2 = _phase2(payload, rules)
+    phase3 = _phase3(payload, rules)
+
+    # Optional PM / QA overheads (0 in the deployed rules, see module docstring)
+    all_days = development["total_days"] + phase2["total_days"] + phase3["total_days"]
+    overhead = (rules["pm_ratio"] * all_days
+                + rules["qa_ratio"] * development["total_days"]) * rules["internal_daily_rate"]
+
+    fixed = development["cost"] + phase2["cost"] + overhead
+    buffer = rules["buffer_multiplier"]
+    final = _yen((fixed + phase3["cost"]) * buffer)
+
+    return {
+        "status": "ok",
+        "estimated_amount": final,
+        "estimated_range": {
+            "min": _yen((fixed + phase3["range"]["min"]) * buffer),
+            "max": _yen((fixed + phase3["range"]["max"]) * buffer),
+        },
+        "currency": "JPY",
+        "method": payload["method"],
+        "breakdown": {
+            "development": development,
+            "phase2_design": phase2,
+            "phase3_visual": phase3,
+            "buffer_multiplier": buffer,
+            "final": final,
+        },
+    }
+
+
+def diff_results(local: Any, remote: Any, path: str = "", tolerance: float = 0.01) -> List[str]:
+    """
+    List the paths where the local result disagrees with the remote one.
+
+    Only keys returned by the remote API are compared, so extra local detail
+    does not count as a mismatch.
+    """
+    if isinstance(remote, dict):
+        if not isinstance(local, dict):
+            return [f"{path or '.'}: expected object"]
+        diffs: List[str] = []
+        for key, value in remote.items():
+            child = f"{path}.{key}" if path else key
+            if key not in local:
+                diffs.append(f"{child}: missing locally")
+            else:
+                diffs.extend(diff_results(local[key], value, child, tolerance))
+        return diffs
+    if isinstance(remote, (int, float)) and not isinstance(remote, bool) \
+            and isinstance(local, (int, float)) and not isinstance(local, bool):
+        if abs(local - remote) > tolerance:
+            return [f"{path}: local={local} remote={remote}"]
+        return []
+    if local != remote:
+        return [f"{path}: local={local!r} remote={remote!r}"]
+    return []
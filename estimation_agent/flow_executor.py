@@ -0,0 +1,224 @@
+"""
+In-process executor for flow.dag.yaml.
+
+The Prompt Flow runtime executes the DAG when the flow is deployed; the Flask
+app runs the same definition locally with `FlowExecutor`, so both paths share
+one node graph instead of the app re-implementing the orchestration:
+
+- a node starts as soon as the nodes it references have finished, on the
+  shared stage pool (stages.get_executor), so independent nodes such as
+  `call_calc` and `lookup_knowledge` run concurrently
+- `activate: {when, is}` bypasses a node (and its dependents) as Prompt Flow
+  does; bypassed nodes produce no result
+- `enable_cache` is left to the Prompt Flow runtime; in the app the tools
+  cache their own results (on normalized keys that re-indexing invalidates)
+- each node is awaited until its own deadline, measured from the start of
+  the run; a node that fails or times out fails its dependents
+
+Node implementations are passed to `run` by name (`tools`), so the caller
+decides which callables back the DAG. Only the nodes needed for `targets`
+are executed, e.g. the app runs everything up to the LLM node and renders
+the prompt itself.
+"""
+
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import yaml
+
+from stages import StageResult, get_executor, timed
+
+DEFAULT_FLOW_PATH = os.path.join(os.path.dirname(__file__), "flow.dag.yaml")
+DEFAULT_NODE_TIMEOUT = 30.0
+
+_REFERENCE = re.compile(r"^\$\{([^}]+)\}$")
+
+
+class FlowError(ValueError):
+    """Invalid flow definition or run request"""
+
+
+class UpstreamError(RuntimeError):
+    """A node was not run because a node it depends on failed"""
+
+
+class Reference:
+    """`${inputs.name}`, `${node.output}` or `${node.output.key}`"""
+
+    __slots__ = ("source", "name", "path")
+
+    def __init__(self, expression: str):
+        parts = expression.split(".")
+        if parts[0] == "inputs" and len(parts) >= 2:
+            self.source, self.name, self.path = "inputs", parts[1], parts[2:]
+        elif len(parts) >= 2 and parts[1] == "output":
+            self.source, self.name, self.path = "node", parts[0], parts[2:]
+        else:
+            raise FlowError(f"unsupported reference: ${{{expression}}}")
+
+    def resolve(self, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> Any:
+        value = inputs.get(self.name) if self.source == "inputs" else outputs.get(self.name)
+        for key in self.path:
+            value = value.get(key) if isinstance(value, dict) else None
+        return value
+
+
+def _parse_value(value: Any) -> Any:
+    if isinstance(value, str):
+        match = _REFERENCE.match(value.strip())
+        if match:
+            return Reference(match.group(1))
+    return value
+
+
+class Node:
+    """One node of the DAG with its input assignments parsed"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.name: str = spec["name"]
+        self.type: str = spec.get("type", "python")
+        self.inputs: Dict[str, Any] = {k: _parse_value(v)
+                                       for k, v in (spec.get("inputs") or {}).items()}
+        activate = spec.get("activate")
+        self.activate: Optional[Tuple[Any, Any]] = (
+            (_parse_value(activate.get("when")), activate.get("is")) if activate else None)
+        references = list(self.inputs.values())
+        if self.activate:
+            references.append(self.activate[0])
+        self.depends_on: List[str] = sorted({ref.name for ref in references
+                                             if isinstance(ref, Reference)
+                                             and ref.source == "node"})
+
+    def resolve_inputs(self, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v.resolve(inputs, outputs) if isinstance(v, Reference) else v
+                for k, v in self.inputs.items()}
+
+    def is_active(self, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> bool:
+        if self.activate is None:
+            return True
+        when, expected = self.activate
+        value = when.resolve(inputs, outputs) if isinstance(when, Reference) else when
+        return value == expected
+
+
+class Flow:
+    """Parsed flow.dag.yaml: input defaults and nodes in dependency order"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.input_defaults: Dict[str, Any] = {
+            name: definition.get("default")
+            for name, definition in (spec.get("inputs") or {}).items()
+            if isinstance(definition, dict) and "default" in definition
+        }
+        nodes = [Node(node) for node in spec.get("nodes") or []]
+        self.nodes: Dict[str, Node] = {}
+        by_name = {node.name: node for node in nodes}
+        visiting = set()
+
+        def visit(node: Node) -> None:
+            if node.name in self.nodes:
+                return
+            if node.name in visiting:
+                raise FlowError(f"cycle at node {node.name}")
+            visiting.add(node.name)
+            for dependency in node.depends_on:
+                if dependency not in by_name:
+                    raise FlowError(f"node {node.name} references unknown node {dependency}")
+                visit(by_name[dependency])
+            self.nodes[node.name] = node
+
+        for node in nodes:
+            visit(node)
+
+    def closure(self, targets: Optional[Iterable[str]] = None) -> List[Node]:
+        """Nodes needed to compute targets (all nodes if None), in dependency order"""
+        if targets is None:
+            return list(self.nodes.values())
+        needed = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in self.nodes:
+                raise FlowError(f"unknown node: {name}")
+            if name not in needed:
+                needed.add(name)
+                stack.extend(self.nodes[name].depends_on)
+        return [node for node in self.nodes.values() if node.name in needed]
+
+
+def load_flow(path: str = DEFAULT_FLOW_PATH) -> Flow:
+    with open(path, encoding="utf-8") as f:
+        return Flow(yaml.safe_load(f))
+
+
+class FlowExecutor:
+    """Runs a Flow with concurrent node scheduling"""
+
+    def __init__(self, flow: Flow):
+        self.flow = flow
+
+    def run(self, inputs: Dict[str, Any], tools: Dict[str, Callable[..., Any]],
+            targets: Optional[Iterable[str]] = None,
+            timeouts: Optional[Dict[str, float]] = None) -> Dict[str, StageResult]:
+        """
+        Execute the nodes needed for targets and return their StageResults.
+
+        Bypassed nodes are absent from the result.
+        """
+        timeouts = timeouts or {}
+        inputs = dict(self.flow.input_defaults, **inputs)
+        started = time.perf_counter()
+        executor = get_executor()
+        waiting = self.flow.closure(targets)
+        outputs: Dict[str, Any] = {}
+        results: Dict[str, StageResult] = {}
+        bypassed = set()
+        running: Dict[Any, Tuple[Node, float]] = {}
+
+        while waiting or running:
+            # Start every node whose dependencies have settled
+            for node in [n for n in waiting
+                         if all(d in results or d in bypassed for d in n.depends_on)]:
+                waiting.remove(node)
+                if any(d in bypassed for d in node.depends_on) or \
+                        not node.is_active(inputs, outputs):
+                    bypassed.add(node.name)
+                    continue
+                failed = [d for d in node.depends_on if not results[d].ok]
+                if failed:
+                    results[node.name] = StageResult(
+                        error=UpstreamError(f"{node.name}: upstream {failed[0]} failed"))
+                    continue
+                tool = tools.get(node.name)
+                if tool is None:
+                    raise FlowError(f"no tool for node {node.name}")
+                kwargs = node.resolve_inputs(inputs, outputs)
+                deadline = started + timeouts.get(node.name, DEFAULT_NODE_TIMEOUT)
+                future = executor.submit(timed(lambda t=tool, kw=kwargs: t(**kw)))
+                running[future] = (node, deadline)
+
+            if not running:
+                continue
+            now = time.perf_counter()
+            next_deadline = min(deadline for _, deadline in running.values())
+            done, _ = wait(list(running), timeout=max(0.0, next_deadline - now),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                node, _ = running.pop(future)
+                value, error, elapsed = future.result()
+                results[node.name] = StageResult(value, error, elapsed_ms=elapsed)
+                if error is None:
+                    outputs[node.name] = value
+            now = time.perf_counter()
+            for future, (node, deadline) in list(running.items()):
+                if deadline <= now:
+                    # Keeps running in the background; the run proceeds without it
+                    future.cancel()
+                    del running[future]
+                    results[node.name] = StageResult(timed_out=True,
+                                                     elapsed_ms=(now - started) * 1000)
+        return results
+
@@ -0,0 +1,30 @@
+"""
+`@tool` for the Python nodes of flow.dag.yaml without importing promptflow.
+
+Importing `promptflow.core` costs over a second and pulls in the whole SDK,
+while the Flask app only calls the node functions directly. When the Prompt
+Flow runtime executes the DAG it has already imported promptflow before it
+loads the node modules, so the real decorator is applied then; otherwise
+the function is returned unchanged and promptflow is never imported.
+PROMPTFLOW_TOOLS=true forces the real decorator (e.g. for tooling that loads
+the node modules before importing promptflow itself).
+"""
+
+import os
+import sys
+from typing import Any, Callable
+
+
+def _running_as_flow() -> bool:
+    if os.getenv("PROMPTFLOW_TOOLS", "").lower() in ("1", "true", "yes", "on"):
+        return True
+    return "promptflow" in sys.modules
+
+
+def tool(func: Callable[..., Any]) -> Callable[..., Any]:
+    """promptflow.core.tool inside the flow runtime, a no-op in the app"""
+    if not _running_as_flow():
+        return func
+    from promptflow.core import tool as promptflow_tool
+
+    return promptflow_tool(func)
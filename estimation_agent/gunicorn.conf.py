@@ -0,0 +1,91 @@
+"""
+gunicorn settings for the estimation agent container.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+/score spends most of its time waiting on Azure OpenAI, so each worker
+process runs a pool of threads (gthread). The app is imported once in the
+master (preload) and the startup self-check runs there before workers are
+forked. On SIGTERM workers stop accepting connections and in-flight
+requests, including streamed LLM responses, get GUNICORN_GRACEFUL_TIMEOUT
+seconds to finish.
+
+Environment:
+    PORT                        Listen port (default 8080)
+    GUNICORN_WORKERS            Worker processes (default 1 with SESSION_STORE=memory,
+                                otherwise 2 per CPU)
+    GUNICORN_THREADS            Threads per worker (default 16)
+    GUNICORN_PRELOAD            Import the app in the master before forking (default true)
+    GUNICORN_TIMEOUT            Seconds before a silent worker is restarted (default 120)
+    GUNICORN_GRACEFUL_TIMEOUT   Drain time on shutdown (default AZURE_OPENAI_TIMEOUT + 30)
+    GUNICORN_KEEPALIVE          Idle keep-alive seconds; keep it above the ingress/load
+                                balancer idle timeout so the proxy closes first (default 75)
+    GUNICORN_MAX_REQUESTS       Recycle workers after N requests, 0 = never (default 0;
+                                recycling drops in-memory sessions)
+    GUNICORN_ACCESS_LOG         Access log file, "-" = stdout, empty = disabled (default -)
+    GUNICORN_LOG_LEVEL          Log level (default info)
+    SDK_WARMUP                  Import the Azure SDKs in a background thread once each
+                                worker is up, instead of on its first request (default true)
+"""
+
+import logging
+import os
+import threading
+
+_session_store = os.getenv("SESSION_STORE", "memory").lower()
+# In-memory sessions live in one process; more workers need the shared redis store
+_default_workers = 1 if _session_store == "memory" else 2 * (os.cpu_count() or 1)
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", _default_workers))
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() not in ("0", "false", "no")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT",
+                                 int(float(os.getenv("AZURE_OPENAI_TIMEOUT", 60))) + 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 75))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+# Worker heartbeat files on tmpfs (a slow overlay filesystem can stall workers)
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+
+def on_starting(server):
+    logging.basicConfig(level=loglevel.upper())
+    import wsgi
+
+    if not wsgi.run_self_check(server.cfg.workers):
+        server.log.error("Startup self-check failed (SELF_CHECK=strict); not starting")
+        raise SystemExit(1)
+
+
+def post_fork(server, worker):
+    # Pools and clients must not be shared with the master across fork
+    import call_calc_tool
+    import openai_client
+
+    openai_client.reset_openai_client()
+    call_calc_tool.reset_calc_client()
+
+
+def post_worker_init(worker):
+    if os.getenv("SDK_WARMUP", "true").lower() in ("0", "false", "no"):
+        return
+    import wsgi
+
+    threading.Thread(target=wsgi.warm_up, name="sdk-warmup", daemon=True).start()
+
+
+def worker_exit(server, worker):
+    # In-flight requests have drained; release background stage threads and connections
+    import openai_client
+    import stages
+
+    stages.shutdown_executor(wait=False)
+    openai_client.reset_openai_client()
@@ -0,0 +1,214 @@
+"""
+Declarative hearing state machine for the mechanical part of the interview.
+
+Once the estimation method is confirmed, the remaining questions (features,
+complexity, size, productivity, design scope, confidence) are fixed option
+lists. `next_step` derives the next unanswered question from the collected
+parameters, and `reply` builds the canned prompt and options for it, so
+`/score` can answer option-button turns without retrieval or an LLM call.
+Free text and the final proposal are still handled by the LLM, except that
+a message naming nothing but known parameters gets `draft_reply`: the
+recognized values come back as option buttons for the user to confirm.
+"""
+
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+# Control option that closes a multi-select step
+NEXT_OPTION = "次へ"
+CALCULATE_OPTION = "見積もり作成"
+
+ALL_METHODS = ("screen", "step", "fp")
+
+# Each step asks for one parameter. Scalar steps are done once the parameter
+# is set; multi-select steps are done when the user presses NEXT_OPTION.
+# "when" (optional) names a list parameter that must be non-empty.
+HEARING_STEPS: List[Dict[str, Any]] = [
+    {
+        "name": "loc",
+        "methods": ("step",),
+        "prompt": "想定ステップ数 (LOC) を選択してください。",
+        "options": ["1000 LOC", "10000 LOC", "50000 LOC", "100000 LOC"],
+    },
+    {
+        "name": "fp_count",
+        "methods": ("fp",),
+        "prompt": "想定FP数を選択してください。",
+        "options": ["100 FP", "300 FP", "500 FP", "1000 FP"],
+    },
+    {
+        "name": "man_days_per_unit",
+        "methods": ("step",),
+        "prompt": "生産性 (人日/step) を選択してください。",
+        "options": ["標準 (0.05人日/step)", "高 (0.04人日/step)", "低 (0.06人日/step)"],
+    },
+    {
+        "name": "man_days_per_unit",
+        "methods": ("fp",),
+        "prompt": "生産性 (人日/FP) を選択してください。",
+        "options": ["標準 (1.0人日/FP)", "高 (0.8人日/FP)", "低 (1.2人日/FP)"],
+    },
+    {
+        "name": "features",
+        "methods": ALL_METHODS,
+        "multi": True,
+        "prompt": "必要な機能を選択してください（複数選択できます）。選び終わったら [次へ] を押してください。",
+        "options": ["ユーザー認証", "一覧表示・検索", "詳細表示", "CRUD操作", "決済機能",
+                    "プッシュ通知", "リアルタイム機能", "外部API連携", "データ移行", "管理画面"],
+    },
+    {
+        "name": "complexity",
+        "methods": ALL_METHODS,
+        "prompt": "システムの複雑度を選択してください。",
+        "options": ["簡易", "標準", "高難度"],
+    },
+    {
+        "name": "screen_count",
+        "methods": ("screen",),
+        "prompt": "想定画面数を選択してください。",
+        "options": ["10画面", "20画面", "30画面", "50画面"],
+    },
+    {
+        "name": "design_scope",
+        "params": ("phase2_items", "phase3_items"),
+        "methods": ALL_METHODS,
+        "multi": True,
+        "prompt": "設計・デザインの範囲を選択してください（複数選択できます）。選び終わったら [次へ] を押してください。",
+        "options": ["IA設計", "WF作成", "Figma化", "UIデザイン", "デザインシステム",
+                    "プロトタイプ", "アイコン・ロゴ"],
+    },
+    {
+        "name": "confidence",
+        "methods": ALL_METHODS,
+        "when": "phase3_items",
+        "prompt": "デザイン要件の具体性を選択してください（デザイン費用の概算幅に反映されます）。",
+        "options": ["要件がまだ曖昧", "標準的", "仕様確定済み"],
+    },
+]
+
+READY_PROMPT = "見積もりに必要な情報が揃いました。見積もりを作成しますか？"
+DRAFT_PROMPT = "次の内容で記録してよければ、該当するボタンを押してください。"
+
+# Button labels for numeric parameters (parsed back by param_matcher)
+NUMBER_LABELS = {"screen_count": "{}画面", "loc": "{} LOC", "fp_count": "{} FP"}
+UNIT_LABELS = {"step": "step", "fp": "FP"}
+
+
+def is_enabled() -> bool:
+    """HEARING_FAST_PATH=false で無効化（全ターンをLLMで応答）"""
+    return os.getenv("HEARING_FAST_PATH", "true").lower() not in ("0", "false", "no")
+
+
+def _is_done(step: Dict[str, Any], params: Dict[str, Any], completed: Iterable[str]) -> bool:
+    if step.get("multi"):
+        return step["name"] in completed
+    return params.get(step["name"]) is not None
+
+
+def _applies(step: Dict[str, Any], params: Dict[str, Any]) -> bool:
+    if params.get("method") not in step["methods"]:
+        return False
+    return not step.get("when") or bool(params.get(step["when"]))
+
+
+def next_step(params: Dict[str, Any], completed: Iterable[str]) -> Optional[Dict[str, Any]]:
+    """Next unanswered step, or None when every mechanical question is answered"""
+    completed = set(completed)
+    for step in HEARING_STEPS:
+        if _applies(step, params) and not _is_done(step, params, completed):
+            return step
+    return None
+
+
+def _selected(step: Dict[str, Any], params: Dict[str, Any]) -> List[str]:
+    selected: List[str] = []
+    for key in step.get("params", (step["name"],)):
+        selected.extend(params.get(key) or [])
+    return selected
+
+
+def reply(params: Dict[str, Any], completed: Iterable[str],
+          mapping: Dict[str, str], recorded: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Canned message and options for the next hearing step.
+
+    mapping is the label -> parameter value table (PARAM_MAPPING) used to hide
+    already selected items in multi-select steps.
+    """
+    step = next_step(params, completed)
+    ack = f"「{recorded}」を記録しました。\n" if recorded else ""
+
+    if step is None:
+        labels = [CALCULATE_OPTION]
+        prompt = READY_PROMPT
+    elif step.get("multi"):
+        chosen = set(_selected(step, params))
+        labels = [label for label in step["options"] if mapping.get(label) not in chosen]
+        labels.append(NEXT_OPTION)
+        prompt = step["prompt"]
+    else:
+        labels = list(step["options"])
+        prompt = step["prompt"]
+
+    buttons = " ".join(f"[{label}]" for label in labels)
+    return {
+        "message": f"{ack}{prompt}\n{buttons}",
+        "options": [{"label": label, "value": label} for label in labels],
+    }
+
+
+def complete_current(params: Dict[str, Any], completed: List[str]) -> None:
+    """Close the current multi-select step (user pressed NEXT_OPTION)"""
+    step = next_step(params, completed)
+    if step is not None and step.get("multi") and step["name"] not in completed:
+        completed.append(step["name"])
+
+
+def _is_recorded(params: Dict[str, Any], key: str, value: Any) -> bool:
+    current = params.get(key)
+    return value in current if isinstance(current, list) else current == value
+
+
+def _draft_label(param: str, value: Any, params: Dict[str, Any],
+                 mapping: Dict[str, str]) -> Optional[str]:
+    """Option label that records param=value under the chosen method, if any"""
+    method = params.get("method")
+    if param == "man_days_per_unit":
+        return f"{value:g}人日/{UNIT_LABELS[method]}" if method in UNIT_LABELS else None
+    for step in HEARING_STEPS:
+        if param not in step.get("params", (step["name"],)) or not _applies(step, params):
+            continue
+        if param in NUMBER_LABELS:
+            return NUMBER_LABELS[param].format(value)
+        for label in step["options"]:
+            if mapping.get(label) == value:
+                return label
+    return None
+
+
+def draft_reply(params: Dict[str, Any], completed: Iterable[str],
+                mapping: Dict[str, str], mentions: Iterable[Any]) -> Optional[Dict[str, Any]]:
+    """
+    Confirmation prompt for parameters recognized in free text.
+
+    mentions are param_matcher mentions (`param`, `value`). Nothing is
+    recorded here: each value not recorded yet is offered as the option
+    label that records it, followed by the current step's options. None if
+    no mention maps to an option under the chosen method.
+    """
+    labels: List[str] = []
+    for mention in mentions:
+        if mention.param == "method" or _is_recorded(params, mention.param, mention.value):
+            continue
+        label = _draft_label(mention.param, mention.value, params, mapping)
+        if label is not None and label not in labels:
+            labels.append(label)
+    if not labels:
+        return None
+    step = reply(params, completed, mapping)
+    options = labels + [o["label"] for o in step["options"] if o["label"] not in labels]
+    buttons = " ".join(f"[{label}]" for label in options)
+    return {
+        "message": f"{DRAFT_PROMPT}\n{buttons}",
+        "options": [{"label": label, "value": label} for label in options],
+    }
@@ -0,0 +1,203 @@
+"""
+Token-budgeted conversation history for prompt rendering.
+
+The last HISTORY_KEEP_MESSAGES messages are rendered verbatim; older ones are
+compacted into a running summary cached on the session (only messages that
+have not been summarized yet are processed on each turn). The whole prompt —
+template, knowledge, collected_params, user input, calc result and history —
+is kept under PROMPT_TOKEN_BUDGET, and the tokens saved against rendering
+the full history are counted for /admin/stats. The full-history size comes
+from the running count the session keeps as messages are appended
+(`message_tokens`), so the whole history is not re-tokenized on every turn.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from chunking import count_tokens
+
+DEFAULT_PROMPT_TOKEN_BUDGET = 8000
+DEFAULT_KEEP_MESSAGES = 6
+DEFAULT_SUMMARY_TOKENS = 600
+SUMMARY_LINE_CHARS = 120
+
+# Prefix of final proposal drafts; they are summarized as a single marker line
+PROPOSAL_HEADER = "# プロジェクト見積もり・提案書"
+_PASSAGE_SEPARATOR = "\n\n--- Source:"
+
+
+def settings() -> Dict[str, int]:
+    """PROMPT_TOKEN_BUDGET / HISTORY_KEEP_MESSAGES / HISTORY_SUMMARY_TOKENS"""
+    return {
+        "budget": int(os.getenv("PROMPT_TOKEN_BUDGET", DEFAULT_PROMPT_TOKEN_BUDGET)),
+        "keep_messages": int(os.getenv("HISTORY_KEEP_MESSAGES", DEFAULT_KEEP_MESSAGES)),
+        "summary_tokens": int(os.getenv("HISTORY_SUMMARY_TOKENS", DEFAULT_SUMMARY_TOKENS)),
+    }
+
+
+class PromptStats:
+    """Cumulative prompt size counters (tokens saved by compaction)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.prompts = 0
+        self.prompt_tokens = 0
+        self.saved_tokens = 0
+        self.summarized_messages = 0
+
+    def record(self, prompt_tokens: int, saved_tokens: int, summarized: int) -> None:
+        with self._lock:
+            self.prompts += 1
+            self.prompt_tokens += prompt_tokens
+            self.saved_tokens += saved_tokens
+            self.summarized_messages += summarized
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "prompts": self.prompts,
+            "prompt_tokens": self.prompt_tokens,
+            "saved_tokens": self.saved_tokens,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.prompts, 1) if self.prompts else 0.0,
+            "summarized_messages": self.summarized_messages,
+        }
+
+
+stats = PromptStats()
+
+
+def new_summary() -> Dict[str, Any]:
+    """Empty running summary (`covered` = number of history messages folded in)"""
+    return {"lines": [], "covered": 0}
+
+
+def summarize_message(message: Dict[str, Any]) -> str:
+    """One short line per message; proposal drafts collapse to a marker"""
+    content = (message.get("content") or "").strip()
+    if PROPOSAL_HEADER in content:
+        return f"{message.get('role')}: （見積もり提案書を提示）"
+    first_line = content.split("\n", 1)[0].strip()
+    if len(first_line) > SUMMARY_LINE_CHARS or "\n" in content:
+        first_line = first_line[:SUMMARY_LINE_CHARS] + "…"
+    return f"{message.get('role')}: {first_line}"
+
+
+def _render(messages: List[Any]) -> str:
+    # Session history holds conversation.Message records (to_dict), rendered windows plain dicts
+    return json.dumps(messages, ensure_ascii=False, default=lambda m: m.to_dict())
+
+
+def message_tokens(message: Any) -> int:
+    """Tokens of one rendered history entry (sessions keep a running total of these)"""
+    return count_tokens(_render([message]))
+
+
+def compact_history(history: List[Dict[str, Any]], summary: Dict[str, Any], budget: int,
+                    keep_messages: int = DEFAULT_KEEP_MESSAGES,
+                    summary_tokens: int = DEFAULT_SUMMARY_TOKENS,
+                    counter: Optional[Callable[[str], int]] = None
+                    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Fit the history into `budget` tokens.
+
+    Returns (messages to render, updated summary). The summary is updated
+    incrementally: messages before the verbatim window are folded in once.
+    """
+    counter = counter or count_tokens
+    if summary["covered"] > len(history):
+        # History was replaced (e.g. restored from the client); start over
+        summary = new_summary()
+    summary = {"lines": list(summary["lines"]), "covered": summary["covered"]}
+
+    def fold(until: int) -> None:
+        for message in history[summary["covered"]:until]:
+            summary["lines"].append(summarize_message(message))
+        summary["covered"] = max(summary["covered"], until)
+
+    def cap_summary(limit: int) -> None:
+        while summary["lines"] and counter("\n".join(summary["lines"])) > limit:
+            summary["lines"].pop(0)
+
+    def window() -> List[Dict[str, Any]]:
+        recent = [{"role": m.get("role"), "content": m.get("content")}
+                  for m in history[summary["covered"]:]]
+        if summary["lines"]:
+            recent.insert(0, {"role": "summary", "content": "\n".join(summary["lines"])})
+        return recent
+
+    fold(max(0, len(history) - keep_messages))
+    cap_summary(min(summary_tokens, max(0, budget)))
+
+    messages = window()
+    # Under budget pressure fold more of the verbatim window (keep the latest message)
+    while counter(_render(messages)) > budget and summary["covered"] < len(history) - 1:
+        fold(summary["covered"] + 1)
+        cap_summary(min(summary_tokens, max(0, budget)))
+        messages = window()
+    while counter(_render(messages)) > budget and summary["lines"]:
+        summary["lines"].pop(0)
+        messages = window()
+    return messages, summary
+
+
+def trim_knowledge(knowledge: str, max_tokens: int,
+                   counter: Optional[Callable[[str], int]] = None) -> str:
+    """Drop trailing passages (lowest ranked) until the knowledge block fits"""
+    counter = counter or count_tokens
+    if counter(knowledge) <= max_tokens:
+        return knowledge
+    passages = knowledge.split(_PASSAGE_SEPARATOR)
+    while len(passages) > 1:
+        passages.pop()
+        trimmed = _PASSAGE_SEPARATOR.join(passages)
+        if counter(trimmed) <= max_tokens:
+            return trimmed
+    return ""
+
+
+def fit_prompt(history: List[Dict[str, Any]], summary: Optional[Dict[str, Any]],
+               knowledge: str, fixed_parts: List[str], template_tokens: int = 0,
+               config: Optional[Dict[str, int]] = None,
+               full_history_tokens: Optional[int] = None
+               ) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any], Dict[str, int]]:
+    """
+    Split PROMPT_TOKEN_BUDGET between the fixed prompt parts, the knowledge
+    block and the history.
+
+    Returns (knowledge, history messages, updated summary, usage) where usage
+    has prompt_tokens / full_history_tokens / history_tokens / saved_tokens.
+    `full_history_tokens` is the session's running count; it is only summed
+    here per message when the caller does not track one.
+    """
+    config = config or settings()
+    budget = config["budget"]
+    fixed = template_tokens + sum(count_tokens(part) for part in fixed_parts)
+    # Knowledge may use whatever is left after reserving room for the summary
+    knowledge = trim_knowledge(knowledge or "", max(0, budget - fixed - config["summary_tokens"]))
+    history_budget = max(0, budget - fixed - count_tokens(knowledge))
+
+    previous = summary or new_summary()
+    messages, summary = compact_history(history, previous, history_budget,
+                                        keep_messages=config["keep_messages"],
+                                        summary_tokens=config["summary_tokens"])
+    full_tokens = full_history_tokens
+    if full_tokens is None:
+        full_tokens = sum(message_tokens(m) for m in history)
+    history_tokens = count_tokens(_render(messages))
+    usage = {
+        "prompt_tokens": fixed + count_tokens(knowledge) + history_tokens,
+        "full_history_tokens": full_tokens,
+        "history_tokens": history_tokens,
+        "saved_tokens": max(0, full_tokens - history_tokens),
+    }
+    stats.record(usage["prompt_tokens"], usage["saved_tokens"],
+                 summary["covered"] - min(previous["covered"], summary["covered"]))
+    return knowledge, messages, summary, usage
+
+
+def get_prompt_stats() -> Dict[str, Any]:
+    return stats.as_dict()
@@ -1,76 +1,362 @@
-import os
+"""
+Incremental indexer for the Azure AI Search knowledge index (estimation-rags).
+
+Chunks (see chunking.py) are compared against a local manifest of content
+hashes, and only the difference is sent: `mergeOrUpload` for new or changed
+chunks and `delete` for chunks that disappeared, in bounded parallel
+batches. The search index is never emptied while it is being updated.
+
+Schema changes use blue/green aliasing: a new physical index
+(`<alias>-<timestamp>`) is filled completely, then the alias that
+`lookup_knowledge` queries is switched to it and the old index is dropped.
+
+Usage:
+    python index_rags.py              # apply changed chunks
+    python index_rags.py --dry-run    # print the diff without touching Azure
+    python index_rags.py --rebuild    # full blue/green rebuild
+    python index_rags.py --migrate-legacy  # one-off: replace a legacy physical
+                                           # index named like the alias
+"""
+
 import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceNotFoundError
 from azure.search.documents import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
+    SearchAlias,
     SearchIndex,
     SimpleField,
     SearchFieldDataType,
     SearchableField,
 )
 from dotenv import load_dotenv
+from chunking import chunk_directory, chunk_settings
+from ttl_cache import stable_hash
 
 # .env ファイルを明示的に指定して読み込む
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
 
-def recreate_index(endpoint, key, index_name):
-    client = SearchIndexClient(endpoint, AzureKeyCredential(key))
-    
-    index = SearchIndex(
-        name=index_name,
-        fields=[
-            SimpleField(name="id", type=SearchFieldDataType.String, key=True),
-            SearchableField(name="content", type=SearchFieldDataType.String, analyzer_name="ja.microsoft"),
-            SimpleField(name="source", type=SearchFieldDataType.String),
-        ]
-    )
-    
+MANIFEST_VERSION = 1
+DEFAULT_ALIAS = "estimation-rags"
+DEFAULT_RAGS_DIR = os.path.join(os.path.dirname(__file__), "rags")
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(__file__), ".rags_manifest.json")
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_WORKERS = 4
+
+
+def index_fields() -> List[Any]:
+    return [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+        SearchableField(name="content", type=SearchFieldDataType.String, analyzer_name="ja.microsoft"),
+        SimpleField(name="source", type=SearchFieldDataType.String, filterable=True),
+        SearchableField(name="heading_path", type=SearchFieldDataType.String, analyzer_name="ja.microsoft"),
+        SimpleField(name="chunk_index", type=SearchFieldDataType.Int32, filterable=True, sortable=True),
+    ]
+
+
+def schema_fingerprint(fields: Optional[List[Any]] = None) -> str:
+    """Hash of the field definitions; a change requires a blue/green rebuild"""
+    return stable_hash([f.as_dict() for f in (fields or index_fields())])
+
+
+def document_hash(doc: Dict[str, Any]) -> str:
+    return stable_hash(doc)
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """Manifest of the last successful run (empty if missing or unreadable)"""
     try:
-        # 既存のインデックスを削除（スキーマ変更を反映するため）
-        print(f"Deleting existing index '{index_name}'...")
-        client.delete_index(index_name)
-    except Exception as e:
-        print(f"Index '{index_name}' did not exist or could not be deleted: {e}")
-        
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": MANIFEST_VERSION, "index": None, "schema": None, "documents": {}}
+
+
+def save_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def plan_changes(docs: List[Dict[str, Any]], indexed: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Diff the current chunks against the manifest ({chunk id: content hash}).
+
+    Returns {"upserts": [docs], "deletes": [ids], "unchanged": n, "hashes": {id: hash}}.
+    """
+    hashes = {doc["id"]: document_hash(doc) for doc in docs}
+    upserts = [doc for doc in docs if indexed.get(doc["id"]) != hashes[doc["id"]]]
+    deletes = sorted(doc_id for doc_id in indexed if doc_id not in hashes)
+    return {
+        "upserts": upserts,
+        "deletes": deletes,
+        "unchanged": len(docs) - len(upserts),
+        "hashes": hashes,
+    }
+
+
+def _batches(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _send(action: Any, batch: List[Dict[str, Any]]) -> Dict[str, bool]:
+    """Run one batch; returns {key: succeeded}. A failed request fails the whole batch"""
     try:
-        client.create_index(index)
-        print(f"Index '{index_name}' created.")
+        return {r.key: bool(r.succeeded) for r in action(documents=batch)}
     except Exception as e:
-        raise e
-
-def upload_documents(endpoint, key, index_name, rags_dir):
-    client = SearchClient(endpoint, index_name, AzureKeyCredential(key))
-    
-    docs = []
-    files = glob.glob(os.path.join(rags_dir, "*.md"))
-    
-    for i, file_path in enumerate(files):
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            filename = os.path.basename(file_path)
-            doc = {
-                "id": str(i),
-                "content": content,
-                "source": filename
-            }
-            docs.append(doc)
-    
-    if docs:
-        result = client.upload_documents(documents=docs)
-        print(f"Uploaded {len(docs)} documents.")
-    else:
-        print("No documents found to upload.")
+        print(f"Batch of {len(batch)} failed: {e}")
+        return {doc["id"]: False for doc in batch}
+
+
+def apply_changes(client: Any, plan: Dict[str, Any], indexed: Dict[str, str],
+                  batch_size: int = DEFAULT_BATCH_SIZE,
+                  max_workers: int = DEFAULT_MAX_WORKERS) -> Dict[str, Any]:
+    """
+    Send the planned upserts/deletes in parallel batches and return the new
+    {id: hash} map. Failed keys keep their previous manifest state so the
+    next run retries them.
+    """
+    jobs = [(client.merge_or_upload_documents, batch)
+            for batch in _batches(plan["upserts"], batch_size)]
+    jobs += [(client.delete_documents, batch)
+             for batch in _batches([{"id": doc_id} for doc_id in plan["deletes"]], batch_size)]
+
+    results: Dict[str, bool] = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for outcome in executor.map(lambda job: _send(*job), jobs):
+            results.update(outcome)
+
+    updated = dict(indexed)
+    failed = []
+    for doc in plan["upserts"]:
+        if results.get(doc["id"]):
+            updated[doc["id"]] = plan["hashes"][doc["id"]]
+        else:
+            failed.append(doc["id"])
+    for doc_id in plan["deletes"]:
+        if results.get(doc_id):
+            updated.pop(doc_id, None)
+        else:
+            failed.append(doc_id)
+    return {"documents": updated, "failed": failed}
+
+
+def _current_alias_target(index_client: Any, alias: str) -> Optional[str]:
+    try:
+        indexes = index_client.get_alias(alias).indexes
+        return indexes[0] if indexes else None
+    except ResourceNotFoundError:
+        return None
+
+
+def _index_exists(index_client: Any, name: str) -> bool:
+    try:
+        index_client.get_index(name)
+        return True
+    except ResourceNotFoundError:
+        return False
+
+
+def wait_for_documents(client: Any, expected: int, timeout: float = 30.0) -> bool:
+    """True once the index reports at least `expected` documents (counts lag uploads)"""
+    deadline = time.monotonic() + timeout
+    while True:
+        count = client.get_document_count()
+        if count >= expected:
+            return True
+        if time.monotonic() >= deadline:
+            print(f"Index holds {count} of {expected} documents.")
+            return False
+        time.sleep(2)
+
+
+def print_legacy_instructions(alias: str, index_name: str) -> None:
+    print(f"'{alias}' is still a physical index, so the alias of the same name cannot be "
+          f"created without deleting it. The new index '{index_name}' is complete; "
+          "cut over as a maintenance step:")
+    print(f"  1. Set AZURE_AI_SEARCH_INDEX_ALIAS={index_name} on the app and restart it "
+          "(it then queries the new index directly)")
+    print(f"  2. python index_rags.py --alias {alias} --migrate-legacy")
+    print(f"  3. Set AZURE_AI_SEARCH_INDEX_ALIAS back to {alias} and restart the app")
+
+
+def swap_alias(index_client: Any, alias: str, index_name: str,
+               migrate_legacy: bool = False) -> bool:
+    """
+    Point the alias at index_name. Returns False, changing nothing, while a
+    legacy physical index still holds the alias name and migrate_legacy is
+    not set: deleting it is a one-off maintenance step (see
+    print_legacy_instructions), never a side effect of a routine sync.
+    """
+    if _index_exists(index_client, alias):
+        if not migrate_legacy:
+            print_legacy_instructions(alias, index_name)
+            return False
+        # 旧構成（エイリアス名と同名の物理インデックス）からの一度きりの移行
+        print(f"Deleting legacy index '{alias}' to free the alias name...")
+        index_client.delete_index(alias)
+        try:
+            index_client.create_or_update_alias(SearchAlias(name=alias, indexes=[index_name]))
+        except Exception:
+            print(f"Alias creation failed after the legacy index was deleted; keep the app on "
+                  f"AZURE_AI_SEARCH_INDEX_ALIAS={index_name} and rerun with --migrate-legacy.")
+            raise
+        return True
+    index_client.create_or_update_alias(SearchAlias(name=alias, indexes=[index_name]))
+    return True
+
+
+def whole_file_ids(rags_dir: str) -> List[str]:
+    """Keys of the documents the pre-chunking uploader wrote (one per file, md5(filename))"""
+    return [hashlib.md5(os.path.basename(path).encode()).hexdigest()
+            for path in sorted(glob.glob(os.path.join(rags_dir, "*.md")))]
+
+
+def delete_whole_file_documents(client: Any, rags_dir: str = DEFAULT_RAGS_DIR) -> int:
+    """
+    Delete the whole-file documents left by the old upload_rags.py, which
+    would otherwise be retrieved next to the chunks of the same file.
+    Deleting a key that does not exist succeeds, so this is safe to repeat.
+    """
+    ids = whole_file_ids(rags_dir)
+    if not ids:
+        return 0
+    results = _send(client.delete_documents, [{"id": doc_id} for doc_id in ids])
+    return sum(results.values())
+
+
+def print_plan(plan: Dict[str, Any], rebuild_target: Optional[str] = None) -> None:
+    if rebuild_target:
+        print(f"Schema changed or rebuild requested: new index '{rebuild_target}' + alias swap")
+    for doc in plan["upserts"]:
+        print(f"  mergeOrUpload {doc['id']}  {doc['source']} > {doc['heading_path']}")
+    for doc_id in plan["deletes"]:
+        print(f"  delete        {doc_id}")
+    print(f"{len(plan['upserts'])} upserts, {len(plan['deletes'])} deletes, "
+          f"{plan['unchanged']} unchanged")
+
+
+def sync_index(endpoint: str, key: str, rags_dir: str = DEFAULT_RAGS_DIR,
+               alias: str = DEFAULT_ALIAS, manifest_path: str = DEFAULT_MANIFEST_PATH,
+               dry_run: bool = False, rebuild: bool = False,
+               batch_size: int = DEFAULT_BATCH_SIZE, max_workers: int = DEFAULT_MAX_WORKERS,
+               migrate_legacy: bool = False, index_client: Any = None,
+               search_client_factory: Any = None) -> Dict[str, Any]:
+    """
+    Bring the search index in line with rags_dir.
+
+    Incremental when the schema is unchanged; otherwise (or with rebuild=True)
+    fills a new index and swaps the alias once every chunk is indexed. The
+    old index is dropped only after the alias is confirmed to point at the
+    new one. A legacy physical index named like the alias is deleted only
+    with migrate_legacy=True; until then the filled index is kept in the
+    manifest and the result has "alias_pending": True.
+    """
+    docs = chunk_directory(rags_dir, **chunk_settings())
+    manifest = load_manifest(manifest_path)
+    schema = schema_fingerprint()
+    needs_rebuild = rebuild or not manifest["index"] or manifest["schema"] != schema
+
+    target = f"{alias}-{time.strftime('%Y%m%d%H%M%S')}" if needs_rebuild else manifest["index"]
+    indexed = {} if needs_rebuild else manifest["documents"]
+    plan = plan_changes(docs, indexed)
+    print_plan(plan, target if needs_rebuild else None)
+    if dry_run:
+        return {"plan": plan, "index": target, "applied": False}
+
+    credential = AzureKeyCredential(key) if key else None
+    index_client = index_client or SearchIndexClient(endpoint, credential)
+    search_client_factory = search_client_factory or (
+        lambda name: SearchClient(endpoint, name, credential))
+
+    if needs_rebuild:
+        index_client.create_index(SearchIndex(name=target, fields=index_fields()))
+        print(f"Index '{target}' created.")
+
+    client = search_client_factory(target)
+    result = apply_changes(client, plan, indexed, batch_size=batch_size, max_workers=max_workers)
+    if result["failed"]:
+        print(f"{len(result['failed'])} documents failed; rerun to retry.")
+        if needs_rebuild:
+            # 未完成のインデックスにはエイリアスを切り替えない
+            index_client.delete_index(target)
+            return {"plan": plan, "index": target, "applied": False, "failed": result["failed"]}
+
+    previous = _current_alias_target(index_client, alias)
+    swapped = previous == target
+    switched = False
+    if not swapped:
+        if migrate_legacy and not wait_for_documents(client, len(result["documents"])):
+            print(f"Index '{target}' is incomplete; the legacy index was kept. Rerun to retry.")
+        else:
+            swapped = swap_alias(index_client, alias, target, migrate_legacy=migrate_legacy)
+        if swapped:
+            if _current_alias_target(index_client, alias) != target:
+                raise RuntimeError(f"Alias '{alias}' does not point at '{target}' after the swap")
+            print(f"Alias '{alias}' -> '{target}'")
+            switched = True
+            if previous:
+                index_client.delete_index(previous)
+                print(f"Old index '{previous}' deleted.")
+
+    if plan["upserts"] or plan["deletes"] or switched:
+        # 共有キャッシュ（RAG_CACHE_BACKEND=redis）に残った旧インデックスの検索結果を破棄する
+        from lookup_knowledge import invalidate_retrieval_cache
+        invalidate_retrieval_cache()
+
+    save_manifest(manifest_path, {
+        "version": MANIFEST_VERSION,
+        "alias": alias,
+        "index": target,
+        "schema": schema,
+        "documents": result["documents"],
+    })
+    return {"plan": plan, "index": target, "applied": True, "failed": result["failed"],
+            "alias_pending": not swapped}
+
 
 if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Incrementally index rags/ into Azure AI Search")
+    parser.add_argument("--dry-run", action="store_true", help="Print the diff without uploading")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Build a new index and swap the alias (blue/green)")
+    parser.add_argument("--migrate-legacy", action="store_true",
+                        help="Delete a legacy physical index named like the alias and create "
+                             "the alias (maintenance step)")
+    parser.add_argument("--rags-dir", default=DEFAULT_RAGS_DIR)
+    parser.add_argument("--alias", default=os.getenv("AZURE_AI_SEARCH_INDEX_ALIAS", DEFAULT_ALIAS))
+    parser.add_argument("--manifest", default=os.getenv("RAG_MANIFEST_PATH", DEFAULT_MANIFEST_PATH))
+    parser.add_argument("--batch-size", type=int,
+                        default=int(os.getenv("RAG_INDEX_BATCH_SIZE", DEFAULT_BATCH_SIZE)))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.getenv("RAG_INDEX_WORKERS", DEFAULT_MAX_WORKERS)))
+    args = parser.parse_args()
+
     endpoint = os.getenv("AZURE_AI_SEARCH_ENDPOINT")
     key = os.getenv("AZURE_AI_SEARCH_API_KEY")
-    index_name = "estimation-rags"
-    rags_dir = os.path.join(os.path.dirname(__file__), "rags")
-    
-    if not endpoint or not key:
+
+    if not args.dry_run and (not endpoint or not key):
         print("Error: AZURE_AI_SEARCH_ENDPOINT or AZURE_AI_SEARCH_API_KEY not set in .env")
         print(f"DEBUG: ENDPOINT={endpoint}")
-    else:
-        recreate_index(endpoint, key, index_name)
-        upload_documents(endpoint, key, index_name, rags_dir)
+        sys.exit(1)
+
+    outcome = sync_index(endpoint, key, rags_dir=args.rags_dir, alias=args.alias,
+                         manifest_path=args.manifest, dry_run=args.dry_run,
+                         rebuild=args.rebuild, batch_size=args.batch_size,
+                         max_workers=args.workers, migrate_legacy=args.migrate_legacy)
+    sys.exit(1 if outcome.get("failed") or outcome.get("alias_pending") else 0)
@@ -0,0 +1,326 @@
+"""
+Process-wide admission control for Azure OpenAI calls.
+
+Every /score turn that reaches the LLM goes through `get_gateway()`:
+
+- at most LLM_MAX_CONCURRENCY calls are in flight; further callers wait in a
+  bounded queue (LLM_MAX_QUEUE) and are rejected once
+  LLM_QUEUE_TIMEOUT_SECONDS have passed since they arrived
+- token buckets keep the request and token rate under the deployment quota
+  (LLM_RPM_LIMIT / LLM_TPM_LIMIT per process, 0 = unlimited). Azure enforces
+  quotas over 10-second windows, so a bucket bursts at most 10 seconds' worth
+- a 429 pauses every caller for its Retry-After (`retry-after-ms` /
+  `retry-after` headers, otherwise exponential backoff); connection errors
+  and 5xx back off only the failing call. Either way the call is retried up
+  to LLM_MAX_RETRIES times within the same deadline
+
+Rejections raise `GatewaySaturated` with a retry hint in seconds, which the
+API returns as a structured 503. Retries live here rather than in the SDK
+(AZURE_OPENAI_MAX_RETRIES defaults to 0) so each 429 is seen and counted once.
+"""
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional
+
+import metrics
+from chunking import count_tokens
+
+# Azure OpenAI rate limits are evaluated per 10 seconds (RPM / 6 per window)
+QUOTA_WINDOW_SECONDS = 10.0
+
+QUEUE_FULL = "queue_full"
+TIMEOUT = "timeout"
+RATE_LIMITED = "rate_limited"
+
+LLM_QUEUE_SECONDS = metrics.registry.register(metrics.Histogram(
+    "estimation_llm_queue_wait_seconds", "Time LLM calls waited for admission",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)))
+LLM_REJECTED = metrics.registry.register(metrics.Counter(
+    "estimation_llm_rejected_total",
+    "LLM calls rejected by the gateway (reason=queue_full|timeout|rate_limited)"))
+LLM_RETRIES = metrics.registry.register(metrics.Counter(
+    "estimation_llm_retries_total", "LLM call retries (reason=rate_limited|error)"))
+
+
+class GatewaySaturated(Exception):
+    """The LLM call was not admitted (or kept being rate limited)"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"LLM capacity exhausted ({reason}); retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills `rate` units per second up to `capacity` (not thread-safe; guarded by the gateway)"""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (larger amounts wait for a full bucket)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+def quota_bucket(per_minute: int, now: float) -> Optional[TokenBucket]:
+    if per_minute <= 0:
+        return None
+    return TokenBucket(per_minute / 60.0, per_minute * QUOTA_WINDOW_SECONDS / 60.0, now)
+
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Delay requested by a 429 response (retry-after-ms, retry-after seconds or HTTP date)"""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    """Tokens charged against TPM: Azure counts the prompt plus max_tokens at admission"""
+    return sum(count_tokens(str(m.get("content") or "")) for m in messages) + max_tokens
+
+
+class GatewayStream:
+    """A streaming response that holds its gateway slot until consumed or closed"""
+
+    def __init__(self, stream: Any, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._closed = False
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            for chunk in self._stream:
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+        self._release()
+
+    def __enter__(self) -> "GatewayStream":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class LLMGateway:
+    """Concurrency cap, bounded wait queue, quota buckets and retry policy for LLM calls"""
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 32,
+                 queue_timeout: float = 10.0, rpm_limit: int = 0, tpm_limit: int = 0,
+                 max_retries: int = 2, backoff_base: float = 1.0, backoff_max: float = 20.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        now = time.monotonic()
+        self._requests = quota_bucket(rpm_limit, now)
+        self._tokens = quota_bucket(tpm_limit, now)
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        # Counters exposed in /admin/stats
+        self.admitted = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.rejected = {QUEUE_FULL: 0, TIMEOUT: 0, RATE_LIMITED: 0}
+
+    def _admission_wait(self, tokens: int, now: float) -> float:
+        """Seconds until this call could be admitted (inf: wait for a slot to free up)"""
+        wait = max(0.0, self.paused_until - now)
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_time(tokens, now))
+        if wait == 0.0 and self.in_flight >= self.max_concurrency:
+            return float("inf")
+        return wait
+
+    def _retry_hint(self, now: float) -> float:
+        hint = max(1.0, self.paused_until - now)
+        if self._requests is not None:
+            hint = max(hint, self._requests.wait_time(1, now))
+        return round(hint, 1)
+
+    def _reject(self, reason: str, retry_after: float) -> GatewaySaturated:
+        with self._cond:
+            self.rejected[reason] += 1
+        LLM_REJECTED.inc(reason=reason)
+        return GatewaySaturated(reason, retry_after)
+
+    def acquire(self, tokens: int, deadline: float) -> None:
+        """Wait for a slot and quota until `deadline` (monotonic), or raise GatewaySaturated"""
+        started = time.monotonic()
+        with self._cond:
+            if self.waiting >= self.max_queue:
+                raise self._reject(QUEUE_FULL, self._retry_hint(started))
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._admission_wait(tokens, now)
+                    if wait == 0.0:
+                        break
+                    if now >= deadline:
+                        raise self._reject(TIMEOUT, self._retry_hint(now))
+                    self._cond.wait(min(wait, deadline - now))
+                if self._requests is not None:
+                    self._requests.take(1, now)
+                if self._tokens is not None:
+                    self._tokens.take(tokens, now)
+                self.in_flight += 1
+                self.admitted += 1
+            finally:
+                self.waiting -= 1
+        LLM_QUEUE_SECONDS.observe(time.monotonic() - started)
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for `seconds` (the deployment answered 429)"""
+        with self._cond:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _create(self, create: Callable[[], Any], tokens: int) -> Any:
+        """Call `create` with admission and retries; the slot stays held on success"""
+        import openai  # Already loaded by the client; not imported with the app
+
+        deadline = time.monotonic() + self.queue_timeout
+        attempt = 0
+        while True:
+            self.acquire(tokens, deadline)
+            try:
+                return create()
+            except openai.RateLimitError as e:
+                self.release()
+                delay = retry_after_seconds(e.response.headers) or self._backoff(attempt)
+                # The whole deployment is over quota: hold back every caller, not just this one
+                self.pause(delay)
+                if attempt >= self.max_retries or time.monotonic() + delay > deadline:
+                    raise self._reject(RATE_LIMITED, round(max(1.0, delay), 1)) from e
+                reason = RATE_LIMITED
+            except (openai.APIConnectionError, openai.InternalServerError):
+                self.release()
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay > deadline:
+                    raise
+                time.sleep(delay)
+                reason = "error"
+            except BaseException:
+                self.release()
+                raise
+            attempt += 1
+            with self._cond:
+                self.retries += 1
+            LLM_RETRIES.inc(reason=reason)
+
+    def complete(self, create: Callable[[], Any], tokens: int) -> Any:
+        """Run a non-streaming call through the gateway"""
+        result = self._create(create, tokens)
+        self.release()
+        return result
+
+    def open_stream(self, create: Callable[[], Any], tokens: int) -> GatewayStream:
+        """Start a streaming call; the slot is released when the stream is consumed or closed"""
+        return GatewayStream(self._create(create, tokens), self.release)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "admitted": self.admitted,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "paused_seconds": round(max(0.0, self.paused_until - now), 2),
+                "rejected": dict(self.rejected),
+            }
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """Shared gateway configured from LLM_* environment variables"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway(
+                    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 16)),
+                    max_queue=int(os.getenv("LLM_MAX_QUEUE", 32)),
+                    queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 10)),
+                    rpm_limit=int(os.getenv("LLM_RPM_LIMIT", 0)),
+                    tpm_limit=int(os.getenv("LLM_TPM_LIMIT", 0)),
+                    max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+                    backoff_base=float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 1)),
+                    backoff_max=float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 20)),
+                )
+    return _gateway
+
+
+def reset_gateway() -> None:
+    """Drop the shared gateway so the next call rebuilds it (config reload / tests)"""
+    global _gateway
+    with _gateway_lock:
+        _gateway = None
+
+
+def get_gateway_stats() -> Dict[str, Any]:
+    return get_gateway().stats()
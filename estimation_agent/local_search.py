@@ -0,0 +1,169 @@
+"""
+In-process BM25 retrieval over the markdown knowledge base (rags/).
+
+A zero-network alternative to Azure AI Search for `lookup_knowledge`
+(RAG_BACKEND=local). Documents are the heading-aware chunks produced by
+`chunking.py`. The corpus is Japanese, so text is NFKC-normalized and
+tokenized into character bigrams for CJK runs and lower-cased words for
+ASCII runs. The inverted index can be persisted to JSON and is rebuilt
+automatically when the corpus fingerprint changes.
+
+Usage:
+    python local_search.py --build rags_index.json
+"""
+
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from chunking import chunk_directory, chunk_settings
+
+INDEX_FORMAT_VERSION = 2
+DEFAULT_RAGS_DIR = os.path.join(os.path.dirname(__file__), "rags")
+
+_TOKEN_RE = re.compile(r"[0-9a-z_]+|[\u3040-\u30ff\u3400-\u9fff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """NFKC-normalize and split into ASCII words and CJK character bigrams"""
+    tokens: List[str] = []
+    for match in _TOKEN_RE.finditer(unicodedata.normalize("NFKC", text).lower()):
+        run = match.group()
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def load_documents(rags_dir: str = DEFAULT_RAGS_DIR) -> List[Dict[str, Any]]:
+    """Chunk every markdown file in rags_dir (RAG_CHUNK_TOKENS / RAG_CHUNK_OVERLAP)"""
+    return chunk_directory(rags_dir, **chunk_settings())
+
+
+def corpus_fingerprint(docs: List[Dict[str, Any]]) -> str:
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(doc["id"].encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(doc.get("heading_path", "").encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(doc["content"].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring"""
+
+    def __init__(self, docs: List[Dict[str, Any]], k1: float = 1.5, b: float = 0.75,
+                 fingerprint: Optional[str] = None):
+        self.docs = docs
+        self.k1 = k1
+        self.b = b
+        self.fingerprint = fingerprint or corpus_fingerprint(docs)
+        self.postings: Dict[str, List[List[int]]] = {}
+        self.doc_lengths: List[int] = []
+        for doc_id, doc in enumerate(docs):
+            counts = Counter(tokenize(f"{doc.get('heading_path', '')}\n{doc['content']}"))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append([doc_id, tf])
+        self._prepare()
+
+    def _prepare(self) -> None:
+        n = len(self.docs)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+                    for term, p in self.postings.items()}
+        # Per-document length normalization is query independent
+        self._norms = [self.k1 * (1 - self.b + self.b * length / self.avg_length)
+                       for length in self.doc_lengths]
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """Return up to top_k documents (with a 'score' key) ranked by BM25"""
+        scores: Dict[int, float] = {}
+        for term, qtf in Counter(tokenize(query)).items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in postings:
+                score = qtf * idf * tf * (self.k1 + 1) / (tf + self._norms[doc_id])
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [dict(self.docs[doc_id], score=score) for doc_id, score in best]
+
+    def save(self, path: str) -> None:
+        data = {
+            "version": INDEX_FORMAT_VERSION,
+            "fingerprint": self.fingerprint,
+            "k1": self.k1,
+            "b": self.b,
+            "docs": self.docs,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format: {data.get('version')}")
+        index = cls.__new__(cls)
+        index.docs = data["docs"]
+        index.k1 = data["k1"]
+        index.b = data["b"]
+        index.fingerprint = data["fingerprint"]
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = data["postings"]
+        index._prepare()
+        return index
+
+
+def load_or_build_index(rags_dir: str = DEFAULT_RAGS_DIR,
+                        index_path: Optional[str] = None) -> BM25Index:
+    """
+    Load a persisted index if it matches the current corpus, otherwise build
+    it (and persist it when index_path is given).
+    """
+    docs = load_documents(rags_dir)
+    fingerprint = corpus_fingerprint(docs)
+    if index_path and os.path.exists(index_path):
+        try:
+            index = BM25Index.load(index_path)
+            if index.fingerprint == fingerprint:
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = BM25Index(docs, fingerprint=fingerprint)
+    if index_path:
+        index.save(index_path)
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the local BM25 index over rags/")
+    parser.add_argument("--build", required=True, help="Output path of the index file")
+    parser.add_argument("--rags-dir", default=DEFAULT_RAGS_DIR)
+    args = parser.parse_args()
+
+    built = load_or_build_index(args.rags_dir, args.build)
+    print(f"Indexed {len(built.docs)} documents, {len(built.postings)} terms -> {args.build}")
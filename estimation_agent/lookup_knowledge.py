@@ -1,54 +1,231 @@
 import os
-from typing import List, Dict, Any
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from promptflow.core import tool
+import threading
+import time
+import unicodedata
+from typing import List, Dict, Any, Optional, Tuple
+from flow_tool import tool
 from dotenv import load_dotenv
+from chunking import count_tokens
+from ttl_cache import create_cache, stable_hash
 
 # .env ファイルの読み込み
 load_dotenv()
 
+# Azure AI Search SDK（起動時間短縮のため初回の Azure 検索で import する）
+SearchClient: Any = None
+SearchIndexClient: Any = None
+AzureKeyCredential: Any = None
+
+# ローカル検索インデックス（RAG_BACKEND=local 時に初回利用で構築）
+_local_index = None
+_local_index_lock = threading.Lock()
+
+# 検索結果キャッシュ（RAG_CACHE_BACKEND / RAG_CACHE_SIZE / RAG_CACHE_TTL_SECONDS）
+_retrieval_cache = None
+_retrieval_cache_ready = False
+_retrieval_cache_lock = threading.Lock()
+
+# エイリアスの参照先インデックス名（キャッシュキー用、RAG_ALIAS_REFRESH_SECONDS ごとに再取得）
+_alias_targets: Dict[str, Tuple[str, float]] = {}
+_alias_targets_lock = threading.Lock()
+
+
+def get_local_index():
+    """rags/ のBM25インデックスを返す（RAG_INDEX_PATH があれば永続化ファイルを利用）"""
+    global _local_index
+    if _local_index is None:
+        with _local_index_lock:
+            if _local_index is None:
+                from local_search import load_or_build_index
+                _local_index = load_or_build_index(index_path=os.getenv("RAG_INDEX_PATH") or None)
+    return _local_index
+
+
+def load_search_sdk() -> None:
+    """azure-search-documents を import する（初回の Azure 検索時、またはウォームアップ時）"""
+    global SearchClient, SearchIndexClient, AzureKeyCredential
+    if SearchClient is None:
+        from azure.search.documents import SearchClient
+    if SearchIndexClient is None:
+        from azure.search.documents.indexes import SearchIndexClient
+    if AzureKeyCredential is None:
+        from azure.core.credentials import AzureKeyCredential
+
+
+def get_retrieval_cache():
+    """検索結果キャッシュを返す（RAG_CACHE_BACKEND=none なら None）"""
+    global _retrieval_cache, _retrieval_cache_ready
+    if not _retrieval_cache_ready:
+        with _retrieval_cache_lock:
+            if not _retrieval_cache_ready:
+                _retrieval_cache = create_cache(
+                    "retrieval",
+                    backend=os.getenv("RAG_CACHE_BACKEND", "memory"),
+                    maxsize=int(os.getenv("RAG_CACHE_SIZE", 2048)),
+                    ttl_seconds=float(os.getenv("RAG_CACHE_TTL_SECONDS", 3600))
+                )
+                _retrieval_cache_ready = True
+    return _retrieval_cache
+
+
+def invalidate_retrieval_cache() -> None:
+    """インデックス再構築時に検索結果キャッシュを破棄する"""
+    with _alias_targets_lock:
+        _alias_targets.clear()
+    cache = get_retrieval_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def reset_local_index() -> None:
+    """ローカルインデックスを破棄し、次回利用時に再構築する（キャッシュも無効化）"""
+    global _local_index
+    with _local_index_lock:
+        _local_index = None
+    invalidate_retrieval_cache()
+
+
+def get_retrieval_stats() -> Dict[str, Any]:
+    cache = get_retrieval_cache()
+    return cache.stats() if cache is not None else {"backend": "none"}
+
+
+def normalize_query(query: str) -> str:
+    """
+    キャッシュキー用にクエリを正規化する
+    
+    NFKC（全角英数字・半角カナの統一）、小文字化、空白（全角空白を含む）の畳み込み
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).lower().split())
+
+
+def _alias_target(endpoint: str, key: str, alias: str) -> str:
+    """
+    エイリアスが現在参照している物理インデックス名を返す
+
+    index_rags.py の再構築（ブルー/グリーン）ごとに変わるため、他のレプリカも
+    RAG_ALIAS_REFRESH_SECONDS 以内に新しいキャッシュキーへ切り替わる。
+    エイリアスでない（旧構成の物理インデックス）・参照できない場合は名前をそのまま返す
+    """
+    now = time.monotonic()
+    with _alias_targets_lock:
+        cached = _alias_targets.get(alias)
+    if cached and now - cached[1] < float(os.getenv("RAG_ALIAS_REFRESH_SECONDS", 30)):
+        return cached[0]
+    try:
+        load_search_sdk()
+        indexes = SearchIndexClient(endpoint, AzureKeyCredential(key)).get_alias(alias).indexes
+        target = indexes[0] if indexes else alias
+    except Exception:
+        target = alias
+    with _alias_targets_lock:
+        _alias_targets[alias] = (target, now)
+    return target
+
+
+def _index_version(backend: str, endpoint: Optional[str] = None, key: Optional[str] = None,
+                   alias: str = "") -> str:
+    """
+    ローカルはコーパスのフィンガープリント、Azure はエイリアスの参照先インデックス名
+    （RAG_INDEX_VERSION を設定すると併せてキーに含める）
+    """
+    if backend == "local":
+        return get_local_index().fingerprint
+    return f"{_alias_target(endpoint, key, alias)}#{os.getenv('RAG_INDEX_VERSION', '')}"
+
+
+def _passages(results) -> List[Dict[str, Any]]:
+    """キャッシュ可能な形（JSON化できる dict のリスト）に検索結果を変換する"""
+    return [{
+        "source": result.get("source", "unknown"),
+        "heading_path": result.get("heading_path"),
+        "content": result.get("content", ""),
+    } for result in results]
+
+
+def _format_results(results, max_tokens: Optional[int] = None) -> str:
+    """
+    検索結果（スコア順のパッセージ）をプロンプト用テキストに整形する
+    
+    合計トークン数が max_tokens（RAG_MAX_TOKENS）を超えるパッセージは含めない
+    """
+    if max_tokens is None:
+        max_tokens = int(os.getenv("RAG_MAX_TOKENS", 1200))
+    relevant_docs = []
+    used_tokens = 0
+    for result in results:
+        content = result.get("content", "")
+        source = result.get("source", "unknown")
+        heading_path = result.get("heading_path")
+        label = f"{source} > {heading_path}" if heading_path else source
+        passage = f"--- Source: {label} ---\n{content}"
+        passage_tokens = count_tokens(passage)
+        if used_tokens + passage_tokens > max_tokens:
+            continue
+        relevant_docs.append(passage)
+        used_tokens += passage_tokens
+        
+    if not relevant_docs:
+        return "No relevant internal documents found."
+        
+    return "\n\n".join(relevant_docs)
+
+
 @tool
-def lookup_knowledge(user_input: Dict[str, Any], top_k: int = 3) -> str:
+def lookup_knowledge(user_input: Dict[str, Any], top_k: int = 5) -> str:
     """
-    Azure AI Search から関連するナレッジを検索して返す
+    関連するナレッジを検索して返す
+    
+    RAG_BACKEND=azure（デフォルト）は Azure AI Search、
+    RAG_BACKEND=local はプロセス内のBM25インデックスを使用する
     
     Args:
         user_input: ユーザー入力
-        top_k: 取得するドキュメント数
+        top_k: 取得するパッセージ（チャンク）数の上限
     
     Returns:
         結合された関連ドキュメントのテキスト
     """
     # ユーザーメッセージを優先し、なければ project_type を使用
     query = user_input.get("message") or user_input.get("project_type") or "software development"
-    endpoint = os.getenv("AZURE_AI_SEARCH_ENDPOINT")
-    key = os.getenv("AZURE_AI_SEARCH_API_KEY")
-    index_name = "estimation-rags"
+    backend = os.getenv("RAG_BACKEND", "azure").lower()
+    index_name = os.getenv("AZURE_AI_SEARCH_INDEX_ALIAS", "estimation-rags")
+    endpoint = key = None
     
-    if not endpoint or not key:
-        return "Warning: Azure AI Search connection info not found."
+    if backend != "local":
+        endpoint = os.getenv("AZURE_AI_SEARCH_ENDPOINT")
+        key = os.getenv("AZURE_AI_SEARCH_API_KEY")
+        if not endpoint or not key:
+            return "Warning: Azure AI Search connection info not found."
 
     try:
-        client = SearchClient(endpoint, index_name, AzureKeyCredential(key))
+        # 正規化したクエリ・件数・インデックス名・バージョンでキャッシュを引く
+        normalized = normalize_query(query)
+        cache = get_retrieval_cache()
+        cache_key = stable_hash({
+            "query": normalized,
+            "top_k": top_k,
+            "index": "local" if backend == "local" else index_name,
+            "version": _index_version(backend, endpoint=endpoint, key=key, alias=index_name),
+        })
+        passages = cache.get(cache_key) if cache is not None else None
         
-        # 検索実行
-        results = client.search(
-            search_text=query,
-            top=top_k,
-            include_total_count=True
-        )
+        if passages is None:
+            if backend == "local":
+                passages = _passages(get_local_index().search(normalized, top_k=top_k))
+            else:
+                load_search_sdk()
+                client = SearchClient(endpoint, index_name, AzureKeyCredential(key))
+                # 検索実行
+                passages = _passages(client.search(
+                    search_text=normalized,
+                    top=top_k,
+                    include_total_count=True
+                ))
+            if cache is not None:
+                cache.set(cache_key, passages)
         
-        relevant_docs = []
-        for result in results:
-            content = result.get("content", "")
-            source = result.get("source", "unknown")
-            relevant_docs.append(f"--- Source: {source} ---\n{content}")
-            
-        if not relevant_docs:
-            return "No relevant internal documents found."
-            
-        return "\n\n".join(relevant_docs)
+        return _format_results(passages)
         
     except Exception as e:
         return f"Error during search: {str(e)}"
@@ -0,0 +1,237 @@
+"""
+Prometheus metrics for the /score pipeline (text exposition format 0.0.4).
+
+Stage latencies are recorded into histograms with `stage("name")` (a context
+manager) or `observe_stage(name, seconds)` for durations measured elsewhere.
+Values owned by other modules (cache counters, session count) are read at
+scrape time through collectors registered with `register_collector`.
+
+When OTEL_EXPORTER_OTLP_ENDPOINT is set, every stage is also exported as an
+OpenTelemetry span over OTLP/HTTP. The exporter packages are optional
+(requirements-otel.txt: opentelemetry-sdk, opentelemetry-exporter-otlp-proto-http)
+and imported lazily, only in that case; without them spans are disabled with
+one warning.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers in-process stages (ms) up to long proposal generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.type = "counter"
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.type = "histogram"
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (bucket counts, sum, count)
+        self._values: Dict[Labels, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(tuple(sorted(labels.items())))
+        return entry[2] if entry else 0
+
+    def samples(self) -> List[Sample]:
+        out: List[Sample] = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = dict(key)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    out.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)),
+                                bucket_count))
+                out.append((f"{self.name}_bucket", dict(labels, le="+Inf"), count))
+                out.append((f"{self.name}_sum", labels, total))
+                out.append((f"{self.name}_count", labels, count))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+        # name, type, help, callback returning [(labels, value)]
+        self._collectors: List[Tuple[str, str, str, Callable[[], List[Tuple[Dict[str, str], float]]]]] = []
+
+    def register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, name: str, metric_type: str, help_text: str,
+                           callback: Callable[[], List[Tuple[Dict[str, str], float]]]) -> None:
+        """Add a metric whose samples are computed at scrape time"""
+        self._collectors = [c for c in self._collectors if c[0] != name]
+        self._collectors.append((name, metric_type, help_text, callback))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name, metric_type, help_text, callback in self._collectors:
+            try:
+                samples = callback()
+            except Exception:
+                # A failing backend (e.g. Redis down) must not break the scrape
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "estimation_stage_duration_seconds", "Duration of each /score pipeline stage"))
+TURNS = registry.register(Counter(
+    "estimation_turns_total", "Conversation turns by how they were answered"))
+LLM_TOKENS = registry.register(Counter(
+    "estimation_llm_tokens_total", "Tokens reported by the LLM (kind=prompt|completion)"))
+ERRORS = registry.register(Counter(
+    "estimation_errors_total", "Failed requests by endpoint"))
+STAGE_TIMEOUTS = registry.register(Counter(
+    "estimation_stage_timeouts_total", "/score stages abandoned at their deadline"))
+
+
+_tracer: Any = None
+_tracer_ready = False
+_tracer_lock = threading.Lock()
+
+
+def _create_tracer(endpoint: str) -> Any:
+    # Optional dependency, only needed when spans are exported
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(resource=Resource.create({
+        "service.name": os.getenv("OTEL_SERVICE_NAME", "estimation-agent")}))
+    provider.add_span_processor(BatchSpanProcessor(
+        OTLPSpanExporter(endpoint=f"{endpoint.rstrip('/')}/v1/traces")))
+    return provider.get_tracer("estimation_agent")
+
+
+def get_tracer() -> Optional[Any]:
+    """OpenTelemetry tracer exporting to OTEL_EXPORTER_OTLP_ENDPOINT, or None"""
+    global _tracer, _tracer_ready
+    if not _tracer_ready:
+        with _tracer_lock:
+            if not _tracer_ready:
+                endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+                if endpoint:
+                    try:
+                        _tracer = _create_tracer(endpoint)
+                    except ImportError as e:
+                        logging.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but the OpenTelemetry "
+                                        "exporter is not installed (requirements-otel.txt); "
+                                        "spans are disabled: %s", e)
+                _tracer_ready = True
+    return _tracer
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as pipeline stage `name` (histogram + optional span)"""
+    tracer = get_tracer()
+    span_cm = tracer.start_as_current_span(f"score.{name}") if tracer is not None else None
+    if span_cm is not None:
+        span_cm.__enter__()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+        if span_cm is not None:
+            span_cm.__exit__(None, None, None)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """Record a stage measured elsewhere (e.g. on a worker thread)"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    tracer = get_tracer()
+    if tracer is not None:
+        end = time.time_ns()
+        span = tracer.start_span(f"score.{name}", start_time=end - int(seconds * 1e9))
+        span.end(end_time=end)
+
+
+def record_usage(usage: Any) -> Optional[Dict[str, int]]:
+    """
+    Count prompt/completion tokens from an OpenAI `usage` object (if present)
+    and return them as {"prompt_tokens", "completion_tokens"}.
+    """
+    if usage is None:
+        return None
+    prompt = getattr(usage, "prompt_tokens", None) or 0
+    completion = getattr(usage, "completion_tokens", None) or 0
+    if prompt:
+        LLM_TOKENS.inc(prompt, kind="prompt")
+    if completion:
+        LLM_TOKENS.inc(completion, kind="completion")
+    return {"prompt_tokens": prompt, "completion_tokens": completion}
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,182 @@
+"""
+Process-wide Azure OpenAI client.
+
+Building an ``AzureOpenAI`` client per request creates a new httpx connection
+pool, so every /score turn paid for a fresh TCP + TLS handshake. This module
+keeps a single client (and pool) per process, configured from environment
+variables, and records connection statistics for the admin endpoint.
+
+Configuration:
+    AZURE_OPENAI_API_VERSION        API version (default 2024-02-01)
+    AZURE_OPENAI_DEPLOYMENT_NAME    Chat deployment (default gpt-4o)
+    AZURE_OPENAI_MAX_CONNECTIONS    Max pooled connections (default 20)
+    AZURE_OPENAI_MAX_KEEPALIVE      Max idle keep-alive connections (default 10)
+    AZURE_OPENAI_KEEPALIVE_EXPIRY   Idle connection lifetime in seconds (default 30)
+    AZURE_OPENAI_HTTP2              Enable HTTP/2 when `h2` is installed (default true)
+    AZURE_OPENAI_TIMEOUT            Per-request timeout in seconds (default 60)
+    AZURE_OPENAI_CONNECT_TIMEOUT    Connect timeout in seconds (default 5)
+    AZURE_OPENAI_MAX_RETRIES        SDK retry count (default 0; /score retries in llm_gateway)
+
+The openai SDK (and httpx) are imported when the client is first built, so
+importing the app does not pay for them; `load_sdk` imports them ahead of
+the first request (see gunicorn.conf.py).
+"""
+
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AzureOpenAI
+
+_lock = threading.Lock()
+_client: Optional["AzureOpenAI"] = None
+_http_client: Optional["httpx.Client"] = None
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def load_settings() -> Dict[str, Any]:
+    """Read client settings from the environment"""
+    return {
+        "api_version": os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01"),
+        "max_connections": int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", 20)),
+        "max_keepalive_connections": int(os.getenv("AZURE_OPENAI_MAX_KEEPALIVE", 10)),
+        "keepalive_expiry": float(os.getenv("AZURE_OPENAI_KEEPALIVE_EXPIRY", 30)),
+        "http2": _env_bool("AZURE_OPENAI_HTTP2", True),
+        "timeout": float(os.getenv("AZURE_OPENAI_TIMEOUT", 60)),
+        "connect_timeout": float(os.getenv("AZURE_OPENAI_CONNECT_TIMEOUT", 5)),
+        "max_retries": int(os.getenv("AZURE_OPENAI_MAX_RETRIES", 0)),
+    }
+
+
+class PoolStats:
+    """Connection counters fed by httpcore trace events"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tcp_connects = 0
+        self.tls_handshakes = 0
+
+    def trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        with self._lock:
+            if event_name == "connection.connect_tcp.complete":
+                self.tcp_connects += 1
+            elif event_name == "connection.start_tls.complete":
+                self.tls_handshakes += 1
+
+    def on_request(self, request: "httpx.Request") -> None:
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self.trace
+
+
+_stats = PoolStats()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def load_sdk() -> None:
+    """Import the openai SDK and httpx (done on first use otherwise)"""
+    import httpx  # noqa: F401
+    import openai  # noqa: F401
+
+
+def _build_http_client(settings: Dict[str, Any]) -> "httpx.Client":
+    import httpx
+
+    http2 = settings["http2"]
+    if http2 and not _http2_available():
+        logging.warning("AZURE_OPENAI_HTTP2 is enabled but 'h2' is not installed. Using HTTP/1.1.")
+        http2 = False
+
+    return httpx.Client(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_keepalive_connections"],
+            keepalive_expiry=settings["keepalive_expiry"],
+        ),
+        timeout=httpx.Timeout(settings["timeout"], connect=settings["connect_timeout"]),
+        event_hooks={"request": [_stats.on_request]},
+    )
+
+
+def get_openai_client() -> "AzureOpenAI":
+    """Return the shared AzureOpenAI client, creating it on first use"""
+    global _client, _http_client
+    if _client is not None:
+        return _client
+
+    with _lock:
+        if _client is None:
+            from openai import AzureOpenAI
+
+            settings = load_settings()
+            _http_client = _build_http_client(settings)
+            _client = AzureOpenAI(
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                api_version=settings["api_version"],
+                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                max_retries=settings["max_retries"],
+                http_client=_http_client,
+            )
+    return _client
+
+
+def get_deployment_name() -> str:
+    """Chat completion deployment to use for /score"""
+    return os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o")
+
+
+def reset_openai_client() -> None:
+    """Close the shared client so the next call rebuilds it (config reload / tests)"""
+    global _client, _http_client, _stats
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+        _client = None
+        _http_client = None
+        _stats = PoolStats()
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Connection pool statistics for the admin endpoint"""
+    active = idle = 0
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    # httpcore does not expose pool state publicly; inspect defensively
+    for connection in list(getattr(pool, "connections", []) or []):
+        try:
+            if connection.is_idle():
+                idle += 1
+            else:
+                active += 1
+        except Exception:
+            continue
+
+    settings = load_settings()
+    return {
+        "initialized": _client is not None,
+        "http2": bool(settings["http2"] and _http2_available()),
+        "max_connections": settings["max_connections"],
+        "max_keepalive_connections": settings["max_keepalive_connections"],
+        "active_connections": active,
+        "idle_connections": idle,
+        "requests": _stats.requests,
+        "tcp_connects": _stats.tcp_connects,
+        "tls_handshakes": _stats.tls_handshakes,
+    }
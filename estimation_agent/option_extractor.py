@@ -0,0 +1,138 @@
+"""
+Single-pass extraction of tappable options from LLM replies.
+
+Options are `[label]` buttons (not markdown links `[text](url)`) and list
+items (`- x`, `1. x`, `• x`, `ー x`, `* x`). Both are line-local, so complete
+lines are tokenized in a single pass of one alternation regex, compiled at
+import. `OptionExtractor` accepts the reply in arbitrary chunks (`feed`) and
+reports options as soon as their line is complete, which is what
+/score/stream needs; `extract_options` is the one-shot form used by /score.
+
+The result matches the previous regex implementation on the golden corpus
+(tests/golden/option_extraction.jsonl): buttons first, then list items, in
+text order, cleaned of `[]*`, cut at ": ", de-duplicated, shorter than 40
+characters and not headings or URLs. It differs only on degenerate list
+lines: a marker alone on a line no longer takes the next line as its label,
+and a marker followed only by "." / ")" yields nothing instead of "." / ")".
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+MAX_LABEL_CHARS = 40
+
+# One alternation, scanned once over the completed lines:
+#   group 1: `[label]` not followed by "(" (markdown links are not buttons)
+#   group 2: list item text after the marker, up to the first bracket
+_TOKEN = re.compile(
+    r"\[([^\]\n]+)\](?!\()"
+    r"|^[^\S\n]*[-ー•*1-9](?:[.)]|[^\S\n])+([^\n\[\]]*)",
+    re.MULTILINE,
+)
+_REJECT_PREFIXES = ("#", "http://", "https://")
+
+
+@lru_cache(maxsize=4096)
+def clean_label(raw: str) -> Optional[str]:
+    """Normalize a candidate label, or None if it is not a usable option (cached: labels recur)"""
+    # Strip "[", "]" and "*" (chained replace is much cheaper than translate on non-ASCII text)
+    label = raw.replace("*", "").replace("[", "").replace("]", "").strip()
+    if ": " in label:
+        label = label.split(": ", 1)[0].strip()
+    if not label or len(label) >= MAX_LABEL_CHARS or label.startswith(_REJECT_PREFIXES):
+        return None
+    return label
+
+
+class OptionExtractor:
+    """
+    Incremental option extractor.
+
+    `feed` returns the options first seen in the lines completed by the
+    chunk; `close` flushes the trailing partial line. `options()` gives the
+    full list in /score order. Once a line contains `stop_marker` (e.g. the
+    proposal header), `stopped` is set and nothing more is extracted.
+    """
+
+    def __init__(self, stop_marker: Optional[str] = None):
+        self.stop_marker = stop_marker
+        self.stopped = False
+        self._pending = ""
+        self._buttons: List[str] = []
+        self._items: List[str] = []
+        self._seen_buttons = set()
+        self._seen_items = set()
+        self._reported = set()
+
+    def _scan(self, text: str, new: List[str]) -> None:
+        """Collect options from complete lines (one regex pass)"""
+        if self.stop_marker is not None:
+            cut = text.find(self.stop_marker)
+            if cut != -1:
+                self.stopped = True
+                # Lines before the one holding the marker are still scanned
+                text = text[:text.rfind("\n", 0, cut) + 1]
+        for button, item in _TOKEN.findall(text):
+            label = clean_label(button or item)
+            if label is None:
+                continue
+            if button:
+                if label in self._seen_buttons:
+                    continue
+                self._seen_buttons.add(label)
+                self._buttons.append(label)
+            else:
+                if label in self._seen_items:
+                    continue
+                self._seen_items.add(label)
+                self._items.append(label)
+            if label not in self._reported:
+                self._reported.add(label)
+                new.append(label)
+
+    def feed(self, text: str) -> List[Dict[str, str]]:
+        """Consume a chunk; options from the lines it completed"""
+        if self.stopped or not text:
+            return []
+        new: List[str] = []
+        end = text.rfind("\n")
+        if end == -1:
+            self._pending += text
+        else:
+            self._scan(self._pending + text[:end + 1], new)
+            self._pending = text[end + 1:]
+        if (not self.stopped and self.stop_marker is not None
+                and self.stop_marker in self._pending):
+            self.stopped = True
+        return [option(label) for label in new]
+
+    def close(self) -> List[Dict[str, str]]:
+        """Process the last (unterminated) line"""
+        new: List[str] = []
+        if not self.stopped and self._pending:
+            self._scan(self._pending, new)
+        self._pending = ""
+        return [option(label) for label in new]
+
+    def options(self) -> List[Dict[str, str]]:
+        """All options so far: buttons first, then list items not already offered as buttons"""
+        labels = self._buttons + [label for label in self._items
+                                  if label not in self._seen_buttons]
+        return [option(label) for label in labels]
+
+
+def option(label: str) -> Dict[str, str]:
+    return {"label": label, "value": label}
+
+
+def extract_options(text: str) -> List[Dict[str, str]]:
+    """Tappable options ([label] buttons and list items) of a complete reply"""
+    buttons: List[str] = []
+    items: List[str] = []
+    for button, item in _TOKEN.findall(text):
+        label = clean_label(button or item)
+        if label is not None:
+            (buttons if button else items).append(label)
+    # Ordered de-duplication: buttons first, then list items
+    return [option(label) for label in dict.fromkeys(buttons + items)]
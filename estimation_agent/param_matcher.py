@@ -0,0 +1,341 @@
+"""
+Multi-pattern parameter matcher for option labels and free-text messages.
+
+Every synonym of a parameter value (SYNONYMS), every unit that turns a
+number into a parameter (UNITS) and a list of filler words (FILLERS) are
+compiled at import into one Aho–Corasick automaton over NFKC-folded,
+lower-cased text. `scan` walks a message once, whatever the size of the
+table, and returns every mention with a confidence:
+
+    1.0  the whole message is one known label (an option button)
+    0.9  a number with a unit ("20画面", "10,000 LOC", "0.05人日/step")
+    0.5-0.9 a synonym inside longer text (LABEL_CONFIDENCE for vague words)
+
+Overlapping hits are resolved leftmost-longest, so "一覧表示・検索" is one
+feature rather than "一覧" and "検索". Whatever no mention or filler covers
+is returned as `residual`, which tells whether a free-text message said
+anything beyond the parameters.
+"""
+
+import os
+import unicodedata
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# Parameter -> {label: value}. The first block of each parameter are the
+# option labels offered by the hearing flow and the prompt.
+SYNONYMS: Dict[str, Dict[str, str]] = {
+    "method": {
+        "STEP法": "step", "LOC法": "step", "Step": "step",
+        "FP法": "fp", "Function Point": "fp",
+        "画面数法": "screen", "Screen Count": "screen",
+    },
+    "features": {
+        "ユーザー認証": "auth", "認証": "auth",
+        "一覧表示・検索": "list_search", "検索": "list_search", "一覧": "list_search",
+        "詳細表示": "detail_view", "詳細": "detail_view",
+        "CRUD操作": "crud", "登録・編集": "crud",
+        "決済機能": "payment", "決済": "payment",
+        "プッシュ通知": "push_notification", "通知": "push_notification",
+        "リアルタイム機能": "realtime", "チャット": "realtime",
+        "外部API連携": "external_api", "API連携": "external_api",
+        "データ移行": "data_migration",
+        "管理画面": "admin_panel",
+        # Free-text synonyms
+        "ログイン": "auth", "会員登録": "auth",
+        "カード決済": "payment", "課金": "payment",
+        "リアルタイム": "realtime",
+        "外部連携": "external_api", "API": "external_api",
+        "移行": "data_migration",
+        "管理者画面": "admin_panel", "管理機能": "admin_panel",
+    },
+    "complexity": {
+        "簡易": "low", "シンプル": "low",
+        "標準": "medium", "一般的": "medium",
+        "高難度": "high", "複雑": "high",
+        # Free-text synonyms
+        "簡単": "low", "難しい": "high", "高度": "high",
+    },
+    "phase2_items": {
+        "IA設計": "ia_design",
+        "WF作成": "wireframe",
+        "Figma化": "figma",
+        # Free-text synonyms
+        "情報設計": "ia_design", "ワイヤーフレーム": "wireframe", "Figma": "figma",
+    },
+    "phase3_items": {
+        "UIデザイン": "ui_design",
+        "デザインシステム": "design_system",
+        "プロトタイプ": "prototype",
+        "アイコン・ロゴ": "logo_icon",
+        # Free-text synonyms
+        "ロゴ": "logo_icon", "アイコン": "logo_icon",
+    },
+    "confidence": {
+        "要件がまだ曖昧": "low", "Low Confidence": "low", "概算レベル": "low", "Vague": "low",
+        "標準的": "medium", "Standard": "medium",
+        "仕様確定済み": "high", "High Confidence": "high", "Concrete": "high",
+        "詳細仕様あり": "high",
+    },
+}
+
+# Parameters that hold several values (a second value is not a contradiction)
+LIST_PARAMS = ("features", "phase2_items", "phase3_items")
+
+DEFAULT_CONFIDENCE = 0.9
+UNIT_CONFIDENCE = 0.9
+# Synonyms that are less specific inside free text
+LABEL_CONFIDENCE = {
+    "認証": 0.8, "検索": 0.8, "一覧": 0.8, "詳細": 0.7, "通知": 0.8,
+    "標準": 0.7, "一般的": 0.6, "シンプル": 0.7, "簡単": 0.7, "高度": 0.6,
+    "Step": 0.5, "API": 0.6, "移行": 0.6, "Figma": 0.7,
+    "Vague": 0.6, "Standard": 0.6, "Concrete": 0.6,
+}
+
+# Unit -> (parameter, type); the number directly before the unit is the value
+UNITS: Dict[str, Tuple[str, type]] = {
+    "画面": ("screen_count", int),
+    "LOC": ("loc", int), "ステップ": ("loc", int), "step": ("loc", int), "steps": ("loc", int),
+    "FP": ("fp_count", int),
+    "人日": ("man_days_per_unit", float),
+    # Productivity units name LOC/FP too: matched whole, they win over "step" / "FP"
+    "人日/step": ("man_days_per_unit", float), "人日/ステップ": ("man_days_per_unit", float),
+    "人日/FP": ("man_days_per_unit", float),
+}
+
+# Words that carry no information of their own in a parameter request
+FILLERS = (
+    "と", "や", "が", "を", "は", "も", "の", "で", "に", "へ", "か", "な", "よ", "ね",
+    "機能", "必要", "欲しい", "ほしい", "です", "ます", "でした", "ください", "お願いします",
+    "あと", "それと", "それから", "および", "及び", "and", "あり", "あります", "したい",
+    "くらい", "ぐらい", "程度", "約", "ほど", "想定", "予定", "希望", "全部", "すべて",
+    "追加", "対応", "利用", "使う", "入れたい", "つけたい", "付けたい", "いる", "要る",
+)
+
+# Free text counts as a parameter request when at most this much is left unexplained
+MAX_RESIDUAL_CHARS = 2
+
+_NUMBER_CHARS = frozenset("0123456789.,")
+
+
+def fold(text: str) -> str:
+    """NFKC (full-width -> ASCII, half-width kana -> full-width) and lower-case"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def _is_ascii_alpha(ch: str) -> bool:
+    return "a" <= ch <= "z"
+
+
+def _is_noise(ch: str) -> bool:
+    # Punctuation, symbols and separators never count as residual content
+    return unicodedata.category(ch)[0] in "PZS" or ch.isspace()
+
+
+class AhoCorasick:
+    """Aho–Corasick automaton; `iter` yields (end, pattern index) for every occurrence"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = list(patterns)
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[List[int]] = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(index)
+
+        # Breadth-first: depth-1 states fail to the root, deeper ones to the
+        # longest proper suffix that is also a prefix
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                outputs[nxt].extend(outputs[fail[nxt]])
+        self._goto = goto
+        self._fail = fail
+        self._outputs = [tuple(o) for o in outputs]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int]]:
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for index in outputs[state]:
+                yield i + 1, index
+
+
+class Mention(NamedTuple):
+    """One parameter value found in a message (offsets refer to the folded text)"""
+    param: str
+    value: Any
+    text: str
+    start: int
+    end: int
+    confidence: float
+    kind: str  # "label" or "number"
+
+
+class Scan(NamedTuple):
+    mentions: List[Mention]
+    residual: str
+    folded: str
+
+
+# Senses of one folded pattern: ("label", param, value, confidence),
+# ("unit", param, type, confidence) or ("filler", None, None, 0.0)
+_Sense = Tuple[str, Optional[str], Any, float]
+
+
+class ParamMatcher:
+    """Single-pass matcher over synonyms, units and fillers"""
+
+    def __init__(self, synonyms: Dict[str, Dict[str, str]] = SYNONYMS,
+                 units: Dict[str, Tuple[str, type]] = UNITS, fillers: Iterable[str] = FILLERS,
+                 label_confidence: Optional[Dict[str, float]] = None):
+        label_confidence = LABEL_CONFIDENCE if label_confidence is None else label_confidence
+        senses: Dict[str, List[_Sense]] = {}
+        for param, labels in synonyms.items():
+            for label, value in labels.items():
+                senses.setdefault(fold(label), []).append(
+                    ("label", param, value, label_confidence.get(label, DEFAULT_CONFIDENCE)))
+        for unit, (param, cast) in units.items():
+            senses.setdefault(fold(unit), []).append(("unit", param, cast, UNIT_CONFIDENCE))
+        for filler in fillers:
+            senses.setdefault(fold(filler), []).append(("filler", None, None, 0.0))
+        self._senses = list(senses.values())
+        self._automaton = AhoCorasick(senses.keys())
+
+    @staticmethod
+    def _number_before(text: str, start: int) -> Optional[Tuple[int, str]]:
+        """(start, digits) of a number right before `start` (spaces allowed in between)"""
+        end = start
+        while end > 0 and text[end - 1] == " ":
+            end -= 1
+        begin = end
+        while begin > 0 and text[begin - 1] in _NUMBER_CHARS:
+            begin -= 1
+        digits = text[begin:end].strip(".,").replace(",", "")
+        if not digits or not any(c.isdigit() for c in digits) or digits.count(".") > 1:
+            return None
+        return begin, digits
+
+    def _candidates(self, text: str) -> List[Tuple[int, int, Optional[Mention]]]:
+        """Every hit as (start, end, mention or None for fillers)"""
+        found: List[Tuple[int, int, Optional[Mention]]] = []
+        patterns = self._automaton.patterns
+        for end, index in self._automaton.iter(text):
+            start = end - len(patterns[index])
+            # ASCII words must not be glued to other letters ("steps" is not "step")
+            if ((_is_ascii_alpha(text[start]) and start > 0 and _is_ascii_alpha(text[start - 1]))
+                    or (_is_ascii_alpha(text[end - 1]) and end < len(text)
+                        and _is_ascii_alpha(text[end]))):
+                continue
+            for kind, param, value, confidence in self._senses[index]:
+                if kind == "unit":
+                    number = self._number_before(text, start)
+                    if number is None:
+                        continue
+                    begin, digits = number
+                    found.append((begin, end, Mention(param, value(float(digits)), text[begin:end],
+                                                      begin, end, confidence, "number")))
+                    break
+                if kind == "label":
+                    found.append((start, end, Mention(param, value, text[start:end], start, end,
+                                                      confidence, "label")))
+                else:
+                    found.append((start, end, None))
+        return found
+
+    def scan(self, message: str) -> Scan:
+        """All mentions in `message` (leftmost-longest, non-overlapping) and the residual text"""
+        text = fold(message)
+        chosen: List[Tuple[int, int, Optional[Mention]]] = []
+        covered_to = 0
+        for start, end, mention in sorted(self._candidates(text),
+                                          key=lambda c: (c[0], -(c[1] - c[0]))):
+            if start >= covered_to:
+                chosen.append((start, end, mention))
+                covered_to = end
+
+        mentions = [m for _, _, m in chosen if m is not None]
+        content = [i for i, ch in enumerate(text) if not _is_noise(ch)]
+        if len(mentions) == 1 and content and (
+                mentions[0].start <= content[0] and mentions[0].end > content[-1]):
+            # The message is exactly one label / value: an option button
+            mentions = [mentions[0]._replace(confidence=1.0)]
+
+        covered = bytearray(len(text))
+        for start, end, _ in chosen:
+            covered[start:end] = b"\x01" * (end - start)
+        residual = "".join(text[i] for i in content if not covered[i])
+        return Scan(mentions, residual, text)
+
+
+MATCHER = ParamMatcher()
+
+
+def scan(message: str) -> Scan:
+    return MATCHER.scan(message)
+
+
+def label_values() -> Dict[str, str]:
+    """Flat label -> value table of every synonym (the former PARAM_MAPPING)"""
+    return {label: value for labels in SYNONYMS.values() for label, value in labels.items()}
+
+
+def option_mentions(option: str) -> List[Mention]:
+    """
+    Parameter values to record for an option the user tapped (explicit intent).
+
+    An option that is exactly one label wins. Otherwise numbers with units
+    are recorded and the labels next to them ignored ("標準 (0.05人日/step)"
+    is a productivity, not a complexity), and failing that the labels inside
+    the option ("画面数法 (Screen Count)"). Mentions below min_confidence()
+    are dropped, so a loose match ("Stepで見積もりたい") records nothing.
+    Nothing is recorded when a single-valued parameter gets two different
+    values.
+    """
+    mentions = scan(option).mentions
+    if len(mentions) == 1 and mentions[0].confidence == 1.0:
+        return mentions
+    threshold = min_confidence()
+    mentions = [m for m in mentions if m.confidence >= threshold]
+    chosen = [m for m in mentions if m.kind == "number"] or mentions
+    seen = set()
+    scalars: Dict[str, Any] = {}
+    unique: List[Mention] = []
+    for mention in chosen:
+        if (mention.param, mention.value) in seen:
+            continue
+        if mention.param not in LIST_PARAMS:
+            if mention.param in scalars:
+                return []
+            scalars[mention.param] = mention.value
+        seen.add((mention.param, mention.value))
+        unique.append(mention)
+    return unique
+
+
+def min_confidence() -> float:
+    """PARAM_MATCH_MIN_CONFIDENCE: lowest confidence accepted from free text (default 0.7)"""
+    return float(os.getenv("PARAM_MATCH_MIN_CONFIDENCE", 0.7))
+
+
+def is_parameter_request(result: Scan) -> bool:
+    """True if a free-text message says nothing but confidently recognized parameters"""
+    threshold = min_confidence()
+    return (bool(result.mentions) and len(result.residual) <= MAX_RESIDUAL_CHARS
+            and all(m.confidence >= threshold for m in result.mentions))
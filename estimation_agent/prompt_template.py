@@ -0,0 +1,109 @@
+"""
+Precompiled chat prompt templates with a stable system prefix.
+
+A template file is split once at its role markers (`system:` / `user:`, the
+Prompt Flow chat format). The system section must be static: it is rendered
+a single time and reused byte-for-byte on every turn, so provider-side
+prompt caching can reuse the prefix. Only the user section is rendered per
+request. Compiled templates are cached per path and reloaded when the file
+changes; `PrefixMonitor` records the prefix hash so drift is visible in
+/admin/stats.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from jinja2 import Environment, meta
+
+_ROLE_RE = re.compile(r"^(system|user|assistant):[ \t]*$", re.MULTILINE)
+
+_env = Environment(keep_trailing_newline=True)
+
+
+def split_roles(source: str) -> List[Tuple[str, str]]:
+    """Split a chat template into (role, template source) sections"""
+    markers = list(_ROLE_RE.finditer(source))
+    if not markers:
+        return [("user", source)]
+    sections = []
+    for marker, following in zip(markers, markers[1:] + [None]):
+        end = following.start() if following else len(source)
+        sections.append((marker.group(1), source[marker.end():end].strip("\n")))
+    return sections
+
+
+def prefix_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PromptTemplate:
+    """A chat template whose system message is rendered once at compile time"""
+
+    def __init__(self, source: str):
+        sections = split_roles(source)
+        self.system: Optional[str] = None
+        self._templates = []
+        for index, (role, body) in enumerate(sections):
+            if index == 0 and role == "system":
+                variables = meta.find_undeclared_variables(_env.parse(body))
+                if variables:
+                    raise ValueError(f"System prompt must be static, found variables: {sorted(variables)}")
+                self.system = _env.from_string(body).render().strip()
+            else:
+                self._templates.append((role, _env.from_string(body)))
+        self.prefix_hash = prefix_hash(self.system or "")
+
+    def render_messages(self, **variables: Any) -> List[Dict[str, str]]:
+        messages = []
+        if self.system is not None:
+            messages.append({"role": "system", "content": self.system})
+        for role, template in self._templates:
+            messages.append({"role": role, "content": template.render(**variables).strip()})
+        return messages
+
+
+_cache: Dict[str, Tuple[int, PromptTemplate]] = {}
+_cache_lock = threading.Lock()
+
+
+def load_template(path: str) -> PromptTemplate:
+    """Compiled template for path (recompiled only when the file changes)"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "r", encoding="utf-8") as f:
+                cached = (mtime, PromptTemplate(f.read()))
+            _cache[path] = cached
+    return cached[1]
+
+
+class PrefixMonitor:
+    """Tracks the system prefix hash across turns (should never change between deploys)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hash: Optional[str] = None
+        self.renders = 0
+        self.changes = 0
+
+    def observe(self, messages: List[Dict[str, str]]) -> bool:
+        """Record one rendered prompt; returns False if the prefix changed"""
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        digest = prefix_hash(system)
+        with self._lock:
+            self.renders += 1
+            stable = self.hash is None or self.hash == digest
+            if not stable:
+                self.changes += 1
+            self.hash = digest
+        return stable
+
+    def stats(self) -> Dict[str, Any]:
+        return {"prefix_hash": self.hash, "renders": self.renders, "prefix_changes": self.changes}
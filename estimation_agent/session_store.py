@@ -0,0 +1,283 @@
+"""
+Session storage backends for the estimation agent.
+
+The Flask app talks to a ``SessionStore`` instead of a module-level dict so
+that sessions can either live in-process (single worker, local dev) or in a
+Redis-compatible server shared by every gunicorn worker / container replica.
+
+Expiry is handled by the backend itself:
+- ``InMemorySessionStore`` keeps a min-heap of expiry deadlines and pops only
+  the entries that are actually due, so there is no O(N) sweep per request.
+- ``RedisSessionStore`` relies on native key TTLs (``SET ... EX``).
+
+``InMemorySessionStore`` can also enforce a global memory budget
+(SESSION_MEMORY_BUDGET_MB): sessions report their size with ``size_bytes()``
+and the least recently used ones are evicted once the total exceeds it.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_SESSION_TTL_SECONDS = 3600
+DEFAULT_MEMORY_BUDGET_MB = 256
+# How long the Redis store reuses a session count before scanning again
+DEFAULT_COUNT_TTL_SECONDS = 10.0
+
+
+class SessionStore:
+    """Interface for conversation session storage.
+
+    Sessions are created once (which starts their TTL), mutated by the
+    request handler and then written back with ``save``. The TTL is counted
+    from creation, matching the original 1 hour session lifetime.
+    """
+
+    def __init__(self, ttl_seconds: int = DEFAULT_SESSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        # Sessions dropped because their TTL passed (backends that can observe it)
+        self.expired = 0
+        # Sessions dropped to stay within the memory budget (in-memory store only)
+        self.evicted = 0
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """Return the live session for ``session_id`` or None if missing/expired"""
+        raise NotImplementedError
+
+    def create(self, session: Any) -> None:
+        """Store a new session and start its TTL"""
+        raise NotImplementedError
+
+    def save(self, session: Any) -> None:
+        """Persist changes to an existing session without extending its TTL"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        """Delete a session. Returns True if it existed"""
+        raise NotImplementedError
+
+    def sessions(self) -> Iterator[Any]:
+        """Iterate over live sessions (admin / debugging use only)"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+
+def _session_size(session: Any) -> int:
+    size = getattr(session, "size_bytes", None)
+    return size() if size is not None else 0
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local store with heap-based TTL expiry and an optional LRU memory budget.
+
+    Each ``create`` pushes ``(deadline, session_id)`` onto a min-heap and
+    purges the entries whose deadline has passed. Purging is amortized
+    O(log N) per expired session; live sessions are never scanned.
+
+    ``create``/``save`` re-measure the session (``total_bytes``); with
+    ``max_bytes`` > 0 they then evict least recently used sessions (``get``
+    counts as a use) until the total fits. The session being stored is
+    never evicted by its own save.
+    """
+
+    def __init__(self, ttl_seconds: int = DEFAULT_SESSION_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic, max_bytes: int = 0):
+        super().__init__(ttl_seconds)
+        self._clock = clock
+        self.max_bytes = max_bytes
+        # Least recently used first
+        self._sessions: "OrderedDict[str, Any]" = OrderedDict()
+        self._deadlines: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self._heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def _remove(self, session_id: str) -> None:
+        del self._sessions[session_id]
+        del self._deadlines[session_id]
+        self.total_bytes -= self._sizes.pop(session_id, 0)
+
+    def _purge_expired(self, now: float) -> None:
+        while self._heap and self._heap[0][0] <= now:
+            deadline, session_id = heapq.heappop(self._heap)
+            # Skip stale heap entries for sessions that were deleted/recreated
+            if self._deadlines.get(session_id) == deadline:
+                self._remove(session_id)
+                self.expired += 1
+
+    def _account(self, session: Any) -> None:
+        """Record the session's current size and evict LRU sessions over the budget"""
+        size = _session_size(session)
+        self.total_bytes += size - self._sizes.get(session.session_id, 0)
+        self._sizes[session.session_id] = size
+        while self.max_bytes and self.total_bytes > self.max_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == session.session_id:
+                break
+            self._remove(oldest)
+            self.evicted += 1
+
+    def get(self, session_id: str) -> Optional[Any]:
+        with self._lock:
+            deadline = self._deadlines.get(session_id)
+            if deadline is None:
+                return None
+            if deadline <= self._clock():
+                self._remove(session_id)
+                self.expired += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            return self._sessions[session_id]
+
+    def create(self, session: Any) -> None:
+        with self._lock:
+            now = self._clock()
+            self._purge_expired(now)
+            if session.session_id in self._sessions:
+                self._remove(session.session_id)
+            deadline = now + self.ttl_seconds
+            self._sessions[session.session_id] = session
+            self._deadlines[session.session_id] = deadline
+            heapq.heappush(self._heap, (deadline, session.session_id))
+            self._account(session)
+
+    def save(self, session: Any) -> None:
+        # Sessions are held by reference; mutations are already visible.
+        # Only the size accounting (and budget eviction) needs updating.
+        with self._lock:
+            if session.session_id in self._sessions:
+                self._sessions.move_to_end(session.session_id)
+                self._account(session)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._remove(session_id)
+            return True
+
+    def sessions(self) -> Iterator[Any]:
+        with self._lock:
+            self._purge_expired(self._clock())
+            return iter(list(self._sessions.values()))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._purge_expired(self._clock())
+            return len(self._sessions)
+
+
+class RedisSessionStore(SessionStore):
+    """Redis-protocol store using native key TTLs.
+
+    Expiry happens inside Redis, so ``expired`` is not counted here.
+
+    Sessions are serialized with ``session.to_dict()`` and rebuilt with
+    ``session_factory`` (typically ``ConversationSession.from_dict``), so any
+    worker can pick up any session.
+
+    Counting sessions needs a SCAN of the keyspace, so ``len()`` (called on
+    every /metrics scrape and /admin/stats) reuses the last count for
+    ``count_ttl_seconds``, adjusted for this process's creates and deletes.
+    """
+
+    def __init__(self, client: Any, session_factory: Callable[[Dict[str, Any]], Any],
+                 ttl_seconds: int = DEFAULT_SESSION_TTL_SECONDS,
+                 key_prefix: str = "estimation-agent:session:",
+                 count_ttl_seconds: float = DEFAULT_COUNT_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        super().__init__(ttl_seconds)
+        self._client = client
+        self._session_factory = session_factory
+        self._key_prefix = key_prefix
+        self._count_ttl_seconds = count_ttl_seconds
+        self._clock = clock
+        self._count_lock = threading.Lock()
+        # (count, time of the SCAN) or None before the first count
+        self._count: Optional[Tuple[int, float]] = None
+
+    def _adjust_count(self, delta: int) -> None:
+        with self._count_lock:
+            if self._count is not None:
+                self._count = (max(0, self._count[0] + delta), self._count[1])
+
+    def _key(self, session_id: str) -> str:
+        return f"{self._key_prefix}{session_id}"
+
+    @staticmethod
+    def _dumps(session: Any) -> str:
+        return json.dumps(session.to_dict(), ensure_ascii=False)
+
+    def get(self, session_id: str) -> Optional[Any]:
+        raw = self._client.get(self._key(session_id))
+        if raw is None:
+            return None
+        return self._session_factory(json.loads(raw))
+
+    def create(self, session: Any) -> None:
+        self._client.set(self._key(session.session_id), self._dumps(session), ex=self.ttl_seconds)
+        self._adjust_count(1)
+
+    def save(self, session: Any) -> None:
+        # xx: never resurrect a session that expired mid-request
+        self._client.set(self._key(session.session_id), self._dumps(session), keepttl=True, xx=True)
+
+    def delete(self, session_id: str) -> bool:
+        deleted = bool(self._client.delete(self._key(session_id)))
+        if deleted:
+            self._adjust_count(-1)
+        return deleted
+
+    def sessions(self) -> Iterator[Any]:
+        for key in self._client.scan_iter(match=f"{self._key_prefix}*"):
+            raw = self._client.get(key)
+            if raw is not None:
+                yield self._session_factory(json.loads(raw))
+
+    def __len__(self) -> int:
+        now = self._clock()
+        with self._count_lock:
+            if self._count is not None and now - self._count[1] < self._count_ttl_seconds:
+                return self._count[0]
+        count = sum(1 for _ in self._client.scan_iter(match=f"{self._key_prefix}*"))
+        with self._count_lock:
+            self._count = (count, now)
+        return count
+
+
+def create_session_store(session_factory: Callable[[Dict[str, Any]], Any]) -> SessionStore:
+    """
+    Build the session store selected by environment variables.
+
+    SESSION_STORE: "memory" (default) or "redis"
+    SESSION_TTL_SECONDS: session lifetime in seconds (default 3600)
+    SESSION_MEMORY_BUDGET_MB: LRU memory budget of the memory backend (default 256, 0 = unbounded)
+    REDIS_URL: connection URL for the redis backend
+    SESSION_COUNT_CACHE_SECONDS: how long the redis backend reuses its session count (default 10)
+    """
+    backend = os.getenv("SESSION_STORE", "memory").lower()
+    ttl = int(os.getenv("SESSION_TTL_SECONDS", DEFAULT_SESSION_TTL_SECONDS))
+
+    if backend == "redis":
+        import redis  # Optional dependency, only needed for the shared backend
+
+        client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+                                      decode_responses=True)
+        count_ttl = float(os.getenv("SESSION_COUNT_CACHE_SECONDS", DEFAULT_COUNT_TTL_SECONDS))
+        return RedisSessionStore(client, session_factory, ttl_seconds=ttl,
+                                 count_ttl_seconds=count_ttl)
+
+    if backend != "memory":
+        raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
+    budget_mb = float(os.getenv("SESSION_MEMORY_BUDGET_MB", DEFAULT_MEMORY_BUDGET_MB))
+    return InMemorySessionStore(ttl_seconds=ttl, max_bytes=int(budget_mb * 1024 * 1024))
@@ -0,0 +1,86 @@
+"""
+Building blocks for running the I/O stages of one request concurrently.
+
+`/score` needs the knowledge lookup and (on calculation turns) the Calc API
+result before the LLM call; the two are independent nodes of flow.dag.yaml,
+which flow_executor runs on the shared pool from `get_executor`. `timed`
+wraps a stage so it reports its value or error and wall-clock time, and
+`StageResult` carries that outcome (or a timeout) back to the request.
+`stage_timeout` reads the per-stage deadlines.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+# Stages per /score turn (knowledge lookup + Calc API) that may run at once
+STAGES_PER_REQUEST = 2
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def stage_workers() -> int:
+    """
+    STAGE_WORKERS, or enough threads for every request thread of the worker
+    (GUNICORN_THREADS) to run all of its stages at once. Time spent queued
+    for a pool thread counts against the stage deadline, so a smaller pool
+    turns load into knowledge/calc timeouts.
+    """
+    configured = os.getenv("STAGE_WORKERS")
+    if configured:
+        return int(configured)
+    return STAGES_PER_REQUEST * int(os.getenv("GUNICORN_THREADS", 16))
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Shared pool for request stages (stage_workers() threads)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=stage_workers(),
+                                               thread_name_prefix="stage")
+    return _executor
+
+
+def stage_timeout(name: str, default: float) -> float:
+    """Per-stage timeout in seconds from <NAME>_STAGE_TIMEOUT_SECONDS"""
+    return float(os.getenv(f"{name.upper()}_STAGE_TIMEOUT_SECONDS", default))
+
+
+class StageResult:
+    """Outcome of one stage: value, or error / timed_out, plus elapsed milliseconds"""
+
+    def __init__(self, value: Any = None, error: Optional[BaseException] = None,
+                 timed_out: bool = False, elapsed_ms: float = 0.0):
+        self.value = value
+        self.error = error
+        self.timed_out = timed_out
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.timed_out
+
+
+def timed(fn: Callable[[], Any]) -> Callable[[], Any]:
+    """Wrap fn to return (value, error, elapsed_ms) instead of raising"""
+    def run():
+        started = time.perf_counter()
+        try:
+            return fn(), None, (time.perf_counter() - started) * 1000
+        except Exception as e:
+            return None, e, (time.perf_counter() - started) * 1000
+    return run
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Stop the shared pool (worker shutdown); a later get_executor() builds a new one"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,171 @@
+"""
+Small LRU + TTL caches used for deterministic remote calls.
+
+``TTLCache`` is process-local (OrderedDict LRU with per-entry expiry).
+``RedisCache`` shares entries across workers through a Redis-compatible
+server using native key TTLs; a Redis error is treated as a miss (and a
+failed write is skipped), so an outage only costs the cached call. Both keep
+hit/miss counters for metrics.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def stable_hash(value: Any) -> str:
+    """SHA-256 of the canonical JSON form of ``value`` (key order independent)"""
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    """Hit/miss counters shared by cache backends"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Backend errors served as misses / skipped writes (shared backends)
+        self.errors = 0
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl_seconds``"""
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: float = 600,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= self._clock():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self._stats.record(False)
+                return None
+            self._data.move_to_end(key)
+            self._stats.record(True)
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._stats.as_dict()
+        stats.update({"backend": "memory", "size": len(self._data), "maxsize": self.maxsize})
+        return stats
+
+
+class RedisCache:
+    """Cache backed by a Redis-compatible server (values stored as JSON)"""
+
+    def __init__(self, client: Any, prefix: str, ttl_seconds: float = 600):
+        self._client = client
+        self._prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self._stats = CacheStats()
+        # Log an outage once, not on every call
+        self._failing = False
+
+    def _error(self, operation: str, error: Exception) -> None:
+        self._stats.record_error()
+        if not self._failing:
+            self._failing = True
+            logging.warning("Redis cache %s%s failed, serving misses: %s",
+                            self._prefix, operation, error)
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self._client.get(self._prefix + key)
+            value = json.loads(raw) if raw is not None else None
+        except Exception as e:
+            self._error("get", e)
+            value = None
+        else:
+            self._failing = False
+        self._stats.record(value is not None)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        try:
+            self._client.set(self._prefix + key, json.dumps(value, ensure_ascii=False),
+                             ex=max(1, int(self.ttl_seconds)))
+        except Exception as e:
+            self._error("set", e)
+
+    def clear(self) -> None:
+        keys = list(self._client.scan_iter(match=f"{self._prefix}*"))
+        if keys:
+            self._client.delete(*keys)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._stats.as_dict()
+        stats["backend"] = "redis"
+        return stats
+
+
+def create_cache(prefix: str, backend: str, maxsize: int, ttl_seconds: float) -> Optional[Any]:
+    """
+    Build a cache for the given backend name.
+
+    backend: "memory", "redis" (uses REDIS_URL) or "none" to disable caching.
+    """
+    backend = backend.lower()
+    if backend == "none":
+        return None
+    if backend == "redis":
+        import redis  # Optional dependency, only needed for the shared backend
+
+        client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+                                      decode_responses=True)
+        return RedisCache(client, f"estimation-agent:{prefix}:", ttl_seconds=ttl_seconds)
+    if backend != "memory":
+        raise ValueError(f"Unknown cache backend: {backend}")
+    return TTLCache(maxsize=maxsize, ttl_seconds=ttl_seconds)
@@ -0,0 +1,120 @@
+"""
+Production WSGI entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing this module imports the Flask app (prompt template, local index,
+session store). `self_check` verifies that the configuration can serve
+/score before any traffic is accepted; gunicorn runs it once in the master
+process (see gunicorn.conf.py) and `python wsgi.py --check` runs it
+standalone, e.g. as a deployment gate.
+
+SELF_CHECK controls what a failed check does: "warn" (default) logs it,
+"strict" refuses to start, "off" skips the checks.
+
+The Azure SDKs are not imported with the app (see `warm_up`); each worker
+imports them in the background once it is serving, so startup is not
+blocked on them and the first request rarely waits for them.
+"""
+
+import json
+import logging
+import os
+import sys
+from typing import Any, Dict, List
+
+from app import app, response_template, sessions
+
+logger = logging.getLogger(__name__)
+
+# Smallest valid Calc API payload, used to exercise the in-process engine
+_SAMPLE_PAYLOAD = {"method": "screen", "screen_count": 1, "features": [], "complexity": "medium"}
+
+
+def _check(name: str, ok: bool, detail: str) -> Dict[str, Any]:
+    return {"name": name, "ok": ok, "detail": detail}
+
+
+def _missing(*names: str) -> List[str]:
+    return [name for name in names if not os.getenv(name)]
+
+
+def self_check(workers: int = 1) -> List[Dict[str, Any]]:
+    """Run the startup checks; `workers` is the number of server processes"""
+    checks = [_check("prompt_template", bool(response_template.system),
+                     "system prompt compiled" if response_template.system
+                     else "generate_response.jinja2 has no system section")]
+
+    missing = _missing("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY")
+    checks.append(_check("openai", not missing,
+                         f"missing {', '.join(missing)}" if missing else "configured"))
+
+    if os.getenv("RAG_BACKEND", "azure").lower() == "local":
+        from lookup_knowledge import get_local_index
+
+        count = len(get_local_index().docs)
+        checks.append(_check("knowledge", count > 0, f"local index with {count} chunks"))
+    else:
+        missing = _missing("AZURE_AI_SEARCH_ENDPOINT", "AZURE_AI_SEARCH_API_KEY")
+        checks.append(_check("knowledge", not missing,
+                             f"missing {', '.join(missing)}" if missing else "Azure AI Search"))
+
+    engine = os.getenv("CALC_ENGINE", "remote").lower()
+    if engine in ("local", "parity"):
+        import estimation_engine
+
+        status = estimation_engine.estimate(_SAMPLE_PAYLOAD).get("status")
+        checks.append(_check("calc_engine", status == "ok", f"local engine returned {status}"))
+    if engine in ("remote", "parity"):
+        # call_calc falls back to a localhost Function, which is never right in production
+        missing = _missing("CALC_API_ENDPOINT")
+        checks.append(_check("calc_api", not missing,
+                             "CALC_API_ENDPOINT not set" if missing else "configured"))
+
+    try:
+        active = len(sessions)
+    except Exception as e:
+        checks.append(_check("session_store", False, f"unreachable: {e}"))
+    else:
+        backend = os.getenv("SESSION_STORE", "memory").lower()
+        shared = backend != "memory" or workers <= 1
+        checks.append(_check(
+            "session_store", shared,
+            f"{backend} store, {active} active sessions" if shared
+            else f"memory store with {workers} workers: sessions would not be shared "
+                 "(use SESSION_STORE=redis or a single worker)"
+        ))
+    return checks
+
+
+def run_self_check(workers: int = 1) -> bool:
+    """Run and log the checks according to SELF_CHECK; False means do not start"""
+    mode = os.getenv("SELF_CHECK", "warn").lower()
+    if mode == "off":
+        return True
+    checks = self_check(workers)
+    for check in checks:
+        if check["ok"]:
+            logger.info("self-check %s: %s", check["name"], check["detail"])
+        else:
+            logger.warning("self-check %s FAILED: %s", check["name"], check["detail"])
+    return mode != "strict" or all(check["ok"] for check in checks)
+
+
+def warm_up() -> None:
+    """Import the SDKs this configuration calls, ahead of the first request"""
+    import openai_client
+
+    openai_client.load_sdk()
+    if os.getenv("RAG_BACKEND", "azure").lower() != "local":
+        from lookup_knowledge import load_search_sdk
+
+        load_search_sdk()
+
+
+if __name__ == "__main__":
+    if "--check" not in sys.argv[1:]:
+        sys.exit("usage: python wsgi.py --check  (serve with: gunicorn -c gunicorn.conf.py wsgi:app)")
+    results = self_check(int(os.getenv("GUNICORN_WORKERS", 1)))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    sys.exit(0 if all(check["ok"] for check in results) else 1)
@@ -0,0 +1,126 @@
+import pytest
+import sys
+import os
+import json
+from types import SimpleNamespace
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import app as agent_app
+
+
+def _chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class FakeCompletions:
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if kwargs.get("stream"):
+            # 先頭はAzureのプロンプトフィルタ用チャンク（choicesなし）
+            return iter([SimpleNamespace(choices=[])] + [_chunk(d) for d in self.deltas])
+        message = SimpleNamespace(content="".join(self.deltas))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    def install(deltas):
+        completions = FakeCompletions(deltas)
+        client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        monkeypatch.setattr(agent_app, "get_openai_client", lambda: client)
+        monkeypatch.setattr(agent_app, "lookup_knowledge", lambda user_input: "")
+        monkeypatch.setattr(agent_app, "render_messages",
+                            lambda *args: [{"role": "user", "content": "prompt"}])
+        return completions
+    return install
+
+
+def _parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = block.split("\n")
+        event = lines[0][len("event: "):]
+        data = json.loads(lines[1][len("data: "):])
+        events.append((event, data))
+    return events
+
+
+def test_stream_emits_tokens_options_and_done(fake_llm):
+    """トークンを逐次送出し、行が確定した選択肢を途中で通知する"""
+    fake_llm(["プロジェクトタイプを", "選んでください。\n[Web", "サービス] [モバイル", "アプリ]\n", "以上"])
+    client = agent_app.app.test_client()
+
+    resp = client.post("/score/stream", json={"user_input": {"message": "アプリを作りたい"}})
+    assert resp.mimetype == "text/event-stream"
+    events = _parse_sse(resp.get_data(as_text=True))
+
+    tokens = [d["content"] for e, d in events if e == "token"]
+    assert "".join(tokens) == "プロジェクトタイプを選んでください。\n[Webサービス] [モバイルアプリ]\n以上"
+
+    options = [d["label"] for e, d in events if e == "option"]
+    assert options == ["Webサービス", "モバイルアプリ"]
+    # 選択肢は最後のトークンより前に届く
+    names = [e for e, _ in events]
+    assert names.index("option") < len(names) - 2
+
+    event, done = events[-1]
+    assert event == "done"
+    assert done["is_complete"] is False
+    assert [o["label"] for o in done["options"]] == ["Webサービス", "モバイルアプリ"]
+    assert done["session_id"]
+
+
+def test_stream_detects_proposal_and_returns_markdown(fake_llm):
+    """提案書ヘッダーを検出したら complete イベントを送り、done に markdown を含める"""
+    fake_llm(["# プロジェクト見積", "もり・提案書\n", "## 1. 概要\n[参考]\n"])
+    client = agent_app.app.test_client()
+
+    resp = client.post("/score/stream", json={"user_input": {"message": "見積もりを"}})
+    events = _parse_sse(resp.get_data(as_text=True))
+
+    names = [e for e, _ in events]
+    assert "complete" in names
+    assert "option" not in names
+    done = events[-1][1]
+    assert done["is_complete"] is True
+    assert done["markdown"].startswith("# プロジェクト見積もり・提案書")
+    assert "options" not in done
+
+    session = agent_app.sessions.get(done["session_id"])
+    assert session.is_complete is True
+
+
+def test_stream_short_circuits_without_llm(fake_llm):
+    """手法選択のみのターンはLLMを呼ばずに次のヒアリング項目を done で返す"""
+    completions = fake_llm(["unused"])
+    client = agent_app.app.test_client()
+
+    resp = client.post("/score/stream", json={"user_input": {"selected_option": "画面数法"}})
+    events = _parse_sse(resp.get_data(as_text=True))
+
+    assert [e for e, _ in events] == ["done"]
+    assert events[0][1]["message"].startswith("「画面数法」を記録しました。")
+    assert events[0][1]["options"][-1] == {"label": "次へ", "value": "次へ"}
+    assert completions.calls == []
+
+
+def test_score_matches_stream_payload(fake_llm):
+    """/score と /score/stream の最終ペイロードは一致する"""
+    fake_llm(["複雑度は？\n", "[簡易] [標準] [高難度]"])
+    client = agent_app.app.test_client()
+
+    blocking = client.post("/score", json={"user_input": {"message": "x"}}).get_json()
+    streamed = _parse_sse(client.post("/score/stream", json={
+        "user_input": {"message": "x"}}).get_data(as_text=True))[-1][1]
+
+    blocking.pop("session_id")
+    streamed.pop("session_id")
+    # 所要時間はリクエストごとに異なる
+    assert set(blocking.pop("timings")) == set(streamed.pop("timings"))
+    assert blocking == streamed
@@ -0,0 +1,151 @@
+import pytest
+import sys
+import os
+import time
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+from batch_estimation import estimate_batch, expand_scenarios
+from estimation_engine import estimate
+
+
+GRID_REQUEST = {
+    "base": {"phase2_items": ["ia_design", "wireframe"]},
+    "grid": {
+        "method": ["screen", "step", "fp"],
+        "screen_count": [5, 10, 20, 40],
+        "complexity": ["low", "medium", "high"],
+        "features": [["auth"], ["auth", "payment", "admin_panel"], ["unknown_feature"]],
+        "phase3_items": [[], ["ui_design", "design_system", "prototype"]],
+        "confidence": ["low", "high", None],
+        "loc": [None, 12345],
+        "fp_count": [None, 321],
+        "man_days_per_unit": [None, 0.05, 0.8],
+    }
+}
+
+
+def _scalar_row(result):
+    if result["status"] == "error":
+        return ("error", result["message"])
+    b = result["breakdown"]
+    return ("ok", result["estimated_amount"], result["estimated_range"]["min"],
+            result["estimated_range"]["max"], b["development"]["total_days"],
+            b["phase2_design"]["cost"], b["phase3_visual"]["cost"])
+
+
+def _batch_row(columns, i):
+    if columns["status"][i] == "error":
+        return ("error", columns["error"][i])
+    return ("ok", columns["estimated_amount"][i], columns["estimated_min"][i],
+            columns["estimated_max"][i], columns["development_days"][i],
+            columns["phase2_cost"][i], columns["phase3_cost"][i])
+
+
+def test_batch_matches_scalar_engine():
+    """ベクトル化結果はスカラー版エンジンと一致する"""
+    scenarios = expand_scenarios(GRID_REQUEST)
+    assert len(scenarios) == 3 * 4 * 3 * 3 * 2 * 3 * 2 * 2 * 3
+
+    columns = estimate_batch(scenarios)["columns"]
+    for i, scenario in enumerate(scenarios):
+        assert _batch_row(columns, i) == _scalar_row(estimate(scenario)), scenario
+
+
+def test_error_messages_match_scalar_engine():
+    """入力エラーのメッセージもスカラー版エンジンと同じ文言になる"""
+    scenarios = expand_scenarios({"scenarios": [
+        {"method": "cocomo", "screen_count": 10},
+        {"screen_count": 10, "complexity": "extreme"},
+        {"method": "step", "loc": 1000},
+        {"screen_count": 10, "phase3_items": ["ui_design"]},
+    ]})
+    columns = estimate_batch(scenarios)["columns"]
+    for i, scenario in enumerate(scenarios):
+        assert _batch_row(columns, i) == _scalar_row(estimate(scenario)), scenario
+    assert columns["error"][0] == "Unsupported method: cocomo"
+
+
+def test_explicit_scenarios_are_canonicalized():
+    """シナリオ列挙形式でも call_calc と同じ正規化を行う"""
+    scenarios = expand_scenarios({"scenarios": [
+        {"screen_count": 10, "features": ["auth", "auth"]},
+    ]})
+    assert scenarios[0]["method"] == "screen"
+    assert scenarios[0]["features"] == ["auth"]
+    assert estimate_batch(scenarios)["columns"]["estimated_amount"] == [1100000]
+
+
+@pytest.mark.parametrize("request_body", [
+    "scenarios",
+    ["scenarios"],
+    {},
+    {"grid": {}},
+    {"grid": {"screen_count": []}},
+    {"scenarios": [{"screens": 10}]},
+    {"scenarios": [5]},
+    {"scenarios": [{"screen_count": "ten"}]},
+    {"scenarios": [{"screen_count": True}]},
+    {"scenarios": [{"screen_count": -1}]},
+    {"scenarios": [{"features": "auth"}]},
+    {"scenarios": [{"features": [["auth"]]}]},
+    {"scenarios": [{"complexity": 3}]},
+    {"base": ["auth"], "grid": {"screen_count": [10]}},
+])
+def test_invalid_requests_raise_value_error(request_body):
+    with pytest.raises(ValueError):
+        expand_scenarios(request_body)
+
+
+def test_numeric_strings_are_converted():
+    """数値の文字列は数値に変換して評価する"""
+    scenarios = expand_scenarios({"scenarios": [{"screen_count": "10", "features": ["auth"]}]})
+    assert scenarios[0]["screen_count"] == 10
+    assert estimate_batch(scenarios)["columns"]["estimated_amount"] == [1100000]
+
+
+def test_scenario_limit():
+    with pytest.raises(ValueError):
+        expand_scenarios({"grid": {"screen_count": list(range(100))}}, max_scenarios=50)
+
+
+def test_thousands_of_scenarios_are_fast():
+    """数千シナリオでも短時間で評価できる"""
+    scenarios = expand_scenarios({"grid": {
+        "screen_count": list(range(1, 101)),
+        "complexity": ["low", "medium", "high"],
+        "features": [["auth"], ["auth", "payment"], ["crud", "list_search", "detail_view"]],
+        "phase3_items": [["ui_design"]],
+        "confidence": ["low", "medium", "high"],
+    }})
+    start = time.perf_counter()
+    result = estimate_batch(scenarios)
+    elapsed = time.perf_counter() - start
+
+    assert result["count"] == 2700
+    assert elapsed < 1.0
+
+
+def test_batch_endpoint_returns_columns():
+    """POST /estimate/batch は列指向JSONを返す"""
+    import app as agent_app
+    client = agent_app.app.test_client()
+
+    resp = client.post("/estimate/batch", json={
+        "base": {"features": ["auth"]},
+        "grid": {"screen_count": [10, 20], "complexity": ["low", "medium"]}
+    })
+    body = resp.get_json()
+    assert resp.status_code == 200
+    assert body["count"] == 4
+    assert body["columns"]["complexity"] == ["low", "low", "medium", "medium"]
+    assert body["columns"]["screen_count"] == [10, 20, 10, 20]
+    assert body["columns"]["estimated_amount"][2] == 1100000
+
+    assert client.post("/estimate/batch", json={"grid": {}}).status_code == 400
+    invalid = client.post("/estimate/batch", json={"scenarios": [{"screen_count": "ten"}]})
+    assert invalid.status_code == 400
+    assert "screen_count" in invalid.get_json()["error"]
+    assert client.post("/estimate/batch", json={"scenarios": [5]}).status_code == 400
+    assert client.post("/estimate/batch", json="scenarios").status_code == 400
@@ -0,0 +1,177 @@
+import pytest
+import sys
+import os
+import json
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../bench')))
+
+import run_bench
+from run_bench import compare, load_sessions, percentile, run
+
+
+def _run(**kwargs):
+    # 遅延なしのスタブで最小構成のベンチマークを実行する
+    options = dict(concurrency=2, sessions=3, llm_latency_ms=0, llm_token_delay_ms=0,
+                   search_latency_ms=0, calc_latency_ms=0)
+    options.update(kwargs)
+    return run(**options)
+
+
+def test_replays_recorded_sessions_without_errors():
+    """記録済みセッションを全ターン再生し、ステージ別の統計とメモリを報告する"""
+    report = _run()
+    recorded = load_sessions()
+
+    assert report["summary"]["errors"] == 0
+    assert report["summary"]["turns"] == sum(len(s["turns"]) for s in recorded)
+    assert {"knowledge_ms", "calc_ms", "llm_ms", "total_ms", "client_ms"} <= set(report["stages"])
+    assert set(report["stages"]["total_ms"]) == {"count", "mean", "p50", "p95", "p99", "max"}
+    # 見積もり作成ターンは各セッション1回ずつ Calc API まで到達する
+    assert report["stages"]["calc_ms"]["count"] == len(recorded)
+    assert report["paths"]["early"] > report["paths"]["llm"]
+    assert report["memory"]["sessions_measured"] == 3
+    assert report["memory"]["session_bytes_mean"] > 0
+    json.dumps(report)
+
+
+def test_stream_mode_reports_first_token():
+    """/score/stream では初回トークンまでの時間も計測する"""
+    report = _run(stream=True, sessions=1)
+
+    assert report["config"]["endpoint"] == "/score/stream"
+    assert report["summary"]["errors"] == 0
+    assert report["stages"]["first_token_ms"]["count"] == report["paths"]["llm"]
+
+
+def test_cli_writes_report_and_detects_regressions(tmp_path, monkeypatch):
+    """--output でJSONを書き出し、--baseline との比較で劣化を検出する"""
+    baseline = {"summary": {"turns_per_second": 1e9, "errors": 0},
+                "stages": {"total_ms": {"p95": 0.0}}}
+    baseline_path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps(baseline))
+    output = tmp_path / "report.json"
+
+    status = run_bench.main([
+        "--concurrency", "1", "--sessions", "1", "--warmup", "0", "--llm-latency-ms", "0",
+        "--llm-token-delay-ms", "0", "--search-latency-ms", "0", "--calc-latency-ms", "5",
+        "--output", str(output), "--baseline", str(baseline_path)
+    ])
+
+    assert status == 1
+    assert json.loads(output.read_text())["summary"]["errors"] == 0
+
+
+def test_compare_ignores_noise_and_flags_p95_regressions():
+    """p95 の相対的な悪化とスループット低下のみを劣化とみなす"""
+    baseline = {"summary": {"turns_per_second": 100.0, "errors": 0},
+                "stages": {"llm_ms": {"p95": 100.0}, "knowledge_ms": {"p95": 0.2}}}
+    report = {"summary": {"turns_per_second": 95.0, "errors": 0},
+              "stages": {"llm_ms": {"p95": 130.0}, "knowledge_ms": {"p95": 0.9}}}
+
+    assert compare(report, baseline, max_regression=0.2) == ["llm_ms p95 100.0ms -> 130.0ms"]
+    report["summary"]["turns_per_second"] = 70.0
+    assert len(compare(report, baseline, max_regression=0.2)) == 2
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 95) == 0.0
+
+
+def test_gunicorn_mode_runs_the_same_scenarios():
+    """本番エントリポイント（gunicorn）に対しても同じシナリオを実行できる"""
+    pytest.importorskip("gunicorn")
+    report = _run(server="gunicorn", sessions=3)
+
+    assert report["config"]["server"] == "gunicorn"
+    assert report["summary"]["errors"] == 0
+    assert report["summary"]["turns"] == sum(len(s["turns"]) for s in load_sessions())
+
+
+def test_option_micro_benchmark_runs_on_golden_corpus():
+    """選択肢抽出のマイクロベンチマークが旧実装との出力一致を確認して計測する"""
+    import bench_options
+
+    report = bench_options.run(bench_options.load_corpus(bench_options.DEFAULT_CORPUS),
+                               number=1, repeat=1)
+    assert report["replies"] > 0
+    assert set(report["oneshot"]) == {"regex_us", "extractor_us", "speedup"}
+    assert report["stream"]["extractor_us"] > 0
+
+
+def test_bulk_run_diffs_final_estimates_against_snapshots():
+    """一括実行は全ターンを JSONL で出力し、最終見積もりをスナップショットと比較する"""
+    import io
+    import bulk_run
+
+    sessions = bulk_run.load_jsonl(bulk_run.DEFAULT_INPUT)[-2:]
+    broken = json.loads(json.dumps(sessions[0]))
+    broken["name"] = "broken"
+    broken["snapshot"]["result"]["estimated_amount"] += 1
+    output = io.StringIO()
+    summary = bulk_run.run(sessions + [broken], output, processes=0, threads=2, warmup=0)
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert lines[-1] == json.loads(json.dumps(summary))
+    assert summary["errors"] == 0
+    assert summary["verdicts"] == {"match": 2, "mismatch": 1, "no_estimate": 0, "no_snapshot": 0}
+    assert summary["turns"] == sum(len(s["turns"]) for s in sessions + [broken])
+    assert summary["tokens"]["prompt_tokens"] > 0
+    mismatch = next(line for line in lines
+                    if line["type"] == "session" and line["session"] == "broken")
+    assert [d.split(":")[0] for d in mismatch["diff"]] == ["result.estimated_amount"]
+
+
+def test_bulk_run_cli_fails_on_mismatch(tmp_path):
+    """--snapshots で期待値を上書きでき、不一致があれば終了コード 1 を返す"""
+    import bulk_run
+
+    session = bulk_run.load_jsonl(bulk_run.DEFAULT_INPUT)[-1]
+    input_path = tmp_path / "sessions.jsonl"
+    input_path.write_text(json.dumps(session, ensure_ascii=False) + "\n", encoding="utf-8")
+    args = ["--input", str(input_path), "--processes", "0", "--warmup", "0",
+            "--output", str(tmp_path / "out.jsonl")]
+    assert bulk_run.main(args) == 0
+
+    snapshots = tmp_path / "snapshots.json"
+    snapshots.write_text(json.dumps({session["name"]: {"params": {"loc": 1}}}))
+    assert bulk_run.main(args + ["--snapshots", str(snapshots)]) == 1
+
+
+def test_bulk_run_rate_limiter_spaces_calls():
+    """--rate の上限に合わせて呼び出し間隔を空ける"""
+    import time
+    from bulk_run import RateLimiter
+
+    limiter = RateLimiter(50)
+    started = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.monotonic() - started >= 0.09
+
+
+def test_import_time_benchmark_flags_startup_regressions():
+    """import 時間ベンチマークは起動時に読み込まれた遅延対象モジュールと予算超過を検出する"""
+    import bench_imports
+
+    report = bench_imports.run("app", repeat=1, top=3)
+    assert report["deferred"] == []
+    assert report["import_ms"] > 0
+    assert len(report["top"]) == 3
+
+    assert bench_imports.compare(report, budget_ms=1e9) == []
+    assert len(bench_imports.compare(dict(report, deferred=["promptflow"]), budget_ms=0.0)) == 2
+    baseline = {"import_ms": report["import_ms"] / 2}
+    assert bench_imports.compare(report, 1e9, baseline, max_regression=0.2)
+
+
+def test_parse_importtime_output():
+    from bench_imports import parse_importtime
+
+    stderr = ("import time: self [us] | cumulative | imported package\n"
+              "import time:       100 |        100 |   child\n"
+              "import time:       200 |        300 | parent\n")
+    assert parse_importtime(stderr) == [(1, "child", 100), (0, "parent", 300)]
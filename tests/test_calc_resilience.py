@@ -0,0 +1,207 @@
+import pytest
+import sys
+import os
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import call_calc_tool
+from call_calc_tool import call_calc, get_calc_metrics
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class StubCalcServer(ThreadingHTTPServer):
+    """ローカルの Calc API スタブ。statuses を順に返し、尽きたら 200 を返す"""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubCalcHandler)
+        self.statuses = []
+        self.delay = 0.0
+        # 200 で返す本文を差し替える（None なら見積もり JSON）
+        self.raw_body = None
+        self.requests = 0
+        self.client_ports = set()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/api/calculate_estimate"
+
+    def handle_error(self, request, client_address):
+        # タイムアウトしたクライアントの切断は想定内なのでトレースバックを出さない
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class StubCalcHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests += 1
+        server.client_ports.add(self.client_address[1])
+        time.sleep(server.delay)
+        status = server.statuses.pop(0) if server.statuses else 200
+        body = json.dumps({"status": "ok", "estimated_amount": 1100000, "method": payload["method"]}
+                          if status == 200 else {"status": "error"}).encode()
+        if status == 200 and server.raw_body is not None:
+            body = server.raw_body
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def calc_server(monkeypatch):
+    server = StubCalcServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("CALC_API_ENDPOINT", server.url)
+    monkeypatch.setenv("CALC_API_BACKOFF_FACTOR", "0")
+    call_calc_tool.reset_calc_client()
+    yield server
+    call_calc_tool.reset_calc_client()
+    server.shutdown()
+
+
+def _call(screen_count=10):
+    return json.loads(call_calc(method="screen", screen_count=screen_count, features=["auth"],
+                                complexity="medium"))
+
+
+def test_connections_are_reused(calc_server):
+    """プール済みセッションで接続が再利用される"""
+    for screen_count in (10, 20, 30):
+        assert _call(screen_count)["status"] == "ok"
+    assert calc_server.requests == 3
+    assert len(calc_server.client_ports) == 1
+
+
+def test_retries_transient_5xx(calc_server):
+    """503 はバックオフ付きでリトライされる"""
+    calc_server.statuses = [503, 503]
+    assert _call()["status"] == "ok"
+    assert calc_server.requests == 3
+
+
+def test_read_timeouts_are_not_retried(calc_server, monkeypatch):
+    """応答が返らない呼び出しはリトライせず、読み取りタイムアウト1回分で失敗する"""
+    monkeypatch.setenv("CALC_API_READ_TIMEOUT", "0.2")
+    calc_server.delay = 0.5
+
+    started = time.monotonic()
+    assert "Connection Failed" in _call()["message"]
+    assert time.monotonic() - started < 0.5
+    assert calc_server.requests == 1
+
+
+def test_invalid_body_records_a_single_failure(calc_server, monkeypatch):
+    """200 でも JSON でない応答は失敗1回として記録し、成功とは数えない"""
+    monkeypatch.setenv("CALC_CACHE_BACKEND", "none")
+    calc_server.raw_body = b"<html>gateway</html>"
+
+    result = _call()
+    assert result["status"] == "error"
+    assert "invalid response" in result["message"]
+    metrics = get_calc_metrics()["breakers"][calc_server.url]
+    assert (metrics["successes"], metrics["failures"]) == (0, 1)
+
+
+def test_breaker_opens_and_fails_fast(calc_server, monkeypatch):
+    """連続失敗でサーキットが開き、以降はバックエンドを呼ばずに失敗する"""
+    monkeypatch.setenv("CALC_API_MAX_RETRIES", "0")
+    monkeypatch.setenv("CALC_BREAKER_FAILURE_THRESHOLD", "2")
+    calc_server.statuses = [500, 500, 500]
+
+    assert "500" in _call()["message"]
+    assert "500" in _call()["message"]
+    result = _call()
+    assert result["error_type"] == "circuit_open"
+    assert calc_server.requests == 2
+
+    metrics = get_calc_metrics()["breakers"][calc_server.url]
+    assert metrics["state"] == OPEN
+    assert metrics["rejected"] == 1
+
+
+def test_client_errors_do_not_trip_breaker(calc_server, monkeypatch):
+    """4xx はバックエンド障害として数えない"""
+    monkeypatch.setenv("CALC_BREAKER_FAILURE_THRESHOLD", "1")
+    calc_server.statuses = [400]
+    assert "400" in _call()["message"]
+    assert get_calc_metrics()["breakers"][calc_server.url]["state"] == CLOSED
+
+
+def test_breaker_half_open_probe():
+    """リセット時間経過後は1件だけ試行し、成功で閉じる"""
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow_request() is False
+
+    now[0] = 10
+    assert breaker.allow_request() is True
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request() is False
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request() is True
+
+
+def test_identical_payloads_are_served_from_cache(calc_server):
+    """正規化後に同一のペイロードはキャッシュから返る"""
+    first = call_calc(method="screen", screen_count=10, features=["payment", "auth"],
+                      complexity="medium")
+    second = call_calc(method="screen", screen_count=10, features=["auth", "payment", "auth"],
+                       complexity="medium")
+
+    assert first == second
+    assert calc_server.requests == 1
+    cache_stats = get_calc_metrics()["cache"]
+    assert cache_stats["hits"] == 1
+    assert cache_stats["misses"] == 1
+
+
+def test_failed_results_are_not_cached(calc_server, monkeypatch):
+    """エラー応答はキャッシュしない"""
+    monkeypatch.setenv("CALC_API_MAX_RETRIES", "0")
+    calc_server.statuses = [500]
+    assert _call()["status"] == "error"
+    assert _call()["status"] == "ok"
+    assert calc_server.requests == 2
+
+
+def test_cache_can_be_disabled(calc_server, monkeypatch):
+    """CALC_CACHE_BACKEND=none でキャッシュを無効化できる"""
+    monkeypatch.setenv("CALC_CACHE_BACKEND", "none")
+    _call()
+    _call()
+    assert calc_server.requests == 2
+    assert get_calc_metrics()["cache"] == {"backend": "none"}
+
+
+def test_redis_outage_does_not_fail_the_calculation(calc_server, monkeypatch):
+    """共有キャッシュ（Redis）が落ちていても Calc API の結果をそのまま返す"""
+    from ttl_cache import RedisCache
+
+    class DownClient:
+        def get(self, key):
+            raise ConnectionError("redis down")
+
+        def set(self, *args, **kwargs):
+            raise ConnectionError("redis down")
+
+    monkeypatch.setattr(call_calc_tool, "_get_cache", lambda: RedisCache(DownClient(), "calc:"))
+    assert _call()["status"] == "ok"
+    assert calc_server.requests == 1
@@ -1,38 +1,70 @@
 import pytest
 import sys
 import os
+import json
 
 # プロジェクトルートをパスに追加してインポート可能にする
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
 
-from call_calc_tool import call_calc, _mock_calc
-
-def test_mock_calc_basic():
-    """モック計算の基本動作"""
-    user_input = {
-        "project_type": "web_app",
-        "duration_months": 6,
-        "team_size": 3
-    }
-    
-    result = _mock_calc(user_input)
-    
-    # 100万 * 6ヶ月 * 3人 = 1800万
-    assert result["total"] == 18000000
-    assert result["breakdown"]["development"] == 12600000
-    assert result["is_mock"] is True
-
-def test_call_calc_with_mock_mode(monkeypatch):
-    """モックモードでのcall_calc"""
-    monkeypatch.setenv("USE_MOCK_CALC", "true")
-    
-    user_input = {"duration_months": 3, "team_size": 2}
-    result = call_calc(user_input)
-    
-    assert result["is_mock"] is True
-    assert result["total"] == 6000000
-
-def test_call_calc_missing_params():
-    """パラメータ不足時のデフォルト値（デフォルト値 6ヶ月, 3人が使用されること）"""
-    result = _mock_calc({})
-    assert result["total"] == 18000000
+import call_calc_tool
+from call_calc_tool import call_calc
+
+
+@pytest.fixture
+def captured(monkeypatch):
+    """Calc API へ送るペイロードを記録する（ネットワークには接続しない）"""
+    payloads = []
+
+    def fake_remote(payload):
+        payloads.append(payload)
+        return json.dumps({"status": "ok", "estimated_amount": 1})
+
+    monkeypatch.setenv("CALC_ENGINE", "remote")
+    monkeypatch.setattr(call_calc_tool, "_call_remote", fake_remote)
+    return payloads
+
+
+def test_screen_method_requires_screen_count_and_features(captured):
+    """画面数法では画面数と機能一覧が必須"""
+    result = json.loads(call_calc(method="screen", complexity="medium"))
+
+    assert result["status"] == "error"
+    assert result["error_type"] == "validation_error"
+    assert result["missing_fields"] == ["screen_count", "features"]
+    assert captured == []
+
+
+def test_step_and_fp_methods_require_productivity(captured):
+    """STEP法・FP法では規模と生産性（人日/単位）が必須"""
+    step = json.loads(call_calc(method="step", loc=10000))
+    fp = json.loads(call_calc(method="fp", man_days_per_unit=1.0))
+
+    assert step["missing_fields"] == ["man_days_per_unit"]
+    assert fp["missing_fields"] == ["fp_count"]
+    assert json.loads(call_calc(method="screen", screen_count=10, features=[],
+                                complexity=None))["missing_fields"] == ["complexity"]
+
+
+def test_payload_is_canonicalized(captured):
+    """リストは重複排除・ソートされ、同じ入力は同じペイロードになる"""
+    call_calc(screen_count=10, features=["payment", "auth", "payment"],
+              phase3_items=["ui_design", "design_system"], confidence="high", api_version="v2")
+    call_calc(screen_count=10, features=["auth", "payment"],
+              phase3_items=["design_system", "ui_design"], confidence="high", api_version="v2")
+
+    assert captured[0] == captured[1]
+    assert captured[0]["features"] == ["auth", "payment"]
+    assert captured[0]["phase3_items"] == ["design_system", "ui_design"]
+    assert captured[0]["api_version"] == "v2"
+    assert captured[0]["method"] == "screen"
+
+
+def test_local_engine_returns_calc_api_shape(monkeypatch):
+    """CALC_ENGINE=local はプロセス内エンジンで Calc API と同じ形の結果を返す"""
+    monkeypatch.setenv("CALC_ENGINE", "local")
+    result = json.loads(call_calc(screen_count=10, features=["auth"], complexity="medium"))
+
+    assert result["status"] == "ok"
+    # (5 + 10 * 1.5) 人日 * 50,000 円 * バッファ 1.1
+    assert result["estimated_amount"] == 1100000
+    assert set(result["breakdown"]) >= {"development", "phase2_design", "phase3_visual"}
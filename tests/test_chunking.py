@@ -0,0 +1,97 @@
+import sys
+import os
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import lookup_knowledge as lk
+from chunking import chunk_id, split_markdown
+
+
+def _words(text):
+    """テスト用の単純なトークンカウンタ（空白区切りの単語数）"""
+    return len(text.split())
+
+
+def test_heading_path_tracks_nested_headings():
+    """見出し階層が heading_path に記録される"""
+    content = "# 料金\n\n## 保守\n\n月額 保守 費用\n\n## 開発\n\n開発 費用\n"
+    chunks = split_markdown(content, "a.md", max_tokens=50, min_tokens=0, counter=_words)
+
+    assert [c["heading_path"] for c in chunks] == ["料金", "料金 > 保守", "料金 > 開発"]
+    assert [c["chunk_index"] for c in chunks] == [0, 1, 2]
+    assert chunks[1]["id"] == chunk_id("a.md", "料金 > 保守", 0)
+    assert all(c["source"] == "a.md" for c in chunks)
+
+
+def test_chunk_ids_survive_edits_to_other_sections():
+    """他のセクションを追加・編集しても、変更のないチャンクの id は変わらない"""
+    content = "# 料金\n\n月額 費用\n\n# 保守\n\n保守 費用\n"
+    edited = "# 概要\n\n新しい 節\n\n# 料金\n\n月額 費用 改定\n\n# 保守\n\n保守 費用\n"
+    before = split_markdown(content, "a.md", max_tokens=50, min_tokens=0, counter=_words)
+    after = split_markdown(edited, "a.md", max_tokens=50, min_tokens=0, counter=_words)
+
+    ids = {c["heading_path"]: c["id"] for c in after}
+    assert ids["保守"] == before[1]["id"]
+    assert ids["料金"] == before[0]["id"]
+    assert len(set(ids.values())) == 3
+
+
+def test_chunks_under_one_heading_get_distinct_ids():
+    """同じ見出し配下で分割されたチャンクは見出し内の連番で区別される"""
+    content = "# 大きな節\n\n" + "\n\n".join(f"p{i} " + "w " * 8 for i in range(6))
+    chunks = split_markdown(content, "a.md", max_tokens=30, overlap_tokens=0,
+                            min_tokens=0, counter=_words)
+
+    assert len(chunks) > 1
+    assert [c["id"] for c in chunks] == [chunk_id("a.md", "大きな節", i) for i in range(len(chunks))]
+
+
+def test_headings_inside_code_fence_are_ignored():
+    """コードブロック内の # は見出しとして扱わない"""
+    content = "# 手順\n\n```\n# コメント\necho ok\n```\n"
+    chunks = split_markdown(content, "a.md", max_tokens=50, min_tokens=0, counter=_words)
+
+    assert len(chunks) == 1
+    assert chunks[0]["heading_path"] == "手順"
+    assert "# コメント" in chunks[0]["content"]
+
+
+def test_large_section_is_packed_within_budget_with_overlap():
+    """トークン上限を超えるセクションは段落単位で分割し、末尾段落を重複させる"""
+    paragraphs = [f"p{i} " + "w " * 8 for i in range(6)]  # 各10トークン
+    content = "# 大きな節\n\n" + "\n\n".join(paragraphs)
+    chunks = split_markdown(content, "a.md", max_tokens=30, overlap_tokens=10,
+                            min_tokens=0, counter=_words)
+
+    assert len(chunks) > 1
+    assert all(_words(c["content"]) <= 30 for c in chunks)
+    assert all(c["heading_path"] == "大きな節" for c in chunks)
+    # 前のチャンクの最後の段落が次のチャンクの先頭に含まれる
+    last_paragraph = chunks[0]["content"].split("\n\n")[-1]
+    assert chunks[1]["content"].startswith(last_paragraph)
+
+
+def test_small_sections_are_merged_into_next():
+    """タイトルだけの小さなセクションは次のセクションと結合される"""
+    content = "# タイトル\n\n## 概要\n\n" + "本文 " * 20
+    chunks = split_markdown(content, "a.md", max_tokens=100, min_tokens=5, counter=_words)
+
+    assert len(chunks) == 1
+    assert chunks[0]["heading_path"] == "タイトル"
+    assert chunks[0]["content"].startswith("# タイトル")
+
+
+def test_format_results_respects_token_budget():
+    """RAG_MAX_TOKENS を超えるパッセージはプロンプトに含めない"""
+    results = [
+        {"source": "a.md", "heading_path": "保守", "content": "あ" * 50},
+        {"source": "b.md", "heading_path": "", "content": "い" * 500},
+        {"source": "c.md", "heading_path": "開発", "content": "う" * 50},
+    ]
+    text = lk._format_results(results, max_tokens=200)
+
+    assert "--- Source: a.md > 保守 ---" in text
+    assert "b.md" not in text
+    assert "--- Source: c.md > 開発 ---" in text
+    assert lk._format_results([], max_tokens=200) == "No relevant internal documents found."
@@ -0,0 +1,139 @@
+import pytest
+import sys
+import os
+import json
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import call_calc_tool
+from call_calc_tool import call_calc, get_calc_metrics
+from estimation_engine import estimate, diff_results
+
+
+def _payload(**overrides):
+    payload = {
+        "method": "screen", "screen_count": None, "complexity": "medium",
+        "features": [], "phase2_items": [], "phase3_items": [],
+        "loc": None, "fp_count": None, "man_days_per_unit": None, "confidence": None
+    }
+    payload.update(overrides)
+    return payload
+
+
+def test_golden_snapshot_screen_method():
+    """Golden Snapshot #1: 画面数法 (10画面, 認証, 標準)"""
+    result = estimate(_payload(screen_count=10, features=["auth"]))
+
+    assert result["status"] == "ok"
+    assert result["estimated_amount"] == 1100000
+    assert result["estimated_range"] == {"min": 1100000, "max": 1100000}
+    development = result["breakdown"]["development"]
+    assert development["base_days"] == 20.0
+    assert development["cost"] == 1000000
+    assert development["details"] == {"feature_days": 5, "screen_days": 15.0}
+
+
+def test_golden_snapshot_step_method():
+    """Golden Snapshot #2: STEP法 (10000 LOC, 0.05人日/step)"""
+    result = estimate(_payload(method="step", loc=10000, man_days_per_unit=0.05))
+
+    assert result["estimated_amount"] == 27500000
+    assert result["breakdown"]["development"]["total_days"] == 500.0
+    assert result["breakdown"]["development"]["cost"] == 25000000
+
+
+def test_golden_snapshot_vendor_mixed():
+    """Golden Snapshot #3: デザイン外注 (UIデザイン, Low Confidence ±40%)"""
+    result = estimate(_payload(screen_count=10, features=["auth"], phase3_items=["ui_design"],
+                               confidence="low"))
+
+    assert result["estimated_amount"] == 2112000
+    assert result["estimated_range"] == {"min": 1707200, "max": 2516800}
+    phase3 = result["breakdown"]["phase3_visual"]
+    assert phase3["total_days"] == 10.0
+    assert phase3["cost"] == 920000
+    assert phase3["range"] == {"min": 552000, "max": 1288000}
+
+
+def test_complexity_multiplier_and_fp_method():
+    """複雑度係数は開発工数に掛かる"""
+    result = estimate(_payload(method="fp", fp_count=100, man_days_per_unit=1.0, complexity="high"))
+    assert result["breakdown"]["development"]["total_days"] == 130.0
+    assert result["breakdown"]["development"]["cost"] == 6500000
+
+
+def test_vendor_confidence_is_required():
+    """Phase 3 があるのに確定度がない場合はエラー"""
+    result = estimate(_payload(screen_count=10, phase3_items=["ui_design"]))
+    assert result["status"] == "error"
+    assert "confidence" in result["message"]
+
+
+def test_diff_results_reports_remote_keys_only():
+    """リモート結果に存在するキーだけを比較する"""
+    local = {"a": 1, "b": {"c": 2.0}, "extra": 1}
+    assert diff_results(local, {"a": 1, "b": {"c": 2}}) == []
+    assert diff_results(local, {"a": 2, "d": 1}) == ["a: local=1 remote=2", "d: missing locally"]
+
+
+@pytest.fixture(autouse=True)
+def reset_calc():
+    call_calc_tool.reset_calc_client()
+    yield
+    call_calc_tool.reset_calc_client()
+
+
+def test_call_calc_local_engine_skips_network(monkeypatch):
+    """CALC_ENGINE=local ではリモートを呼ばない"""
+    monkeypatch.setenv("CALC_ENGINE", "local")
+    monkeypatch.setattr(call_calc_tool, "_call_remote",
+                        lambda payload: pytest.fail("remote must not be called"))
+
+    result = json.loads(call_calc(method="screen", screen_count=10, features=["auth"],
+                                  complexity="medium"))
+    assert result["estimated_amount"] == 1100000
+
+
+def test_call_calc_local_engine_falls_back_to_remote(monkeypatch):
+    """ローカルエンジンが失敗した場合はリモートにフォールバックする"""
+    monkeypatch.setenv("CALC_ENGINE", "local")
+
+    def broken(payload):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(call_calc_tool.estimation_engine, "estimate", broken)
+    monkeypatch.setattr(call_calc_tool, "_call_remote",
+                        lambda payload: json.dumps({"status": "ok", "estimated_amount": 1}))
+
+    assert json.loads(call_calc(method="screen", screen_count=10, features=[],
+                                complexity="medium"))["estimated_amount"] == 1
+
+
+def test_call_calc_parity_mode_counts_mismatches(monkeypatch):
+    """CALC_ENGINE=parity はリモート結果を返し、差分を計数する"""
+    monkeypatch.setenv("CALC_ENGINE", "parity")
+    monkeypatch.setattr(call_calc_tool, "_call_remote",
+                        lambda payload: json.dumps({"status": "ok", "estimated_amount": 999}))
+
+    result = json.loads(call_calc(method="screen", screen_count=10, features=["auth"],
+                                  complexity="medium"))
+    assert result["estimated_amount"] == 999
+    assert get_calc_metrics()["parity"] == {"checked": 1, "mismatched": 1}
+
+
+def test_call_calc_parity_errors_do_not_affect_the_result(monkeypatch):
+    """parity の比較でローカルエンジンが失敗してもリモート結果を返し、不一致として数える"""
+    monkeypatch.setenv("CALC_ENGINE", "parity")
+
+    def broken(payload):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(call_calc_tool.estimation_engine, "estimate", broken)
+    monkeypatch.setattr(call_calc_tool, "_call_remote",
+                        lambda payload: json.dumps({"status": "ok", "estimated_amount": 1}))
+
+    result = json.loads(call_calc(method="screen", screen_count=10, features=[],
+                                  complexity="medium"))
+    assert result["estimated_amount"] == 1
+    assert get_calc_metrics()["parity"] == {"checked": 1, "mismatched": 1}
@@ -0,0 +1,169 @@
+import inspect
+import json
+import sys
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import app as agent_app
+from flow_executor import Flow, FlowError, FlowExecutor, UpstreamError, load_flow
+from calc_inputs import calc_inputs
+from call_calc_tool import call_calc
+from lookup_knowledge import lookup_knowledge
+import lookup_knowledge as knowledge
+
+
+def _flow(*nodes, inputs=None):
+    return Flow({"inputs": inputs or {}, "nodes": list(nodes)})
+
+
+def _node(name, **fields):
+    return dict({"name": name, "type": "python"}, **fields)
+
+
+def test_independent_nodes_run_concurrently():
+    """依存関係のないノードは並行実行され、依存するノードは完了後に実行される"""
+    flow = _flow(
+        _node("a", inputs={"x": "${inputs.x}"}),
+        _node("b", inputs={"x": "${inputs.x}"}),
+        _node("c", inputs={"a": "${a.output.value}", "b": "${b.output}"}),
+    )
+    tools = {
+        "a": lambda x: time.sleep(0.3) or {"value": x + 1},
+        "b": lambda x: time.sleep(0.3) or x * 10,
+        "c": lambda a, b: a + b,
+    }
+    started = time.perf_counter()
+    results = FlowExecutor(flow).run({"x": 1}, tools)
+    elapsed = time.perf_counter() - started
+
+    assert results["c"].value == 12
+    assert elapsed < 0.55
+    assert results["a"].elapsed_ms >= 290
+
+
+def test_targets_defaults_and_activate():
+    """targets に必要なノードだけを実行し、activate が偽のノードと依存先はバイパスする"""
+    flow = _flow(
+        _node("gate", inputs={}, activate={"when": "${inputs.enabled}", "is": True}),
+        _node("after_gate", inputs={"v": "${gate.output}"}),
+        _node("always", inputs={"name": "${inputs.name}"}),
+        _node("unused", inputs={}),
+        inputs={"enabled": {"type": "bool", "default": False},
+                "name": {"type": "string", "default": "x"}},
+    )
+    calls = []
+    tools = {name: (lambda n: lambda **kw: calls.append(n) or kw)(name)
+             for name in ("gate", "after_gate", "always", "unused")}
+    executor = FlowExecutor(flow)
+
+    results = executor.run({}, tools, targets=["after_gate", "always"])
+    assert set(results) == {"always"}
+    assert results["always"].value == {"name": "x"}
+    assert calls == ["always"]
+
+    results = executor.run({"enabled": True}, tools, targets=["after_gate"])
+    assert set(results) == {"gate", "after_gate"}
+
+
+def test_failures_and_timeouts_propagate_to_dependents():
+    """失敗・タイムアウトしたノードに依存するノードは実行せずエラーにする"""
+    def boom():
+        raise RuntimeError("boom")
+
+    flow = _flow(
+        _node("broken", inputs={}),
+        _node("child", inputs={"v": "${broken.output}"}),
+        _node("slow", inputs={}),
+        _node("fast", inputs={}),
+    )
+    results = FlowExecutor(flow).run(
+        {}, {"broken": boom, "child": lambda v: v, "slow": lambda: time.sleep(1.0),
+             "fast": lambda: "ok"},
+        timeouts={"slow": 0.1})
+
+    assert isinstance(results["broken"].error, RuntimeError)
+    assert isinstance(results["child"].error, UpstreamError)
+    assert results["slow"].timed_out
+    assert results["fast"].value == "ok"
+
+
+def test_invalid_flows_are_rejected():
+    with pytest.raises(FlowError):
+        _flow(_node("a", inputs={"v": "${b.output}"}))
+    with pytest.raises(FlowError):
+        _flow(_node("a", inputs={"v": "${b.output}"}), _node("b", inputs={"v": "${a.output}"}))
+    with pytest.raises(FlowError):
+        FlowExecutor(_flow(_node("a", inputs={}))).run({}, {})
+
+
+def test_dag_matches_tool_signatures():
+    """flow.dag.yaml の各 Python ノードの入力はツール関数の引数と一致する"""
+    flow = load_flow()
+    tools = {"calc_inputs": calc_inputs, "call_calc": call_calc,
+             "lookup_knowledge": lookup_knowledge}
+    for name, tool in tools.items():
+        parameters = inspect.signature(tool).parameters
+        assert set(flow.nodes[name].inputs) <= set(parameters), name
+    assert flow.nodes["call_calc"].depends_on == ["calc_inputs"]
+    assert flow.nodes["generate_response"].depends_on == ["call_calc", "lookup_knowledge"]
+
+
+def test_llm_node_passes_every_template_variable():
+    """generate_response ノードはテンプレートが参照する変数をすべて入力として渡す"""
+    import jinja2
+    from jinja2 import meta
+
+    with open(agent_app.template_path, encoding="utf-8") as f:
+        variables = meta.find_undeclared_variables(jinja2.Environment().parse(f.read()))
+    assert variables <= set(load_flow().nodes["generate_response"].inputs)
+
+
+def test_dag_runs_calculation_locally(monkeypatch):
+    """ローカル実行で収集済みパラメータから計算ノードまで実行できる"""
+    monkeypatch.setenv("CALC_ENGINE", "local")
+    params = {"method": "screen", "screen_count": 10, "features": ["auth"],
+              "complexity": "medium", "phase2_items": [], "phase3_items": []}
+    results = FlowExecutor(load_flow()).run(
+        {"user_input": {}, "collected_params": params, "calculate": True},
+        {"calc_inputs": calc_inputs, "call_calc": call_calc}, targets=["call_calc"])
+
+    assert results["call_calc"].ok
+    assert json.loads(results["call_calc"].value)["status"] != "error"
+
+
+def test_app_relies_on_the_retrieval_cache_only(monkeypatch):
+    """/score はノードキャッシュを使わず、検索結果キャッシュ（再インデックスで破棄）のみを使う"""
+    message = SimpleNamespace(content="了解しました。")
+    create = lambda **kwargs: SimpleNamespace(choices=[SimpleNamespace(message=message)])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(agent_app, "get_openai_client", lambda: client)
+    monkeypatch.setattr(agent_app, "render_messages",
+                        lambda *args: [{"role": "user", "content": "p"}])
+
+    class FakeIndex:
+        fingerprint = "v1"
+        searches = []
+
+        def search(self, query, top_k=3):
+            FakeIndex.searches.append(query)
+            return [{"source": "a.md", "heading_path": "", "content": query}]
+
+    monkeypatch.setenv("RAG_BACKEND", "local")
+    monkeypatch.setattr(knowledge, "get_local_index", lambda: FakeIndex())
+    monkeypatch.setattr(knowledge, "_retrieval_cache_ready", False)
+    http = agent_app.app.test_client()
+    for text in ("ノードキャッシュの確認", "ノードキャッシュの確認", "　ノードキャッシュの確認 "):
+        assert http.post("/score", json={"user_input": {"message": text}}).status_code == 200
+    assert len(FakeIndex.searches) == 1
+
+    knowledge.invalidate_retrieval_cache()
+    assert http.post("/score",
+                     json={"user_input": {"message": "ノードキャッシュの確認"}}).status_code == 200
+    assert len(FakeIndex.searches) == 2
+    assert "flow_cache" not in http.get("/admin/stats").get_json()
@@ -1,42 +1,48 @@
 import pytest
 import os
-from promptflow import PFClient
+
+# Prompt Flow の実行には Azure OpenAI の接続（azure_openai_connection_final）が必要
+pytestmark = pytest.mark.skipif(
+    not os.getenv("AZURE_OPENAI_API_KEY"),
+    reason="Azure OpenAI credentials are required to run the flow"
+)
+
 
 @pytest.fixture
 def pf_client():
+    from promptflow.client import PFClient
     return PFClient()
 
+
 @pytest.fixture
 def flow_path():
     return os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent'))
 
+
 def test_flow_basic_execution(pf_client, flow_path):
-    """Flow基本実行テスト"""
+    """Flow基本実行テスト（LLMの応答テキストが返る）"""
     result = pf_client.test(
         flow=flow_path,
         inputs={
             "user_input": {
-                "project_type": "web_app",
-                "duration_months": 6,
-                "team_size": 3
+                "message": "ECサイトを作りたい",
+                "project_type": "Webサービス"
             }
         }
     )
-    
+
     assert result is not None
-    assert "response" in result
-    assert result["response"]["success"] is True
-    assert result["response"]["data"]["total"] == 18000000
+    assert isinstance(result["response"], str)
+    assert result["response"].strip()
+
 
 def test_flow_with_minimal_input(pf_client, flow_path):
-    """最小限の入力（空辞書）でのテスト"""
+    """最小限の入力（空辞書）でも応答を返す"""
     result = pf_client.test(
         flow=flow_path,
         inputs={
             "user_input": {}
         }
     )
-    
-    # デフォルト値 6ヶ月, 3人が使用される
-    assert result["response"]["success"] is True
-    assert result["response"]["data"]["total"] == 18000000
+
+    assert result["response"].strip()
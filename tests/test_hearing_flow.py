@@ -0,0 +1,162 @@
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import app as agent_app
+import hearing_flow
+
+
+def _params(**overrides):
+    params = {"method": None, "features": [], "phase2_items": [], "phase3_items": [],
+              "screen_count": None, "complexity": None, "loc": None, "fp_count": None,
+              "man_days_per_unit": None, "confidence": None}
+    params.update(overrides)
+    return params
+
+
+def test_next_step_follows_method_specific_order():
+    """手法ごとに次に聞くべき項目が決まる"""
+    assert hearing_flow.next_step(_params(), []) is None
+    assert hearing_flow.next_step(_params(method="screen"), [])["name"] == "features"
+    assert hearing_flow.next_step(_params(method="step"), [])["name"] == "loc"
+    assert hearing_flow.next_step(_params(method="fp", fp_count=100), [])["name"] == "man_days_per_unit"
+
+    screen = _params(method="screen", complexity="medium")
+    assert hearing_flow.next_step(screen, ["features"])["name"] == "screen_count"
+    screen["screen_count"] = 20
+    assert hearing_flow.next_step(screen, ["features"])["name"] == "design_scope"
+    # Phase 3 を選ばなければ確定度は聞かない
+    assert hearing_flow.next_step(screen, ["features", "design_scope"]) is None
+    screen["phase3_items"] = ["ui_design"]
+    assert hearing_flow.next_step(screen, ["features", "design_scope"])["name"] == "confidence"
+
+
+def test_reply_hides_selected_items_and_offers_next():
+    """複数選択ステップは選択済みの項目を除き、[次へ] を末尾に出す"""
+    data = hearing_flow.reply(_params(method="screen", features=["payment"]), [],
+                              agent_app.PARAM_MAPPING, recorded="決済機能")
+
+    labels = [o["label"] for o in data["options"]]
+    assert data["message"].startswith("「決済機能」を記録しました。")
+    assert "決済機能" not in labels
+    assert labels[-1] == hearing_flow.NEXT_OPTION
+    assert "[ユーザー認証]" in data["message"]
+
+
+@pytest.fixture
+def no_llm(monkeypatch):
+    calls = {"llm": 0, "knowledge": 0}
+
+    def create(**kwargs):
+        calls["llm"] += 1
+        message = SimpleNamespace(content="# プロジェクト見積もり・提案書\n")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(agent_app, "get_openai_client", lambda: client)
+    monkeypatch.setattr(agent_app, "render_messages",
+                        lambda *args: [{"role": "user", "content": "prompt"}])
+
+    def lookup(user_input):
+        calls["knowledge"] += 1
+        return ""
+    monkeypatch.setattr(agent_app, "lookup_knowledge", lookup)
+    monkeypatch.setenv("CALC_ENGINE", "local")
+    return calls
+
+
+def test_option_turns_skip_retrieval_and_llm(no_llm):
+    """手法選択後の選択肢ターンは検索もLLMも呼ばず、最後の見積もり作成のみLLMを使う"""
+    client = agent_app.app.test_client()
+    session_id = None
+    turns = ["画面数法", "決済機能", "ユーザー認証", "次へ", "標準", "20画面",
+             "UIデザイン", "次へ", "標準的"]
+    for option in turns:
+        data = client.post("/score", json={"session_id": session_id,
+                                           "user_input": {"selected_option": option}}).get_json()
+        session_id = data["session_id"]
+        assert data["is_complete"] is False
+
+    assert no_llm == {"llm": 0, "knowledge": 0}
+    assert [o["label"] for o in data["options"]] == [hearing_flow.CALCULATE_OPTION]
+
+    params = agent_app.sessions.get(session_id).collected_params
+    assert params["features"] == ["payment", "auth"]
+    assert params["complexity"] == "medium"
+    assert params["screen_count"] == 20
+    assert params["phase3_items"] == ["ui_design"]
+    assert params["confidence"] == "medium"
+
+    final = client.post("/score", json={"session_id": session_id,
+                                        "user_input": {"selected_option": "見積もり作成"}}).get_json()
+    assert final["is_complete"] is True
+    assert no_llm == {"llm": 1, "knowledge": 1}
+
+
+def test_step_method_productivity_options_are_parsed(no_llm):
+    """STEP法の生産性ラベル（人日/step）は LOC ではなく生産性として記録される"""
+    client = agent_app.app.test_client()
+    session_id = None
+    for option in ["STEP法", "10000 LOC", "標準 (0.05人日/step)"]:
+        data = client.post("/score", json={"session_id": session_id,
+                                           "user_input": {"selected_option": option}}).get_json()
+        session_id = data["session_id"]
+
+    params = agent_app.sessions.get(session_id).collected_params
+    assert params["loc"] == 10000
+    assert params["man_days_per_unit"] == 0.05
+    assert "機能" in data["message"]
+    assert no_llm["llm"] == 0
+
+
+def test_free_text_and_disabled_fast_path_use_llm(no_llm, monkeypatch):
+    """自由記述、または HEARING_FAST_PATH=false の場合は従来どおりLLMで応答する"""
+    client = agent_app.app.test_client()
+    client.post("/score", json={"user_input": {"message": "ECサイトを作りたい"}})
+    assert no_llm["llm"] == 1
+
+    monkeypatch.setenv("HEARING_FAST_PATH", "false")
+    data = client.post("/score", json={"user_input": {"selected_option": "決済機能"}}).get_json()
+    assert no_llm["llm"] == 2
+    assert data["is_complete"] is True
+
+
+def test_free_text_parameters_are_offered_as_options(no_llm):
+    """手法確定後、既知の項目だけを述べた自由記述は記録せず確認用の選択肢として返す"""
+    client = agent_app.app.test_client()
+    data = client.post("/score", json={"user_input": {"selected_option": "STEP法"}}).get_json()
+    session_id = data["session_id"]
+
+    data = client.post("/score", json={"session_id": session_id,
+                                       "user_input": {"message": "1,000 LOC で決済とチャットが必要"}}
+                       ).get_json()
+    labels = [o["label"] for o in data["options"]]
+    assert labels[:3] == ["1000 LOC", "決済機能", "リアルタイム機能"]
+    assert no_llm["llm"] == 0
+    params = agent_app.sessions.get(session_id).collected_params
+    assert params["loc"] is None and params["features"] == []
+
+    # ボタンを押すと記録される（カンマ区切りの数値も正しく読む）
+    client.post("/score", json={"session_id": session_id,
+                                "user_input": {"selected_option": "1,000 LOC"}})
+    assert agent_app.sessions.get(session_id).collected_params["loc"] == 1000
+
+    # 既知の項目以外を含む自由記述は LLM が応答する
+    client.post("/score", json={"session_id": session_id,
+                                "user_input": {"message": "ECサイトで決済が必要"}})
+    assert no_llm["llm"] == 1
+
+
+def test_low_confidence_option_does_not_unlock_fast_path(no_llm):
+    """曖昧な選択肢（信頼度がしきい値未満）は手法として記録せず、LLM が応答する"""
+    client = agent_app.app.test_client()
+    data = client.post("/score", json={"user_input": {"selected_option": "Stepで見積もりたい"}}
+                       ).get_json()
+
+    params = agent_app.sessions.get(data["session_id"]).collected_params
+    assert params["method"] is None
+    assert no_llm["llm"] == 1
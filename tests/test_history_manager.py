@@ -0,0 +1,117 @@
+import sys
+import os
+import json
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import history_manager as hm
+
+
+def _words(text):
+    """テスト用の単純なトークンカウンタ（4文字=1トークン）"""
+    return (len(text) + 3) // 4
+
+
+def _history(n, content="メッセージ"):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{content}{i}",
+             "timestamp": "2026-01-01T00:00:00"} for i in range(n)]
+
+
+def test_recent_messages_are_kept_verbatim_and_older_summarized():
+    """直近 N 件はそのまま、それ以前は要約に畳み込む"""
+    messages, summary = hm.compact_history(_history(10), hm.new_summary(), budget=10000,
+                                           keep_messages=4, counter=_words)
+
+    assert messages[0]["role"] == "summary"
+    assert messages[0]["content"].split("\n") == [f"{'user' if i % 2 == 0 else 'assistant'}: メッセージ{i}"
+                                                  for i in range(6)]
+    assert [m["content"] for m in messages[1:]] == [f"メッセージ{i}" for i in range(6, 10)]
+    # タイムスタンプはプロンプトに含めない
+    assert "timestamp" not in messages[1]
+    assert summary["covered"] == 6
+
+
+def test_summary_is_incremental():
+    """要約済みのメッセージは再処理せず、新しく窓から外れた分だけ追加する"""
+    history = _history(8)
+    _, summary = hm.compact_history(history, hm.new_summary(), budget=10000, keep_messages=4)
+    summary["lines"][0] = "cached line"
+
+    history += _history(2, content="追加")
+    messages, summary = hm.compact_history(history, summary, budget=10000, keep_messages=4)
+
+    assert summary["covered"] == 6
+    assert summary["lines"][0] == "cached line"
+    assert len(summary["lines"]) == 6
+
+
+def test_proposal_drafts_collapse_to_marker():
+    """過去の提案書ドラフトは1行のマーカーに要約される"""
+    proposal = {"role": "assistant", "content": "# プロジェクト見積もり・提案書\n" + "表\n" * 500}
+    assert hm.summarize_message(proposal) == "assistant: （見積もり提案書を提示）"
+    long = {"role": "user", "content": "あ" * 300}
+    assert hm.summarize_message(long) == "user: " + "あ" * hm.SUMMARY_LINE_CHARS + "…"
+
+
+def test_budget_pressure_folds_verbatim_window():
+    """予算を超える場合は直近ウィンドウも要約へ移し、最新メッセージは残す"""
+    history = _history(6, content="長い発言" * 50)
+    messages, summary = hm.compact_history(history, hm.new_summary(), budget=200,
+                                           keep_messages=6, counter=_words)
+
+    assert _words(json.dumps(messages, ensure_ascii=False)) <= 200
+    assert messages[-1]["content"] == history[-1]["content"]
+    assert summary["covered"] == 5
+
+
+def test_history_replaced_resets_summary():
+    """履歴が短くなった（クライアントから復元された）場合は要約をやり直す"""
+    summary = {"lines": ["old"], "covered": 50}
+    messages, summary = hm.compact_history(_history(2), summary, budget=1000, keep_messages=4)
+    assert summary == {"lines": [], "covered": 0}
+    assert len(messages) == 2
+
+
+def test_trim_knowledge_drops_lowest_ranked_passages():
+    """ナレッジは下位のパッセージから削って予算に収める"""
+    knowledge = "\n\n".join(f"--- Source: {i}.md ---\n" + "x" * 400 for i in range(3))
+    trimmed = hm.trim_knowledge(knowledge, 250, counter=_words)
+
+    assert "0.md" in trimmed and "1.md" in trimmed and "2.md" not in trimmed
+    assert hm.trim_knowledge(knowledge, 10, counter=_words) == ""
+
+
+def test_fit_prompt_stays_under_budget_and_reports_savings(monkeypatch):
+    """プロンプト全体が予算内に収まり、削減トークン数が集計される"""
+    monkeypatch.setattr(hm, "stats", hm.PromptStats())
+    history = _history(30, content="こんにちは、見積もりについて相談です。" * 10)
+    config = {"budget": 1500, "keep_messages": 4, "summary_tokens": 300}
+
+    knowledge, messages, summary, usage = hm.fit_prompt(
+        history, None, "--- Source: a.md ---\n知識", fixed_parts=['{"method": "screen"}'],
+        template_tokens=500, config=config)
+
+    assert usage["prompt_tokens"] <= 1500
+    assert usage["saved_tokens"] == usage["full_history_tokens"] - usage["history_tokens"] > 0
+    assert knowledge.startswith("--- Source: a.md")
+    stats = hm.get_prompt_stats()
+    assert stats["prompts"] == 1
+    assert stats["saved_tokens"] == usage["saved_tokens"]
+    assert stats["summarized_messages"] == summary["covered"]
+
+
+def test_fit_prompt_uses_the_running_history_token_count(monkeypatch):
+    """呼び出し側が保持する履歴トークン数を使い、履歴全体を再トークン化しない"""
+    monkeypatch.setattr(hm, "stats", hm.PromptStats())
+    history = _history(30, content="見積もりの相談です。" * 10)
+    config = {"budget": 1500, "keep_messages": 4, "summary_tokens": 300}
+    calls = []
+    monkeypatch.setattr(hm, "message_tokens", lambda m: calls.append(m) or 0)
+
+    _, _, _, usage = hm.fit_prompt(history, None, "", fixed_parts=[], config=config,
+                                   full_history_tokens=100000)
+
+    assert calls == []
+    assert usage["full_history_tokens"] == 100000
+    assert usage["saved_tokens"] == 100000 - usage["history_tokens"]
@@ -0,0 +1,287 @@
+import sys
+import os
+import hashlib
+import json
+import threading
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+from azure.core.exceptions import ResourceNotFoundError
+
+import index_rags
+
+
+class FakeResult:
+    def __init__(self, key, succeeded=True):
+        self.key = key
+        self.succeeded = succeeded
+
+
+class FakeSearchClient:
+    """merge_or_upload / delete の呼び出しを記録する SearchClient の代替"""
+
+    def __init__(self, fail_ids=()):
+        self.docs = {}
+        self.calls = []
+        self.fail_ids = set(fail_ids)
+        self._lock = threading.Lock()
+
+    def merge_or_upload_documents(self, documents):
+        with self._lock:
+            self.calls.append(("mergeOrUpload", [d["id"] for d in documents]))
+            results = []
+            for doc in documents:
+                ok = doc["id"] not in self.fail_ids
+                if ok:
+                    self.docs[doc["id"]] = doc
+                results.append(FakeResult(doc["id"], ok))
+            return results
+
+    def delete_documents(self, documents):
+        with self._lock:
+            self.calls.append(("delete", [d["id"] for d in documents]))
+            for doc in documents:
+                self.docs.pop(doc["id"], None)
+            return [FakeResult(d["id"]) for d in documents]
+
+    def get_document_count(self):
+        return len(self.docs)
+
+
+class FakeAlias:
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+
+class FakeIndexClient:
+    def __init__(self, legacy=False):
+        self.indexes = {"estimation-rags"} if legacy else set()
+        self.aliases = {}
+        self.deleted = []
+
+    def create_index(self, index):
+        self.indexes.add(index.name)
+
+    def get_index(self, name):
+        if name not in self.indexes:
+            raise ResourceNotFoundError(name)
+        return name
+
+    def delete_index(self, name):
+        self.indexes.discard(name)
+        self.deleted.append(name)
+
+    def get_alias(self, name):
+        if name not in self.aliases:
+            raise ResourceNotFoundError(name)
+        return FakeAlias(self.aliases[name])
+
+    def create_or_update_alias(self, alias):
+        self.aliases[alias.name] = list(alias.indexes)
+
+
+def _setup(tmp_path, files):
+    rags = tmp_path / "rags"
+    rags.mkdir(exist_ok=True)
+    for name, content in files.items():
+        (rags / name).write_text(content, encoding="utf-8")
+    return str(rags), str(tmp_path / "manifest.json")
+
+
+def _sync(rags, manifest, index_client, clients, **kwargs):
+    def factory(name):
+        return clients.setdefault(name, FakeSearchClient())
+    return index_rags.sync_index("https://example", "key", rags_dir=rags, manifest_path=manifest,
+                                 index_client=index_client, search_client_factory=factory,
+                                 **kwargs)
+
+
+def test_plan_changes_detects_added_changed_and_deleted():
+    """マニフェストとの差分から upsert / delete を計画する"""
+    docs = [{"id": "a", "content": "x"}, {"id": "b", "content": "y2"}, {"id": "c", "content": "z"}]
+    indexed = {
+        "a": index_rags.document_hash({"id": "a", "content": "x"}),
+        "b": index_rags.document_hash({"id": "b", "content": "y"}),
+        "d": "stale",
+    }
+    plan = index_rags.plan_changes(docs, indexed)
+
+    assert [d["id"] for d in plan["upserts"]] == ["b", "c"]
+    assert plan["deletes"] == ["d"]
+    assert plan["unchanged"] == 1
+
+
+def test_apply_changes_batches_and_keeps_failed_entries():
+    """バッチ分割して送信し、失敗したチャンクは次回再送されるようマニフェストに反映しない"""
+    docs = [{"id": f"doc{i}", "content": str(i)} for i in range(5)]
+    plan = index_rags.plan_changes(docs, {"gone": "h"})
+    client = FakeSearchClient(fail_ids={"doc3"})
+
+    result = index_rags.apply_changes(client, plan, {"gone": "h"}, batch_size=2, max_workers=3)
+
+    upload_batches = [ids for action, ids in client.calls if action == "mergeOrUpload"]
+    assert sorted(len(b) for b in upload_batches) == [1, 2, 2]
+    assert ("delete", ["gone"]) in client.calls
+    assert result["failed"] == ["doc3"]
+    assert "doc3" not in result["documents"]
+    assert "gone" not in result["documents"]
+    assert set(result["documents"]) == {"doc0", "doc1", "doc2", "doc4"}
+
+
+def test_first_run_builds_new_index_and_swaps_alias(tmp_path):
+    """初回（マニフェストなし）は新インデックスを構築してエイリアスを作成する"""
+    rags, manifest = _setup(tmp_path, {"a.md": "# 保守\n\n保守の説明", "b.md": "# 開発\n\n開発の説明"})
+    index_client = FakeIndexClient()
+    clients = {}
+
+    outcome = _sync(rags, manifest, index_client, clients)
+
+    target = outcome["index"]
+    assert outcome["applied"] is True
+    assert target.startswith("estimation-rags-")
+    assert index_client.aliases["estimation-rags"] == [target]
+    assert outcome["alias_pending"] is False
+    assert len(clients[target].docs) == 2
+    with open(manifest, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["index"] == target
+    assert saved["schema"] == index_rags.schema_fingerprint()
+    assert len(saved["documents"]) == 2
+
+
+def test_incremental_run_sends_only_changes(tmp_path):
+    """2回目以降は変更されたチャンクのみ送信し、インデックスは作り直さない"""
+    rags, manifest = _setup(tmp_path, {"a.md": "# 保守\n\n保守の説明", "b.md": "# 開発\n\n開発の説明"})
+    index_client = FakeIndexClient()
+    clients = {}
+    target = _sync(rags, manifest, index_client, clients)["index"]
+    clients[target].calls.clear()
+
+    unchanged = _sync(rags, manifest, index_client, clients)
+    assert unchanged["index"] == target
+    assert clients[target].calls == []
+
+    _setup(tmp_path, {"a.md": "# 保守\n\n保守の説明（改訂）"})
+    os.remove(os.path.join(rags, "b.md"))
+    changed = _sync(rags, manifest, index_client, clients)
+
+    assert len(changed["plan"]["upserts"]) == 1
+    assert len(changed["plan"]["deletes"]) == 1
+    assert sorted(action for action, _ in clients[target].calls) == ["delete", "mergeOrUpload"]
+    assert [d["source"] for d in clients[target].docs.values()] == ["a.md"]
+    assert index_client.aliases["estimation-rags"] == [target]
+
+
+def test_dry_run_does_not_touch_azure(tmp_path, capsys):
+    """--dry-run は差分を表示するだけで Azure へ接続せずマニフェストも更新しない"""
+    rags, manifest = _setup(tmp_path, {"a.md": "# 保守\n\n保守の説明"})
+
+    outcome = index_rags.sync_index(None, None, rags_dir=rags, manifest_path=manifest,
+                                    dry_run=True)
+
+    assert outcome["applied"] is False
+    assert len(outcome["plan"]["upserts"]) == 1
+    assert not os.path.exists(manifest)
+    assert "1 upserts, 0 deletes, 0 unchanged" in capsys.readouterr().out
+
+
+def test_schema_change_rebuilds_and_drops_old_index(tmp_path, monkeypatch):
+    """スキーマが変わった場合は新インデックスへ全件投入してからエイリアスを切り替える"""
+    rags, manifest = _setup(tmp_path, {"a.md": "# 保守\n\n保守の説明"})
+    index_client = FakeIndexClient()
+    clients = {}
+    first = _sync(rags, manifest, index_client, clients)["index"]
+
+    with open(manifest, encoding="utf-8") as f:
+        saved = json.load(f)
+    saved["schema"] = "old-schema"
+    saved["index"] = first
+    with open(manifest, "w", encoding="utf-8") as f:
+        json.dump(saved, f)
+    # 同一秒内でも別名になるようにタイムスタンプを固定する
+    monkeypatch.setattr(index_rags.time, "strftime", lambda fmt: "20990101000000")
+
+    second = _sync(rags, manifest, index_client, clients)["index"]
+    assert second != first
+    assert index_client.aliases["estimation-rags"] == [second]
+    assert first in index_client.deleted
+    assert len(clients[second].docs) == 1
+
+
+def test_failed_rebuild_keeps_alias_on_old_index(tmp_path):
+    """新インデックスへの投入が失敗した場合はエイリアスを切り替えない"""
+    rags, manifest = _setup(tmp_path, {"a.md": "# 保守\n\n保守の説明"})
+    index_client = FakeIndexClient()
+    index_client.aliases["estimation-rags"] = ["estimation-rags-old"]
+
+    def factory(name):
+        client = FakeSearchClient()
+        client.merge_or_upload_documents = lambda documents: (_ for _ in ()).throw(
+            RuntimeError("503"))
+        return client
+
+    outcome = index_rags.sync_index("https://example", "key", rags_dir=rags,
+                                    manifest_path=manifest, index_client=index_client,
+                                    search_client_factory=factory)
+
+    assert outcome["applied"] is False
+    assert index_client.aliases["estimation-rags"] == ["estimation-rags-old"]
+    assert outcome["index"] in index_client.deleted
+    assert not os.path.exists(manifest)
+
+
+def test_legacy_index_is_kept_until_explicit_migration(tmp_path, capsys):
+    """エイリアスと同名の旧インデックスは通常の実行では削除せず、--migrate-legacy で移行する"""
+    rags, manifest = _setup(tmp_path, {"a.md": "# 保守\n\n保守の説明", "b.md": "# 開発\n\n開発の説明"})
+    index_client = FakeIndexClient(legacy=True)
+    clients = {}
+
+    pending = _sync(rags, manifest, index_client, clients)
+
+    target = pending["index"]
+    assert pending["alias_pending"] is True
+    assert "estimation-rags" in index_client.indexes
+    assert index_client.deleted == []
+    assert index_client.aliases == {}
+    assert len(clients[target].docs) == 2
+    assert "--migrate-legacy" in capsys.readouterr().out
+
+    clients[target].calls.clear()
+    migrated = _sync(rags, manifest, index_client, clients, migrate_legacy=True)
+
+    assert migrated["index"] == target
+    assert migrated["alias_pending"] is False
+    assert clients[target].calls == []
+    assert index_client.deleted == ["estimation-rags"]
+    assert index_client.aliases["estimation-rags"] == [target]
+
+
+def test_migration_keeps_legacy_index_when_new_index_is_incomplete(tmp_path, monkeypatch):
+    """新インデックスの件数が揃っていなければ旧インデックスを削除しない"""
+    rags, manifest = _setup(tmp_path, {"a.md": "# 保守\n\n保守の説明"})
+    index_client = FakeIndexClient(legacy=True)
+    clients = {}
+    monkeypatch.setattr(FakeSearchClient, "get_document_count", lambda self: 0)
+    assert index_rags.wait_for_documents(FakeSearchClient(), 1, timeout=0) is False
+
+    monkeypatch.setattr(index_rags, "wait_for_documents", lambda client, expected: False)
+    outcome = _sync(rags, manifest, index_client, clients, migrate_legacy=True)
+
+    assert outcome["alias_pending"] is True
+    assert "estimation-rags" in index_client.indexes
+    assert index_client.deleted == []
+    assert index_client.aliases == {}
+
+
+def test_whole_file_documents_of_the_old_uploader_are_deleted(tmp_path):
+    """旧 upload_rags.py がファイル単位で登録した文書（キー md5(ファイル名)）を削除する"""
+    rags, _ = _setup(tmp_path, {"a.md": "# 保守\n\n保守の説明", "b.md": "# 開発\n\n開発の説明"})
+    client = FakeSearchClient()
+    ids = index_rags.whole_file_ids(rags)
+    for doc_id in ids + ["chunk"]:
+        client.docs[doc_id] = {"id": doc_id}
+
+    assert index_rags.delete_whole_file_documents(client, rags) == 2
+    assert ids == [hashlib.md5(name.encode()).hexdigest() for name in ("a.md", "b.md")]
+    assert list(client.docs) == ["chunk"]
@@ -0,0 +1,194 @@
+import pytest
+import sys
+import os
+import threading
+import time
+from email.utils import formatdate
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../bench')))
+
+import app as agent_app
+import llm_gateway
+import openai_client
+from llm_gateway import GatewaySaturated, LLMGateway, TokenBucket, retry_after_seconds
+from stubs import StubOpenAIServer
+
+
+@pytest.fixture
+def llm_stub(monkeypatch):
+    """429 を返せる Azure OpenAI スタブに実クライアントを向ける"""
+    server = StubOpenAIServer(retry_after_ms=50).start()
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", server.base_url)
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test")
+    openai_client.reset_openai_client()
+    llm_gateway.reset_gateway()
+    yield server
+    server.shutdown()
+    server.server_close()
+    openai_client.reset_openai_client()
+    llm_gateway.reset_gateway()
+
+
+def _create(**options):
+    client = openai_client.get_openai_client()
+    return lambda: client.chat.completions.create(
+        model="gpt-4o", messages=[{"role": "user", "content": "hi"}], max_tokens=10, **options)
+
+
+def test_retry_after_headers():
+    """retry-after-ms を優先し、秒数・HTTP日付にも対応する"""
+    assert retry_after_seconds({"retry-after-ms": "1500", "retry-after": "9"}) == 1.5
+    assert retry_after_seconds({"retry-after": "3"}) == 3.0
+    assert 8 <= retry_after_seconds({"retry-after": formatdate(time.time() + 10, usegmt=True)}) <= 10
+    assert retry_after_seconds({"retry-after": "soon"}) is None
+    assert retry_after_seconds({}) is None
+
+
+def test_token_bucket_refills_at_quota_rate():
+    """容量を使い切ると、補充レートに応じた待ち時間になる"""
+    bucket = TokenBucket(rate=2.0, capacity=4.0, now=0.0)
+    bucket.take(4, now=0.0)
+
+    assert bucket.wait_time(1, now=0.0) == 0.5
+    assert bucket.wait_time(1, now=0.5) == 0.0
+    # 容量を超える要求は満杯になるまで待つ（永久に待たない）
+    assert bucket.wait_time(100, now=0.5) == 1.5
+
+
+def test_queue_is_bounded_and_waiters_are_admitted_in_turn():
+    """同時実行上限を超えた呼び出しは待ち、待ち行列が満杯なら即座に拒否する"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=1)
+    gateway.acquire(1, time.monotonic() + 5)
+    admitted = threading.Event()
+
+    def waiter():
+        gateway.acquire(1, time.monotonic() + 5)
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while gateway.waiting == 0:
+        time.sleep(0.01)
+
+    with pytest.raises(GatewaySaturated) as excinfo:
+        gateway.acquire(1, time.monotonic() + 5)
+    assert excinfo.value.reason == "queue_full"
+    assert not admitted.is_set()
+
+    gateway.release()
+    thread.join(timeout=5)
+    assert admitted.is_set()
+    assert gateway.stats()["in_flight"] == 1
+
+
+def test_waiting_past_the_deadline_is_rejected():
+    """期限までに枠が空かなければ timeout として拒否し、再試行の目安を返す"""
+    gateway = LLMGateway(max_concurrency=1)
+    gateway.acquire(1, time.monotonic() + 5)
+
+    started = time.monotonic()
+    with pytest.raises(GatewaySaturated) as excinfo:
+        gateway.acquire(1, time.monotonic() + 0.1)
+
+    assert excinfo.value.reason == "timeout"
+    assert excinfo.value.retry_after >= 1.0
+    assert time.monotonic() - started < 1.0
+    assert gateway.stats()["rejected"]["timeout"] == 1
+
+
+def test_rpm_quota_limits_the_burst():
+    """RPM 60 では10秒分（10件）までしか連続で受け付けない"""
+    gateway = LLMGateway(rpm_limit=60, queue_timeout=0.2)
+    for _ in range(10):
+        gateway.complete(lambda: "ok", tokens=1)
+
+    # 次の1件は1秒後まで補充されない
+    with pytest.raises(GatewaySaturated) as excinfo:
+        gateway.complete(lambda: "ok", tokens=1)
+    assert excinfo.value.reason == "timeout"
+    assert excinfo.value.retry_after >= 0.8
+
+
+def test_429_is_retried_after_retry_after(llm_stub):
+    """429 は Retry-After だけ全呼び出しを止めてから再試行する"""
+    llm_stub.statuses = [429, 429]
+    gateway = LLMGateway(max_retries=2, queue_timeout=5)
+
+    started = time.monotonic()
+    response = gateway.complete(_create(), tokens=20)
+
+    assert response.choices[0].message.content
+    assert llm_stub.requests == 3
+    assert time.monotonic() - started >= 0.1
+    stats = gateway.stats()
+    assert stats["retries"] == 2
+    assert stats["rate_limited"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_persistent_429_becomes_saturation(llm_stub):
+    """リトライ上限を超えた 429 は rate_limited として拒否する"""
+    llm_stub.statuses = [429, 429, 429]
+    gateway = LLMGateway(max_retries=1, queue_timeout=5)
+
+    with pytest.raises(GatewaySaturated) as excinfo:
+        gateway.complete(_create(), tokens=20)
+
+    assert excinfo.value.reason == "rate_limited"
+    assert llm_stub.requests == 2
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_stream_holds_slot_until_consumed(llm_stub):
+    """ストリームは読み終わる（または close される）まで枠を保持する"""
+    gateway = LLMGateway(max_concurrency=1)
+
+    stream = gateway.open_stream(_create(stream=True), tokens=20)
+    assert gateway.stats()["in_flight"] == 1
+    assert "".join(c.choices[0].delta.content or "" for c in stream if c.choices)
+    assert gateway.stats()["in_flight"] == 0
+
+    stream = gateway.open_stream(_create(stream=True), tokens=20)
+    stream.close()
+    stream.close()
+    assert gateway.stats()["in_flight"] == 0
+
+
+@pytest.mark.parametrize("path", ["/score", "/score/stream"])
+def test_score_returns_structured_503(llm_stub, monkeypatch, path):
+    """飽和時は 500 ではなく Retry-After 付きの 503 を返し、同じターンを再送できる"""
+    monkeypatch.setenv("LLM_MAX_RETRIES", "0")
+    monkeypatch.setattr(agent_app, "lookup_knowledge", lambda user_input: "")
+    llm_stub.statuses = [429]
+    llm_stub.retry_after_ms = 2500
+    client = agent_app.app.test_client()
+
+    resp = client.post(path, json={"user_input": {"message": "ECサイトを作りたい"}})
+
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "3"
+    body = resp.get_json()
+    assert body["error"] == "llm_unavailable"
+    assert body["reason"] == "rate_limited"
+    assert body["retry_after"] == 2.5
+    session = agent_app.sessions.get(body["session_id"])
+    assert session.history == []
+
+    llm_gateway.reset_gateway()
+    resp = client.post("/score", json={"session_id": body["session_id"],
+                                       "user_input": {"message": "ECサイトを作りたい"}})
+    assert resp.status_code == 200
+    assert [m["role"] for m in session.history] == ["user", "assistant"]
+
+
+def test_gateway_metrics_are_exported():
+    """待ち行列の深さ・実行中の数・待ち時間を /metrics に出力する"""
+    body = agent_app.app.test_client().get("/metrics").get_data(as_text=True)
+
+    assert "estimation_llm_queue_depth " in body
+    assert "estimation_llm_in_flight " in body
+    assert "# TYPE estimation_llm_queue_wait_seconds histogram" in body
+    stats = agent_app.app.test_client().get("/admin/stats").get_json()
+    assert {"in_flight", "queue_depth", "rejected"} <= set(stats["llm_gateway"])
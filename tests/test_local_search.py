@@ -0,0 +1,68 @@
+import pytest
+import sys
+import os
+import json
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import lookup_knowledge as lk
+from local_search import load_or_build_index, tokenize
+
+
+def test_tokenize_bigrams_and_nfkc():
+    """CJKは文字バイグラム、全角英数字はNFKCで半角小文字に正規化"""
+    assert tokenize("決済機能") == ["決済", "済機", "機能"]
+    assert tokenize("ＡＰＩ連携") == ["api", "連携"]
+    assert tokenize("ｶﾅ") == ["カナ"]
+
+
+def _write_rags(tmp_path, files):
+    rags = tmp_path / "rags"
+    rags.mkdir()
+    for name, content in files.items():
+        (rags / name).write_text(content, encoding="utf-8")
+    return str(rags)
+
+
+def test_bm25_ranks_matching_document_first(tmp_path):
+    rags = _write_rags(tmp_path, {
+        "a.md": "保守運用プランの説明。月額の保守費用について。",
+        "b.md": "決済機能の実装と外部API連携の注意点。",
+        "c.md": "デザインシステムとFigmaのコンポーネント。",
+    })
+    index = load_or_build_index(rags)
+
+    results = index.search("決済の機能", top_k=2)
+    assert results[0]["source"] == "b.md"
+    assert results[0]["score"] > 0
+    assert index.search("存在しない語彙", top_k=3) == []
+
+
+def test_persisted_index_is_reused_and_rebuilt_on_change(tmp_path):
+    """永続化インデックスはコーパスが同じなら再利用し、変更されたら再構築する"""
+    rags = _write_rags(tmp_path, {"a.md": "画面設計", "b.md": "保守運用"})
+    index_path = str(tmp_path / "index.json")
+
+    built = load_or_build_index(rags, index_path)
+    assert os.path.exists(index_path)
+    loaded = load_or_build_index(rags, index_path)
+    assert loaded.fingerprint == built.fingerprint
+    assert loaded.search("保守")[0]["source"] == "b.md"
+
+    with open(os.path.join(rags, "c.md"), "w", encoding="utf-8") as f:
+        f.write("保守保守保守")
+    rebuilt = load_or_build_index(rags, index_path)
+    assert rebuilt.fingerprint != built.fingerprint
+    assert rebuilt.search("保守")[0]["source"] == "c.md"
+    with open(index_path, encoding="utf-8") as f:
+        assert json.load(f)["fingerprint"] == rebuilt.fingerprint
+
+
+def test_lookup_knowledge_local_backend(monkeypatch):
+    """RAG_BACKEND=local では Azure に接続せずローカル検索する"""
+    monkeypatch.setenv("RAG_BACKEND", "local")
+    monkeypatch.setattr(lk, "SearchClient", lambda *a, **k: pytest.fail("Azure must not be called"))
+
+    result = lk.lookup_knowledge({"message": "保守運用のプラン"}, top_k=1)
+    assert result.startswith("--- Source: 04_maintenance_plans.md")
@@ -0,0 +1,105 @@
+import sys
+import os
+from types import SimpleNamespace
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import app as agent_app
+import metrics
+
+
+def test_histogram_and_counter_exposition():
+    """Prometheus テキスト形式でヒストグラムとカウンタを出力する"""
+    registry = metrics.Registry()
+    hist = registry.register(metrics.Histogram("t_seconds", "test", buckets=(0.1, 1.0)))
+    counter = registry.register(metrics.Counter("t_total", "test"))
+    hist.observe(0.05, stage="a")
+    hist.observe(0.5, stage="a")
+    counter.inc(3, kind='q"x')
+    registry.register_collector("t_gauge", "gauge", "test", lambda: [({}, 7)])
+    registry.register_collector("t_broken", "gauge", "test", lambda: 1 / 0)
+
+    text = registry.render()
+    assert "# TYPE t_seconds histogram" in text
+    assert 't_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 't_seconds_bucket{stage="a",le="+Inf"} 2' in text
+    assert 't_seconds_count{stage="a"} 2' in text
+    assert 't_seconds_sum{stage="a"} 0.55' in text
+    assert 't_total{kind="q\\"x"} 3' in text
+    assert "t_gauge 7" in text
+    assert "t_broken" not in text
+
+
+def test_metrics_endpoint_reports_pipeline_stages(monkeypatch):
+    """/score の各ステージ・トークン数・キャッシュ・セッション数を /metrics で公開する"""
+    usage = SimpleNamespace(prompt_tokens=120, completion_tokens=30)
+    message = SimpleNamespace(content="複雑度は？\n[簡易] [標準]")
+    create = lambda **kwargs: SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(agent_app, "get_openai_client", lambda: client)
+    monkeypatch.setattr(agent_app, "lookup_knowledge", lambda user_input: "")
+    monkeypatch.setattr(agent_app, "render_messages", lambda *args: [{"role": "user", "content": "p"}])
+
+    before = {name: metrics.STAGE_SECONDS.count(stage=name)
+              for name in ("parse", "knowledge", "render", "llm", "extract")}
+    prompt_before = metrics.LLM_TOKENS.value(kind="prompt")
+    http = agent_app.app.test_client()
+    data = http.post("/score", json={"user_input": {"message": "ECサイト"}}).get_json()
+    assert data["usage"] == {"prompt_tokens": 120, "completion_tokens": 30}
+
+    for name, count in before.items():
+        assert metrics.STAGE_SECONDS.count(stage=name) == count + 1, name
+    assert metrics.LLM_TOKENS.value(kind="prompt") == prompt_before + 120
+
+    resp = http.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.content_type.startswith("text/plain; version=0.0.4")
+    text = resp.get_data(as_text=True)
+    assert 'estimation_stage_duration_seconds_bucket{stage="llm",le="+Inf"}' in text
+    assert 'estimation_llm_tokens_total{kind="completion"}' in text
+    assert 'estimation_turns_total{path="llm"}' in text
+    assert 'estimation_cache_hits_total{cache="calc"}' in text
+    assert 'estimation_cache_misses_total{cache="retrieval"}' in text
+    assert "estimation_sessions_active " in text
+    assert "estimation_sessions_expired_total " in text
+
+
+def test_stages_are_exported_as_spans(monkeypatch):
+    """トレーサーが有効な場合はステージをスパンとしても出力する"""
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(metrics, "_tracer", provider.get_tracer("test"))
+    monkeypatch.setattr(metrics, "_tracer_ready", True)
+
+    with metrics.stage("render"):
+        pass
+    metrics.observe_stage("calc", 0.25)
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert set(spans) == {"score.render", "score.calc"}
+    calc = spans["score.calc"]
+    assert abs((calc.end_time - calc.start_time) / 1e9 - 0.25) < 0.01
+
+
+def test_missing_otel_exporter_disables_spans(monkeypatch, caplog):
+    """OTLP エンドポイント設定時にエクスポーターが未インストールでも、警告1回でスパンを無効化する"""
+    monkeypatch.setenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://collector:4318")
+    monkeypatch.setitem(sys.modules, "opentelemetry.exporter.otlp.proto.http.trace_exporter", None)
+    monkeypatch.setattr(metrics, "_tracer", None)
+    monkeypatch.setattr(metrics, "_tracer_ready", False)
+
+    with caplog.at_level("WARNING"):
+        with metrics.stage("render"):
+            pass
+        metrics.observe_stage("calc", 0.1)
+
+    assert metrics.get_tracer() is None
+    assert metrics._tracer_ready is True
+    assert caplog.text.count("spans are disabled") == 1
@@ -0,0 +1,75 @@
+import pytest
+import sys
+import os
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import openai_client
+
+
+class ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "ok"}}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_openai(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("AZURE_OPENAI_HTTP2", "false")
+    openai_client.reset_openai_client()
+    yield server
+    openai_client.reset_openai_client()
+    server.shutdown()
+
+
+def test_client_is_shared_and_connection_reused(stub_openai):
+    """クライアントはプロセス内で共有され、接続はキープアライブで再利用される"""
+    client = openai_client.get_openai_client()
+    assert openai_client.get_openai_client() is client
+
+    for _ in range(3):
+        response = client.chat.completions.create(
+            model="gpt-4o", messages=[{"role": "user", "content": "hi"}])
+        assert response.choices[0].message.content == "ok"
+
+    stats = openai_client.get_pool_stats()
+    assert stats["initialized"] is True
+    assert stats["requests"] == 3
+    assert stats["tcp_connects"] == 1
+    assert stats["idle_connections"] == 1
+    assert stats["active_connections"] == 0
+
+
+def test_pool_settings_from_env(monkeypatch):
+    """接続プール設定は環境変数から読み込まれる"""
+    monkeypatch.setenv("AZURE_OPENAI_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("AZURE_OPENAI_MAX_RETRIES", "0")
+    monkeypatch.setenv("AZURE_OPENAI_HTTP2", "off")
+
+    settings = openai_client.load_settings()
+    assert settings["max_connections"] == 7
+    assert settings["max_retries"] == 0
+    assert settings["http2"] is False
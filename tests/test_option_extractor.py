@@ -0,0 +1,84 @@
+import pytest
+import sys
+import os
+import json
+import random
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+from option_extractor import OptionExtractor, clean_label, extract_options
+from history_manager import PROPOSAL_HEADER
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "golden", "option_extraction.jsonl")
+
+
+def _golden():
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+GOLDEN = _golden()
+
+
+def _labels(options):
+    return [o["label"] for o in options]
+
+
+@pytest.mark.parametrize("case", GOLDEN, ids=[c["name"] for c in GOLDEN])
+def test_matches_golden_corpus(case):
+    """記録済み応答から抽出した選択肢がゴールデン出力と一致する"""
+    assert _labels(extract_options(case["response"])) == case["options"]
+
+
+@pytest.mark.parametrize("case", GOLDEN, ids=[c["name"] for c in GOLDEN])
+def test_chunked_feed_gives_same_result(case):
+    """任意の位置で分割して投入しても、一括抽出と同じ結果になる"""
+    rnd = random.Random(case["name"])
+    text = case["response"]
+    extractor = OptionExtractor()
+    reported = []
+    i = 0
+    while i < len(text):
+        size = rnd.randint(1, 12)
+        reported += extractor.feed(text[i:i + size])
+        i += size
+    reported += extractor.close()
+
+    assert _labels(extractor.options()) == case["options"]
+    assert sorted(_labels(reported)) == sorted(case["options"])
+
+
+def test_options_reported_when_line_completes():
+    """選択肢は行が確定した時点で一度だけ通知される"""
+    extractor = OptionExtractor()
+    assert extractor.feed("[Web") == []
+    assert extractor.feed("サービス] [モバ") == []
+    assert _labels(extractor.feed("イル]\n- Web")) == ["Webサービス", "モバイル"]
+    assert _labels(extractor.close()) == ["Web"]
+    assert extractor.feed("\n[Webサービス]\n") == []
+
+
+def test_stop_marker_ends_extraction():
+    """提案書ヘッダーを含む行以降は抽出しない（未確定の行でも検知する）"""
+    extractor = OptionExtractor(stop_marker=PROPOSAL_HEADER)
+    assert _labels(extractor.feed("[はい]\n" + PROPOSAL_HEADER[:5])) == ["はい"]
+    assert not extractor.stopped
+    extractor.feed(PROPOSAL_HEADER[5:])
+    assert extractor.stopped
+    assert extractor.feed("\n- 対象: ECサイト\n") == []
+    assert _labels(extractor.options()) == ["はい"]
+
+
+def test_links_brackets_and_list_markers():
+    """リンク・空括弧・区切り線は選択肢にならず、リスト項目は括弧の手前まで"""
+    text = "[a](http://x) [b] [] [c\n  1. 項目 [x]\n10画面\n---\n- ...\n-\n次の行"
+    assert [o["label"] for o in extract_options(text)] == ["b", "x", "項目"]
+
+
+def test_clean_label():
+    """[]* を除去し「: 」以降を落とし、見出し・URL・40文字以上は除外する"""
+    assert clean_label(" **決済機能**: クレジットカード ") == "決済機能"
+    assert clean_label("# 見出し") is None
+    assert clean_label("https://example.com") is None
+    assert clean_label("あ" * 40) is None
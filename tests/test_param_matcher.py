@@ -0,0 +1,106 @@
+import sys
+import os
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import param_matcher
+from param_matcher import AhoCorasick, ParamMatcher
+
+
+def _found(text):
+    return [(m.param, m.value) for m in param_matcher.scan(text).mentions]
+
+
+def test_aho_corasick_reports_every_occurrence():
+    """オートマトンは重なり合うパターンもすべて1回の走査で報告する"""
+    automaton = AhoCorasick(["he", "she", "his", "hers"])
+    hits = sorted(automaton.iter("ushers"))
+    assert hits == [(4, 0), (4, 1), (6, 3)]
+
+
+def test_free_text_mentions_and_residual():
+    """自由記述から複数の機能を拾い、助詞などのつなぎ語は残差に残らない"""
+    result = param_matcher.scan("決済とチャットと管理画面が必要です")
+    assert [(m.param, m.value) for m in result.mentions] == [
+        ("features", "payment"), ("features", "realtime"), ("features", "admin_panel")]
+    assert result.residual == ""
+
+    result = param_matcher.scan("ECサイトを作りたい")
+    assert result.mentions == []
+    assert result.residual != ""
+    assert not param_matcher.is_parameter_request(result)
+
+
+def test_leftmost_longest_and_nfkc():
+    """長いラベルが優先され、全角英数字・半角カナも同じラベルとして扱う"""
+    assert _found("一覧表示・検索") == [("features", "list_search")]
+    assert _found("ＣＲＵＤ操作") == [("features", "crud")]
+    assert _found("ﾌﾟｯｼｭ通知") == [("features", "push_notification")]
+    # 英字ラベルは単語の途中では一致しない
+    assert _found("rapid") == []
+
+
+def test_numbers_with_units():
+    """単位付きの数値は桁区切りや空白を含めて読み取る"""
+    assert _found("1,000 LOC") == [("loc", 1000)]
+    assert _found("２０画面くらい") == [("screen_count", 20)]
+    assert _found("300FP") == [("fp_count", 300)]
+    # 生産性の単位（人日/step）は LOC として読まない
+    assert _found("0.05人日/step") == [("man_days_per_unit", 0.05)]
+    # 数値のない単位は無視する
+    assert _found("画面") == []
+
+
+def test_confidence_levels():
+    """選択肢そのものは 1.0、文中のあいまいな語は低い信頼度になる"""
+    assert param_matcher.scan("標準").mentions[0].confidence == 1.0
+    mentions = param_matcher.scan("一般的で詳細も").mentions
+    assert [m.confidence for m in mentions] == [0.6, 0.7]
+    # 既定のしきい値 (0.7) を下回る語を含む自由記述は LLM に任せる
+    assert not param_matcher.is_parameter_request(param_matcher.scan("一般的で詳細も"))
+
+
+def test_min_confidence_env(monkeypatch):
+    """PARAM_MATCH_MIN_CONFIDENCE で自由記述の採用しきい値を変えられる"""
+    result = param_matcher.scan("一般的で詳細も")
+    monkeypatch.setenv("PARAM_MATCH_MIN_CONFIDENCE", "0.5")
+    assert param_matcher.is_parameter_request(result)
+
+
+def test_option_mentions():
+    """選択肢ラベルは完全一致を優先し、数値があれば数値を、矛盾する値は採用しない"""
+    assert [(m.param, m.value) for m in param_matcher.option_mentions("標準")] == [
+        ("complexity", "medium")]
+    assert [(m.param, m.value) for m in param_matcher.option_mentions("標準 (0.05人日/step)")] == [
+        ("man_days_per_unit", 0.05)]
+    assert param_matcher.option_mentions("10画面 20画面") == []
+    assert param_matcher.option_mentions("未知のラベル") == []
+
+
+def test_low_confidence_option_records_nothing(monkeypatch):
+    """選択肢でも PARAM_MATCH_MIN_CONFIDENCE 未満の曖昧な一致は記録しない"""
+    assert param_matcher.option_mentions("Stepで見積もりたい") == []
+    assert param_matcher.option_mentions("移行・リプレース") == []
+    # 数値とラベルの組み合わせは従来どおり
+    assert [(m.param, m.value) for m in param_matcher.option_mentions("画面数法 (Screen Count)")] == [
+        ("method", "screen")]
+    monkeypatch.setenv("PARAM_MATCH_MIN_CONFIDENCE", "0.5")
+    assert [(m.param, m.value) for m in param_matcher.option_mentions("Stepで見積もりたい")] == [
+        ("method", "step")]
+
+
+def test_label_values_keep_option_labels():
+    """PARAM_MAPPING 用の表には従来の選択肢ラベルがすべて含まれる"""
+    mapping = param_matcher.label_values()
+    assert mapping["画面数法"] == "screen"
+    assert mapping["決済機能"] == "payment"
+    assert mapping["仕様確定済み"] == "high"
+
+
+def test_custom_tables():
+    """表を差し替えた ParamMatcher も構築できる"""
+    matcher = ParamMatcher({"features": {"SSO": "auth"}}, units={}, fillers=("と",))
+    result = matcher.scan("SSOと")
+    assert [(m.param, m.value) for m in result.mentions] == [("features", "auth")]
+    assert result.residual == ""
@@ -0,0 +1,104 @@
+import pytest
+import sys
+import os
+import json
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import app as agent_app
+import prompt_template as pt
+
+
+def test_split_roles_and_static_system():
+    """ロールマーカーで分割し、system は変数を含まない静的テキストとして一度だけ描画する"""
+    template = pt.PromptTemplate("system:\n指示です。\n\nuser:\n質問: {{ q }}\n")
+    assert template.system == "指示です。"
+    assert template.render_messages(q="A") == [
+        {"role": "system", "content": "指示です。"},
+        {"role": "user", "content": "質問: A"},
+    ]
+    assert template.prefix_hash == pt.prefix_hash("指示です。")
+
+
+def test_dynamic_system_prompt_is_rejected():
+    """system に変数が含まれるとプレフィックスが不安定になるためエラーにする"""
+    with pytest.raises(ValueError):
+        pt.PromptTemplate("system:\n{{ knowledge }}\nuser:\nx")
+
+
+def test_load_template_is_cached_until_file_changes(tmp_path):
+    """コンパイル済みテンプレートはファイルが変わるまで再利用する"""
+    path = tmp_path / "t.jinja2"
+    path.write_text("system:\nv1\nuser:\n{{ x }}", encoding="utf-8")
+    first = pt.load_template(str(path))
+    assert pt.load_template(str(path)) is first
+
+    path.write_text("system:\nv2\nuser:\n{{ x }}", encoding="utf-8")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    second = pt.load_template(str(path))
+    assert second is not first
+    assert second.system == "v2"
+
+
+def _session(params=None):
+    session = agent_app.ConversationSession("prefix-test")
+    if params:
+        session.collected_params.update(params)
+    return session
+
+
+def test_real_template_prefix_is_stable_across_turns(monkeypatch):
+    """実テンプレートの system メッセージはターンごとに変化しない"""
+    monkeypatch.setattr(agent_app, "prefix_monitor", pt.PrefixMonitor())
+    first = agent_app.render_messages(_session(), {"message": "アプリを作りたい"}, "", None)
+
+    session = _session({"method": "screen", "screen_count": 20})
+    session.add_message("user", "決済機能")
+    calc = {"status": "ok", "estimated_amount": 100, "breakdown": {"final": 100}}
+    second = agent_app.render_messages(session, {"selected_option": "見積もり作成"},
+                                       "--- Source: a.md ---\n知識", calc)
+
+    assert [m["role"] for m in first] == ["system", "user"]
+    assert first[0]["content"] == second[0]["content"]
+    assert "{{" not in first[0]["content"]
+    assert agent_app.prefix_monitor.stats()["prefix_changes"] == 0
+    assert agent_app.prefix_monitor.stats()["renders"] == 2
+
+    user = second[1]["content"]
+    order = ["## 関連知識 (RAG)", "## 収集済みパラメータ", "## 計算API結果", "## 会話履歴", "## ユーザー入力"]
+    positions = [user.index(header) for header in order]
+    assert positions == sorted(positions)
+    assert '"estimated_amount": 100' in user
+    assert "見積もり作成" in user
+
+
+def test_prefix_change_is_logged_as_warning(monkeypatch, caplog):
+    """system プレフィックスが変わった場合は logging の警告として記録する"""
+    monitor = pt.PrefixMonitor()
+    monitor.hash = "previous-deploy"
+    monkeypatch.setattr(agent_app, "prefix_monitor", monitor)
+
+    with caplog.at_level("WARNING"):
+        agent_app.render_messages(_session(), {"message": "アプリを作りたい"}, "", None)
+
+    assert "prefix changed" in caplog.text
+    assert monitor.stats()["prefix_changes"] == 1
+
+
+def test_real_template_accepts_flow_object_inputs():
+    """Prompt Flow からはオブジェクトのまま渡されるため JSON 化して描画する"""
+    template = pt.load_template(agent_app.template_path)
+    messages = template.render_messages(user_input={"message": "x"}, knowledge="k",
+                                        conversation_history=[], calc_result='{"status": "ok"}')
+    user = messages[1]["content"]
+    assert json.dumps({"message": "x"}) in user
+    assert '{"status": "ok"}' in user
+
+
+def test_prefix_monitor_counts_changes():
+    monitor = pt.PrefixMonitor()
+    assert monitor.observe([{"role": "system", "content": "a"}])
+    assert monitor.observe([{"role": "system", "content": "a"}])
+    assert not monitor.observe([{"role": "system", "content": "b"}])
+    assert monitor.stats()["prefix_changes"] == 1
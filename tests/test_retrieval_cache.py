@@ -0,0 +1,150 @@
+import pytest
+import sys
+import os
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import lookup_knowledge as lk
+
+
+class FakeSearchClient:
+    """Azure AI Search の代替（検索回数を記録する）"""
+    calls = []
+
+    def __init__(self, endpoint, index_name, credential):
+        self.index_name = index_name
+
+    def search(self, search_text, top, include_total_count=False):
+        FakeSearchClient.calls.append((self.index_name, search_text, top))
+        return [{"source": "04_maintenance_plans.md", "heading_path": "保守",
+                 "content": f"結果: {search_text}", "@search.score": 1.0}]
+
+
+class FakeIndexClient:
+    """エイリアスの参照先を返す SearchIndexClient の代替"""
+    aliases = {}
+
+    def __init__(self, endpoint, credential):
+        pass
+
+    def get_alias(self, name):
+        if name not in FakeIndexClient.aliases:
+            raise RuntimeError("404")
+        return type("Alias", (), {"indexes": [FakeIndexClient.aliases[name]]})()
+
+
+@pytest.fixture(autouse=True)
+def azure_backend(monkeypatch):
+    monkeypatch.setenv("RAG_BACKEND", "azure")
+    monkeypatch.setenv("AZURE_AI_SEARCH_ENDPOINT", "https://example.search.windows.net")
+    monkeypatch.setenv("AZURE_AI_SEARCH_API_KEY", "key")
+    monkeypatch.delenv("RAG_INDEX_VERSION", raising=False)
+    monkeypatch.setattr(lk, "SearchClient", FakeSearchClient)
+    monkeypatch.setattr(lk, "SearchIndexClient", FakeIndexClient)
+    monkeypatch.setattr(lk, "_retrieval_cache_ready", False)
+    monkeypatch.setattr(lk, "_alias_targets", {})
+    FakeSearchClient.calls = []
+    FakeIndexClient.aliases = {"estimation-rags": "estimation-rags-20250101000000"}
+    yield
+
+
+def test_normalize_query_folds_width_case_and_whitespace():
+    """全角・半角、大文字小文字、空白の違いは同じキーに正規化される"""
+    assert lk.normalize_query("　ＡＰＩ連携 　 ｶﾅ\n") == "api連携 カナ"
+    assert lk.normalize_query("決済機能") == lk.normalize_query(" 決済機能　")
+
+
+def test_near_identical_queries_hit_cache():
+    """表記揺れのある同一クエリは Azure へ再問い合わせしない"""
+    first = lk.lookup_knowledge({"message": "決済機能"})
+    second = lk.lookup_knowledge({"message": "　決済機能 "})
+    lk.lookup_knowledge({"message": "ＡＰＩ連携"})
+    lk.lookup_knowledge({"message": "api連携"})
+
+    assert first == second
+    assert len(FakeSearchClient.calls) == 2
+    stats = lk.get_retrieval_stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+
+
+def test_cache_key_includes_top_k_index_and_version(monkeypatch):
+    """top_k・インデックス名・インデックスバージョンが異なれば別エントリになる"""
+    lk.lookup_knowledge({"message": "検索"}, top_k=5)
+    lk.lookup_knowledge({"message": "検索"}, top_k=3)
+    monkeypatch.setenv("AZURE_AI_SEARCH_INDEX_ALIAS", "estimation-rags-staging")
+    lk.lookup_knowledge({"message": "検索"}, top_k=3)
+    monkeypatch.setenv("RAG_INDEX_VERSION", "2")
+    lk.lookup_knowledge({"message": "検索"}, top_k=3)
+
+    assert len(FakeSearchClient.calls) == 4
+    assert FakeSearchClient.calls[2][0] == "estimation-rags-staging"
+
+
+def test_alias_swap_switches_cache_key(monkeypatch):
+    """エイリアスの参照先が切り替わると（他レプリカの再構築後も）新しいキーで検索する"""
+    monkeypatch.setenv("RAG_ALIAS_REFRESH_SECONDS", "0")
+    lk.lookup_knowledge({"message": "検索"})
+    lk.lookup_knowledge({"message": "検索"})
+    FakeIndexClient.aliases["estimation-rags"] = "estimation-rags-20250201000000"
+    lk.lookup_knowledge({"message": "検索"})
+
+    assert len(FakeSearchClient.calls) == 2
+
+
+def test_alias_target_is_refreshed_periodically(monkeypatch):
+    """参照先は RAG_ALIAS_REFRESH_SECONDS の間は再取得しない"""
+    monkeypatch.setenv("RAG_ALIAS_REFRESH_SECONDS", "3600")
+    assert lk._alias_target("https://example", "key", "estimation-rags") == \
+        "estimation-rags-20250101000000"
+    FakeIndexClient.aliases["estimation-rags"] = "estimation-rags-20250201000000"
+    assert lk._alias_target("https://example", "key", "estimation-rags") == \
+        "estimation-rags-20250101000000"
+    # 旧構成の物理インデックスなどエイリアスが無い場合は名前をそのまま使う
+    assert lk._alias_target("https://example", "key", "legacy") == "legacy"
+
+
+def test_errors_are_not_cached(monkeypatch):
+    """検索エラーはキャッシュせず、次回は再試行する"""
+    class BrokenClient(FakeSearchClient):
+        def search(self, *args, **kwargs):
+            raise RuntimeError("503")
+
+    monkeypatch.setattr(lk, "SearchClient", BrokenClient)
+    assert lk.lookup_knowledge({"message": "検索"}).startswith("Error during search")
+
+    monkeypatch.setattr(lk, "SearchClient", FakeSearchClient)
+    assert lk.lookup_knowledge({"message": "検索"}).startswith("--- Source:")
+    assert len(FakeSearchClient.calls) == 1
+
+
+def test_invalidate_on_rebuild():
+    """インデックス再構築時はキャッシュが破棄される"""
+    lk.lookup_knowledge({"message": "検索"})
+    lk.invalidate_retrieval_cache()
+    lk.lookup_knowledge({"message": "検索"})
+
+    assert len(FakeSearchClient.calls) == 2
+
+
+def test_local_backend_keys_on_corpus_fingerprint(monkeypatch):
+    """ローカルバックエンドはコーパスのフィンガープリントをバージョンとして使う"""
+    class FakeIndex:
+        fingerprint = "v1"
+        searches = 0
+
+        def search(self, query, top_k=3):
+            FakeIndex.searches += 1
+            return [{"source": "a.md", "heading_path": "", "content": query}]
+
+    index = FakeIndex()
+    monkeypatch.setenv("RAG_BACKEND", "local")
+    monkeypatch.setattr(lk, "get_local_index", lambda: index)
+
+    lk.lookup_knowledge({"message": "保守"})
+    lk.lookup_knowledge({"message": "保守"})
+    index.fingerprint = "v2"
+    lk.lookup_knowledge({"message": "保守"})
+
+    assert FakeIndex.searches == 2
@@ -0,0 +1,177 @@
+import pytest
+import sys
+import os
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+from session_store import InMemorySessionStore, RedisSessionStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class DummySession:
+    def __init__(self, session_id, value=None):
+        self.session_id = session_id
+        self.value = value
+
+    def to_dict(self):
+        return {"session_id": self.session_id, "value": self.value}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["session_id"], data["value"])
+
+
+def test_memory_store_expires_by_ttl():
+    """TTL 経過後のセッションは取得できない"""
+    clock = FakeClock()
+    store = InMemorySessionStore(ttl_seconds=10, clock=clock)
+    store.create(DummySession("a"))
+
+    clock.now = 9
+    assert store.get("a") is not None
+
+    clock.now = 10
+    assert store.get("a") is None
+    assert len(store) == 0
+
+
+def test_memory_store_purges_only_due_sessions_on_create():
+    """create 時に期限切れのセッションだけがヒープから除去される"""
+    clock = FakeClock()
+    store = InMemorySessionStore(ttl_seconds=10, clock=clock)
+    store.create(DummySession("old"))
+    clock.now = 5
+    store.create(DummySession("young"))
+
+    clock.now = 12
+    store.create(DummySession("new"))
+
+    assert "old" not in store._sessions
+    assert set(store._sessions) == {"young", "new"}
+
+
+def test_memory_store_recreated_session_ignores_stale_deadline():
+    """削除後に同じIDで再作成されたセッションは古い期限で消えない"""
+    clock = FakeClock()
+    store = InMemorySessionStore(ttl_seconds=10, clock=clock)
+    store.create(DummySession("a", 1))
+    assert store.delete("a") is True
+    clock.now = 5
+    store.create(DummySession("a", 2))
+
+    clock.now = 11
+    assert len(store) == 1
+    assert store.get("a").value == 2
+
+
+@pytest.fixture
+def redis_client():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def test_redis_store_roundtrip_and_native_ttl(redis_client):
+    """Redis バックエンドはネイティブ TTL を設定し、save で TTL を延長しない"""
+    store = RedisSessionStore(redis_client, DummySession.from_dict, ttl_seconds=100)
+    session = DummySession("s1", "before")
+    store.create(session)
+
+    key = "estimation-agent:session:s1"
+    ttl_after_create = redis_client.ttl(key)
+    assert 0 < ttl_after_create <= 100
+
+    session.value = "after"
+    store.save(session)
+    assert 0 < redis_client.ttl(key) <= ttl_after_create
+    assert store.get("s1").value == "after"
+    assert len(store) == 1
+    assert [s.session_id for s in store.sessions()] == ["s1"]
+
+    assert store.delete("s1") is True
+    assert store.get("s1") is None
+
+
+def test_redis_store_save_does_not_resurrect_expired_session(redis_client):
+    """期限切れ後の save でセッションが復活しない"""
+    store = RedisSessionStore(redis_client, DummySession.from_dict, ttl_seconds=100)
+    session = DummySession("gone")
+    store.create(session)
+    redis_client.delete("estimation-agent:session:gone")
+
+    store.save(session)
+    assert store.get("gone") is None
+
+
+def test_redis_store_caches_session_count(redis_client):
+    """セッション数は一定時間キャッシュし、スクレイプごとにキー空間を SCAN しない"""
+    now = [0.0]
+    store = RedisSessionStore(redis_client, DummySession.from_dict, count_ttl_seconds=10,
+                              clock=lambda: now[0])
+    scans = []
+    scan_iter = redis_client.scan_iter
+    redis_client.scan_iter = lambda **kwargs: scans.append(1) or scan_iter(**kwargs)
+
+    store.create(DummySession("a"))
+    assert len(store) == 1
+    store.create(DummySession("b"))
+    store.delete("a")
+    # 他のワーカーが作成したセッションは次回の SCAN まで数えない
+    redis_client.set("estimation-agent:session:other", "{}")
+    assert len(store) == 1
+    assert len(scans) == 1
+
+    now[0] = 11.0
+    assert len(store) == 2
+    assert len(scans) == 2
+
+
+class SizedSession(DummySession):
+    def __init__(self, session_id, size):
+        super().__init__(session_id)
+        self.size = size
+
+    def size_bytes(self):
+        return self.size
+
+
+def test_memory_store_evicts_least_recently_used_over_budget():
+    """メモリ予算を超えると、最も長く使われていないセッションから破棄する"""
+    store = InMemorySessionStore(ttl_seconds=100, clock=FakeClock(), max_bytes=300)
+    for session_id in ("a", "b", "c"):
+        store.create(SizedSession(session_id, 100))
+    assert store.total_bytes == 300
+
+    store.get("a")  # a を最近使用にする
+    store.create(SizedSession("d", 100))
+
+    assert set(store._sessions) == {"a", "c", "d"}
+    assert store.evicted == 1
+    assert store.total_bytes == 300
+
+
+def test_memory_store_save_reaccounts_grown_session():
+    """save でサイズを再計測し、増えた分だけ他のセッションを破棄する（保存中のセッションは残す）"""
+    store = InMemorySessionStore(ttl_seconds=100, clock=FakeClock(), max_bytes=300)
+    a, b = SizedSession("a", 100), SizedSession("b", 100)
+    store.create(a)
+    store.create(b)
+
+    a.size = 250
+    store.save(a)
+    assert set(store._sessions) == {"a"}
+    assert store.total_bytes == 250
+
+    a.size = 500
+    store.save(a)
+    assert store.get("a") is a
+
+    assert store.delete("a")
+    assert store.total_bytes == 0
@@ -0,0 +1,74 @@
+import sys
+import os
+import time
+from types import SimpleNamespace
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import app as agent_app
+import metrics
+import openai_client
+from stages import stage_timeout, stage_workers
+
+
+def test_stage_timeout_from_env(monkeypatch):
+    monkeypatch.setenv("CALC_STAGE_TIMEOUT_SECONDS", "2.5")
+    assert stage_timeout("calc", 15) == 2.5
+    assert stage_timeout("knowledge", 5) == 5
+
+
+def test_stage_pool_covers_every_request_thread(monkeypatch):
+    """ステージ用スレッド数は未設定時 2 × GUNICORN_THREADS（STAGE_WORKERS で上書き可能）"""
+    monkeypatch.delenv("STAGE_WORKERS", raising=False)
+    monkeypatch.delenv("GUNICORN_THREADS", raising=False)
+    assert stage_workers() == 32
+    monkeypatch.setenv("GUNICORN_THREADS", "24")
+    assert stage_workers() == 48
+    monkeypatch.setenv("STAGE_WORKERS", "8")
+    assert stage_workers() == 8
+
+
+def _install_llm(monkeypatch):
+    # ワーカーのウォームアップ（wsgi.warm_up）と同様に SDK を先に読み込み、計測から除外する
+    openai_client.load_sdk()
+    message = SimpleNamespace(content="# プロジェクト見積もり・提案書\n")
+    create = lambda **kwargs: SimpleNamespace(choices=[SimpleNamespace(message=message)])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(agent_app, "get_openai_client", lambda: client)
+    monkeypatch.setattr(agent_app, "render_messages", lambda *args: [{"role": "user", "content": "p"}])
+
+
+def test_calculation_turn_overlaps_lookup_and_calc(monkeypatch):
+    """計算ターンでは検索と計算を並行実行し、ステージ別の所要時間を返す"""
+    _install_llm(monkeypatch)
+    monkeypatch.setattr(agent_app, "lookup_knowledge", lambda user_input: time.sleep(0.3) or "")
+    monkeypatch.setattr(agent_app, "call_calc",
+                        lambda **kwargs: time.sleep(0.3) or '{"status": "ok", "estimated_amount": 1}')
+    client = agent_app.app.test_client()
+
+    data = client.post("/score", json={"user_input": {"selected_option": "見積もり作成"}}).get_json()
+
+    timings = data["timings"]
+    assert set(timings) == {"knowledge_ms", "calc_ms", "llm_ms", "total_ms"}
+    assert timings["knowledge_ms"] >= 290 and timings["calc_ms"] >= 290
+    assert timings["total_ms"] < 550
+    assert data["is_complete"] is True
+
+
+def test_calc_timeout_degrades_to_api_error(monkeypatch):
+    """計算ステージがタイムアウトしても応答は返し、エラーとしてLLMに渡す"""
+    _install_llm(monkeypatch)
+    captured = {}
+    monkeypatch.setattr(agent_app, "render_messages",
+                        lambda session, user_input, knowledge, calc: captured.update(calc=calc) or [])
+    monkeypatch.setattr(agent_app, "lookup_knowledge", lambda user_input: "")
+    monkeypatch.setattr(agent_app, "call_calc", lambda **kwargs: time.sleep(0.5) or "{}")
+    monkeypatch.setenv("CALC_STAGE_TIMEOUT_SECONDS", "0.1")
+    client = agent_app.app.test_client()
+
+    resp = client.post("/score", json={"user_input": {"selected_option": "見積もり作成"}})
+
+    assert resp.status_code == 200
+    assert captured["calc"] == {"error": "api_error", "details": "Calc stage failed: timeout"}
+    assert 'estimation_stage_timeouts_total{stage="calc"}' in metrics.render()
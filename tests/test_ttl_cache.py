@@ -0,0 +1,66 @@
+import pytest
+import sys
+import os
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+from ttl_cache import RedisCache, TTLCache, stable_hash
+
+
+def test_stable_hash_ignores_key_order():
+    """キー順序に依存しない安定したハッシュ"""
+    assert stable_hash({"a": 1, "b": [1, 2]}) == stable_hash({"b": [1, 2], "a": 1})
+    assert stable_hash({"a": 1}) != stable_hash({"a": 2})
+
+
+def test_ttl_cache_lru_eviction_and_expiry():
+    """容量超過で最も古いエントリを追い出し、TTL経過で失効する"""
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl_seconds=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a を最近使用に
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    now[0] = 10
+    assert cache.get("c") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["evictions"] == 1
+
+
+def test_redis_cache_roundtrip():
+    """共有ストア（Redis互換）バックエンド"""
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis(decode_responses=True)
+    cache = RedisCache(client, "test:", ttl_seconds=60)
+
+    assert cache.get("k") is None
+    cache.set("k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+    assert 0 < client.ttl("test:k") <= 60
+
+    cache.clear()
+    assert cache.get("k") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_redis_cache_errors_are_misses():
+    """Redis の障害時は例外を投げずにミスとして扱い、書き込みは読み飛ばす"""
+    class DownClient:
+        def get(self, key):
+            raise ConnectionError("redis down")
+
+        def set(self, *args, **kwargs):
+            raise ConnectionError("redis down")
+
+    cache = RedisCache(DownClient(), "test:", ttl_seconds=60)
+    cache.set("k", {"v": 1})
+    assert cache.get("k") is None
+    stats = cache.stats()
+    assert (stats["misses"], stats["errors"]) == (1, 2)
@@ -0,0 +1,92 @@
+import pytest
+import sys
+import os
+
+# プロジェクトルートをパスに追加してインポート可能にする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../estimation_agent')))
+
+import wsgi
+from wsgi import run_self_check, self_check
+
+
+@pytest.fixture
+def configured(monkeypatch):
+    """本番相当の接続設定（値はダミー）"""
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "key")
+    monkeypatch.setenv("AZURE_AI_SEARCH_ENDPOINT", "https://example.search.windows.net")
+    monkeypatch.setenv("AZURE_AI_SEARCH_API_KEY", "key")
+    monkeypatch.setenv("CALC_API_ENDPOINT", "https://calc.example.com/api/calculate_estimate")
+    monkeypatch.setenv("RAG_BACKEND", "azure")
+    monkeypatch.setenv("CALC_ENGINE", "remote")
+    monkeypatch.setenv("SESSION_STORE", "memory")
+
+
+def _by_name(checks):
+    return {check["name"]: check for check in checks}
+
+
+def test_all_checks_pass_when_configured(configured):
+    """設定が揃っていれば全チェックが成功する"""
+    checks = self_check(workers=1)
+
+    assert [c["name"] for c in checks] == ["prompt_template", "openai", "knowledge", "calc_api",
+                                            "session_store"]
+    assert all(c["ok"] for c in checks)
+
+
+def test_missing_settings_are_reported(configured, monkeypatch):
+    """未設定の接続情報を名前付きで報告する（Calc API の localhost フォールバックも不可）"""
+    monkeypatch.delenv("AZURE_OPENAI_API_KEY")
+    monkeypatch.delenv("CALC_API_ENDPOINT")
+
+    checks = _by_name(self_check())
+
+    assert not checks["openai"]["ok"]
+    assert "AZURE_OPENAI_API_KEY" in checks["openai"]["detail"]
+    assert not checks["calc_api"]["ok"]
+
+
+def test_local_backends_are_exercised(configured, monkeypatch):
+    """local バックエンドはインデックスとエンジンを実際に確認する"""
+    monkeypatch.setenv("RAG_BACKEND", "local")
+    monkeypatch.setenv("CALC_ENGINE", "parity")
+
+    checks = _by_name(self_check())
+
+    assert checks["knowledge"]["ok"] and "local index" in checks["knowledge"]["detail"]
+    assert checks["calc_engine"]["ok"]
+    assert checks["calc_api"]["ok"]
+
+
+def test_memory_store_with_multiple_workers_fails(configured):
+    """メモリ上のセッションは複数ワーカー間で共有できない"""
+    checks = _by_name(self_check(workers=4))
+
+    assert not checks["session_store"]["ok"]
+    assert "SESSION_STORE=redis" in checks["session_store"]["detail"]
+
+
+def test_strict_mode_blocks_startup(configured, monkeypatch):
+    """SELF_CHECK=strict のみ失敗時に起動を止める"""
+    monkeypatch.delenv("AZURE_OPENAI_ENDPOINT")
+
+    assert run_self_check() is True
+    monkeypatch.setenv("SELF_CHECK", "strict")
+    assert run_self_check() is False
+    monkeypatch.setenv("SELF_CHECK", "off")
+    monkeypatch.setattr(wsgi, "self_check", lambda workers=1: pytest.fail("checks should not run"))
+    assert run_self_check() is True
+
+
+def test_warm_up_imports_the_configured_sdks(configured, monkeypatch):
+    """ウォームアップで Azure OpenAI・AI Search の SDK を初回リクエスト前に読み込む"""
+    import lookup_knowledge
+
+    monkeypatch.setattr(lookup_knowledge, "SearchClient", None)
+    monkeypatch.setattr(lookup_knowledge, "AzureKeyCredential", None)
+    wsgi.warm_up()
+
+    assert "openai" in sys.modules
+    assert lookup_knowledge.SearchClient is not None
+    assert lookup_knowledge.AzureKeyCredential is not None